@@ -0,0 +1,111 @@
+# Copyright 2013 The Regents of The University California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Columnar copies of the benchmark tables.
+
+   prepare_benchmark.py --columnar copies rankings and uservisits into ORC,
+   Parquet or RCFile tables named after the format, e.g. rankings_orc, with
+   CREATE TABLE AS SELECT on each engine. run_query.py --table-variant runs
+   queries 1-3 against these copies instead; Query 4 reads documents, which
+   is never converted. Engines write with whatever they support: Hive for
+   everything Hive and Shark read, Impala for its own Parquet tables, and
+   Hive on the Impala cluster for RCFile, which Impala reads but can't
+   write.
+
+   Compression is one of "none", "snappy" or "zlib" (gzip for Parquet, the
+   same deflate algorithm), and the row group size is the ORC stripe, the
+   Parquet row group (for Impala, which writes one row group per file, the
+   file size) or the RCFile record buffer. Left unset, each engine's
+   default applies.
+"""
+
+import re
+
+FORMATS = ["orc", "parquet", "rcfile"]
+TABLES = ["rankings", "uservisits"]
+COMPRESSION = ["none", "snappy", "zlib"]
+
+# Formats of the copies each engine can read
+ENGINE_FORMATS = {
+  "shark": ["orc", "rcfile"],
+  "hive": ["orc", "parquet", "rcfile"],
+  "hive_cdh": ["orc", "parquet", "rcfile"],
+  "impala": ["parquet", "rcfile"],
+}
+
+HIVE_STORAGE = {"orc": "ORC", "parquet": "PARQUET", "rcfile": "RCFILE"}
+ORC_CODECS = {"none": "NONE", "snappy": "SNAPPY", "zlib": "ZLIB"}
+PARQUET_CODECS = {"none": "UNCOMPRESSED", "snappy": "SNAPPY", "zlib": "GZIP"}
+IMPALA_CODECS = {"none": "none", "snappy": "snappy", "zlib": "gzip"}
+HADOOP_CODECS = {"snappy": "org.apache.hadoop.io.compress.SnappyCodec",
+                 "zlib": "org.apache.hadoop.io.compress.DefaultCodec"}
+
+TABLE_NAMES = re.compile(r"\b(%s)\b" % "|".join(TABLES))
+
+def variant_table(table, variant):
+  return "%s_%s" % (table, variant)
+
+def use_variant(statement, variant):
+  """`statement` reading the `variant` copies of the benchmark tables, or
+     unchanged if `variant` is None. Names that merely start with a table's,
+     like rankings_cached, are left alone."""
+  if not variant:
+    return statement
+  return TABLE_NAMES.sub(r"\1_%s" % variant, statement)
+
+def _bytes(mb):
+  return int(mb * 1024 * 1024)
+
+def hive_statements(table, fmt, compression="snappy", row_group_mb=None):
+  """HiveQL creating the `fmt` copy of `table`, for Hive and Shark."""
+  # Settings rather than TBLPROPERTIES, whose quoted values wouldn't survive
+  # the single quotes ssh_pool wraps remote commands in
+  settings = []
+  if fmt == "orc":
+    settings.append("SET hive.exec.orc.default.compress=%s;" %
+                    ORC_CODECS[compression])
+    if row_group_mb:
+      settings.append("SET hive.exec.orc.default.stripe.size=%d;" %
+                      _bytes(row_group_mb))
+  elif fmt == "parquet":
+    settings.append("SET parquet.compression=%s;" %
+                    PARQUET_CODECS[compression])
+    if row_group_mb:
+      settings.append("SET parquet.block.size=%d;" % _bytes(row_group_mb))
+  else:
+    if compression == "none":
+      settings.append("SET hive.exec.compress.output=false;")
+    else:
+      settings += ["SET hive.exec.compress.output=true;",
+                   "SET mapred.output.compression.codec=%s;" %
+                   HADOOP_CODECS[compression]]
+    if row_group_mb:
+      settings.append("SET hive.io.rcfile.record.buffer.size=%d;" %
+                      _bytes(row_group_mb))
+  name = variant_table(table, fmt)
+  return settings + [
+    "DROP TABLE IF EXISTS %s;" % name,
+    "CREATE TABLE %s STORED AS %s AS SELECT * FROM %s;" % (
+      name, HIVE_STORAGE[fmt], table)]
+
+def impala_statements(table, compression="snappy", row_group_mb=None):
+  """Statements creating the Parquet copy of `table` on Impala."""
+  settings = ["SET PARQUET_COMPRESSION_CODEC=%s;" % IMPALA_CODECS[compression]]
+  if row_group_mb:
+    settings.append("SET PARQUET_FILE_SIZE=%d;" % _bytes(row_group_mb))
+  name = variant_table(table, "parquet")
+  return settings + [
+    "DROP TABLE IF EXISTS %s;" % name,
+    "CREATE TABLE %s STORED AS PARQUETFILE AS SELECT * FROM %s;" % (
+      name, table)]
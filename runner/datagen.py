@@ -0,0 +1,573 @@
+# Copyright 2013 The Regents of The University California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Generate the benchmark data sets locally instead of copying them from S3.
+
+   Writes rankings, uservisits and documents at any scale factor, laid out
+   like the published sets (see local_engine.py) in the tables' formats in
+   prepare_benchmark.py:
+
+     <output>/rankings/part-NNNNN      pageURL, pageRank, avgDuration
+     <output>/uservisits/part-NNNNN    sourceIP, destURL, visitDate, ...
+     <output>/crawl/part-NNNNN         HTML documents, each after a header
+
+   Rows are comma delimited text, in one of the encodings of the published
+   sets (--file-format):
+
+     text              plain text
+     text-deflate      text compressed with Hadoop's DefaultCodec, in
+                       part-NNNNN.deflate files
+     sequence          SequenceFiles of Text values and empty BytesWritable
+                       keys, as Hive writes them
+     sequence-snappy   the same, block compressed with Snappy (needs the
+                       python-snappy module)
+
+   Documents are always text, compressed or not, since the documents table
+   is a TEXTFILE table whatever the format of the others. Parts are cut to
+   --part-size MB of uncompressed rows. Deflated text can't be split, so
+   its parts are made larger by default, about a block once compressed.
+
+   Each table is cut into parts of a fixed size, and each part is generated
+   from its own random seed by one of a pool of worker processes, so the
+   output only depends on the scale factor and --seed, not on the number of
+   workers. Parts are written under a hidden name and renamed when they are
+   complete; parts that already exist are skipped, so an interrupted run
+   can be resumed. With --hdfs, parts are streamed to HDFS through
+   "hadoop fs -put" without touching the local disk.
+
+   Values are drawn to reproduce the published sets' query selectivities:
+
+     pageRank     heavy tailed, so that the catalog's cardinalities of
+                  queries 1a-1c come out within a few percent
+     sourceIP     uniform octets, as the group counts of queries 2a-2c imply
+     destURL      a page of rankings for JOIN_FRACTION of the visits, for
+                  the join of Query 3
+     visitDate    uniform from 1970 through 2009, which gives queries 3b
+                  and 3c their catalog cardinalities (3a comes out about ten
+                  times larger than the catalog's)
+
+   The other columns follow examples/files/UserVisits.dat. Dates are zero
+   padded, so that the string comparisons of Query 3 work. Documents are
+   synthetic rather than sampled from Common Crawl; their links point to
+   pages of rankings, popular ones more often, and their header lines are
+   the ones udf/url_count.py looks for.
+
+     python datagen.py -n 1 -o /mnt/bdb --workers 16
+"""
+
+import datetime
+import hashlib
+import multiprocessing
+import os
+import random
+import struct
+import subprocess
+import sys
+import time
+import zlib
+from optparse import OptionParser
+
+try:
+  import snappy
+except ImportError:
+  snappy = None
+
+# Rows of rankings and uservisits and bytes of documents per unit of scale
+# factor, and for the tiny set (scale factor 0)
+SCALE_FACTOR_SIZES = {"rankings": 18000000, "uservisits": 155000000,
+                      "documents": 29000000000}
+TINY_SIZES = {"rankings": 1200, "uservisits": 10000, "documents": 6800000}
+# Average bytes per row, to cut tables into parts of a given size
+ROW_BYTES = {"rankings": 72, "uservisits": 138, "documents": 1}
+TABLES = ["rankings", "uservisits", "documents"]
+# Directory of each table under the output directory
+TABLE_DIRS = {"rankings": "rankings", "uservisits": "uservisits",
+              "documents": "crawl"}
+
+FORMATS = ["text", "text-deflate", "sequence", "sequence-snappy"]
+# Uncompressed size of each part by default, in MB
+DEFAULT_PART_MB = {"text": 128, "text-deflate": 384, "sequence": 128,
+                   "sequence-snappy": 256}
+DEFLATE_LEVEL = 6
+
+# SequenceFile layout, as in Hadoop's SequenceFile.Writer
+SEQUENCE_VERSION = "SEQ\x06"
+KEY_CLASS = "org.apache.hadoop.io.BytesWritable"
+VALUE_CLASS = "org.apache.hadoop.io.Text"
+SNAPPY_CODEC = "org.apache.hadoop.io.compress.SnappyCodec"
+SYNC_ESCAPE = struct.pack(">i", -1)
+# Bytes between sync markers of uncompressed files
+SYNC_INTERVAL = 2000
+# Bytes of keys and values per compressed block (io.seqfile.compress.blocksize)
+COMPRESS_BLOCK_SIZE = 1000000
+# Input of each Snappy chunk; SnappyCodec's buffers are 256KB
+SNAPPY_CHUNK = 128 * 1024
+# An empty BytesWritable
+EMPTY_KEY = struct.pack(">i", 0)
+
+# Rows are buffered and written this many at a time
+BATCH_ROWS = 10000
+BUFFER_SIZE = 4 * 1024 * 1024
+
+# pageRank is drawn from a shifted Pareto distribution, except for a few
+# pages ranked 10 or below
+LOW_RANK_FRACTION = 0.00028
+RANK_ALPHA = 2.116
+RANK_SCALE = 24
+# Fraction of visits to a page that is in rankings
+JOIN_FRACTION = 0.92
+FIRST_VISIT = datetime.date(1970, 1, 1)
+LAST_VISIT = datetime.date(2009, 12, 31)
+
+# Lengths of URLs, including ".html"
+URL_LENGTHS = (16, 112)
+URL_CHARS = "abcdefghijklmnopqrstuvwxyz0123456789"
+# Page ids are scrambled into URLs by a bijection of [0, 2^40)
+URL_ID_BITS = 40
+URL_SCRAMBLE = 0x9e3779b97f
+URL_TEXT_SIZE = 1 << 16
+
+# Vocabularies of uservisits, from examples/files/UserVisits.dat. Mozilla/4.0
+# is several times as common as any other user agent there.
+USER_AGENTS = ["Mozilla/4.0"] * 6 + [
+  "GSiteCrawler/v1.xx rev. xxx", "IconSurf/2.0 favicon monitor",
+  "IlTrovatore/1.2", "Infoseek SideWinder/2.0B", "Java1.1.xx.",
+  "JobSpider_BA/1.", "Journster.com RSS/Atom aggregator 0.5",
+  "LECodeChecker/3.0 libgetdoc/1.", "LeechGet 200x", "LinkProver 2.",
+  "MSNBOT_Mobile MSMOBOT Mozilla/2.0", "Metaeuro Web Crawler/0.2",
+  "Mozilla/2.0", "Mozilla/3.0", "Mozilla/3.01",
+  "Mozilla/4.0 compatible ZyBorg/1.0", "Mozilla/4.01 [en]",
+  "Mozilla/4.5 [en]C-CCK-MCD {TLC;RETAIL}", "NP/0.1", "NuSearch Spider",
+  "Opera/5.0", "Orca Browser", "Overture-WebCrawler/3.8/Fresh", "PHP/4.0.",
+  "Piffany_Web_Scraper_v0.", "PrivacyFinder/1.", "RRC", "Scrubby/3.0",
+  "Search/1.0", "Snapbot/1.", "Superdownloads Spiderma",
+  "UKWizz/Nutch-0.8.1", "W3C-WebCon/5.x.x libwww/5.x.", "WWW-Mechanize/1.1",
+  "WWWeasel Robot v1.00",
+  "Waypath development crawler - info at waypath dot co",
+  "WebSearch.COM.AU/3.0.1", "WinkBot/0.06", "Wotbox/alpha0.6", "larbin",
+  "mammoth/1.0", "moget/x.x", "obidos-bot", "scooter-venus-3.0.vn",
+  "sogou develop spide", "webbandit/4.xx.", "webmeasurement-bot"]
+COUNTRY_CODES = [
+  "ABW", "ARE", "AUS", "AUT", "BEN", "BMU", "BRA", "BTN", "DEU", "FIN",
+  "FLK", "GAB", "GLP", "GTM", "GUF", "HKG", "HND", "HUN", "IDN", "IRL",
+  "IRN", "ISR", "ITA", "LSO", "LUX", "MCO", "MNG", "MNP", "NIC", "NLD",
+  "PHL", "RWA", "SAU", "SCG", "SLB", "SVN", "SWE", "SYR", "TCA", "TGO",
+  "THA", "UGA", "UMI", "USA", "UZB", "WSM", "ZAF", "ZWE"]
+SEARCH_WORDS = [
+  "FUNCTION", "Galaxy:", "Herbig-Haro", "Kuiper", "MHD", "Scuti",
+  "acceleration", "angular", "apj@as.arizona.edu.", "are", "bands", "blue",
+  "bubbles", "bursts", "cataclysmic", "catalogs", "circumstellar",
+  "conduction", "cosmology:", "data", "diffuse", "dust", "dynamics",
+  "history", "horizontal-branch", "important", "instruments",
+  "interferometric", "kinematics", "late-type", "masses", "medium",
+  "nebulae", "nonthermal", "observations", "outflows", "photometric",
+  "pulsars:", "radio", "rays", "region", "remnants", "spiral", "spots",
+  "stars", "state", "supergiants", "supernovae:", "system", "systems",
+  "testing", "time"]
+LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+# Links from a document favor popular pages: the page is drawn as
+# pages * U^LINK_SKEW for U uniform in [0, 1)
+LINK_SKEW = 3
+LINKS_PER_PARAGRAPH = (0, 3)
+WORDS_PER_PARAGRAPH = (10, 40)
+PARAGRAPHS_PER_DOCUMENT = (5, 40)
+
+def _seed(*parts):
+  return int(hashlib.md5(":".join(str(p) for p in parts)).hexdigest(), 16)
+
+def table_size(table, scale_factor):
+  """Rows (or bytes, for documents) of a table at a scale factor."""
+  if scale_factor == 0:
+    return TINY_SIZES[table]
+  return int(SCALE_FACTOR_SIZES[table] * scale_factor)
+
+# (index, first row or byte, size) of each part of a table
+def parts(table, scale_factor, part_mb):
+  size = table_size(table, scale_factor)
+  part_size = max(int(part_mb * 1024 * 1024) // ROW_BYTES[table], 1)
+  return [(i, start, min(part_size, size - start))
+          for i, start in enumerate(range(0, size, part_size))]
+
+def table_format(table, file_format):
+  """Format `table` is written in when the data set is in `file_format`."""
+  if table == "documents" and not file_format.startswith("text"):
+    return "text"
+  return file_format
+
+def part_name(index, file_format="text"):
+  name = "part-%05d" % index
+  if file_format == "text-deflate":
+    return name + ".deflate"
+  return name
+
+class Urls(object):
+  """The URL of every page, a function of its id and the seed. URLs start
+     with the page id scrambled and written in base 36, so they are unique,
+     followed by random characters."""
+
+  def __init__(self, seed):
+    rand = random.Random(_seed(seed, "urls"))
+    self.mask = (1 << URL_ID_BITS) - 1
+    self.salt = rand.getrandbits(URL_ID_BITS)
+    self.text = "".join(rand.choice(URL_CHARS)
+                        for _ in xrange(URL_TEXT_SIZE))
+
+  def url(self, page_id):
+    x = ((page_id ^ self.salt) * URL_SCRAMBLE) & self.mask
+    key = ""
+    for _ in range(8):
+      x, digit = divmod(x, len(URL_CHARS))
+      key += URL_CHARS[digit]
+    lo, hi = URL_LENGTHS
+    h = (page_id * 2654435761) & 0xffffffff
+    length = lo + h % (hi - lo + 1) - len(key) - len(".html")
+    start = h % (URL_TEXT_SIZE - hi)
+    return key + self.text[start:start + length] + ".html"
+
+def _page_rank(rand):
+  if rand.random() < LOW_RANK_FRACTION:
+    return rand.randint(1, 10)
+  return 11 + int(RANK_SCALE * (rand.paretovariate(RANK_ALPHA) - 1))
+
+def _rankings(rand, urls, start, size, pages):
+  for page_id in xrange(start, start + size):
+    yield "%s,%d,%d\n" % (urls.url(page_id), _page_rank(rand),
+                          rand.randint(1, 100))
+
+def _visit_dates():
+  first = FIRST_VISIT.toordinal()
+  return [datetime.date.fromordinal(day).isoformat()
+          for day in range(first, LAST_VISIT.toordinal() + 1)]
+
+def _uservisits(rand, urls, start, size, pages):
+  r = rand.random
+  dates = _visit_dates()
+  destinations = int(pages / JOIN_FRACTION)
+  for _ in xrange(size):
+    country = COUNTRY_CODES[int(r() * len(COUNTRY_CODES))]
+    yield "%d.%d.%d.%d,%s,%s,%.12g,%s,%s,%s-%s%s,%s,%d\n" % (
+      r() * 256, r() * 256, r() * 256, r() * 256,
+      urls.url(int(r() * destinations)),
+      dates[int(r() * len(dates))],
+      1 + r() * 499,
+      USER_AGENTS[int(r() * len(USER_AGENTS))],
+      country, country, LETTERS[int(r() * 26)], LETTERS[int(r() * 26)],
+      SEARCH_WORDS[int(r() * len(SEARCH_WORDS))],
+      1 + r() * 9)
+
+def _paragraph(rand, urls, pages):
+  words = [rand.choice(SEARCH_WORDS)
+           for _ in range(rand.randint(*WORDS_PER_PARAGRAPH))]
+  for _ in range(rand.randint(*LINKS_PER_PARAGRAPH)):
+    page_id = int(pages * rand.random() ** LINK_SKEW)
+    i = rand.randrange(len(words))
+    words[i] = "<a href=\"http://%s\">%s</a>" % (urls.url(page_id), words[i])
+  return "<p>%s</p>\n" % " ".join(words)
+
+# Documents, each after a header line of the form Common Crawl's ARC files
+# use, until `size` bytes have been written
+def _documents(rand, urls, start, size, pages):
+  written = 0
+  while written < size:
+    title = " ".join(rand.choice(SEARCH_WORDS) for _ in range(3))
+    body = "<html><head><title>%s</title></head><body>\n%s</body></html>\n" % (
+      title, "".join(_paragraph(rand, urls, pages) for _ in
+                     range(rand.randint(*PARAGRAPHS_PER_DOCUMENT))))
+    day = FIRST_VISIT + datetime.timedelta(rand.randrange(
+      (LAST_VISIT - FIRST_VISIT).days))
+    header = "http://%s %d.%d.%d.%d %s%02d%02d%02d text/html %d\n" % (
+      urls.url(rand.randrange(pages)), rand.randrange(256),
+      rand.randrange(256), rand.randrange(256), rand.randrange(256),
+      day.strftime("%Y%m%d"), rand.randrange(24), rand.randrange(60),
+      rand.randrange(60), len(body))
+    written += len(header) + len(body)
+    yield header + body
+
+GENERATORS = {"rankings": _rankings, "uservisits": _uservisits,
+              "documents": _documents}
+
+# State of each worker process, set up once by _init_worker
+_URLS = None
+
+def _init_worker(seed):
+  global _URLS
+  _URLS = Urls(seed)
+
+class _Writer(object):
+  """Writes a part under a hidden name, locally or to HDFS, and gives it its
+     real name once it is complete."""
+
+  def __init__(self, directory, name, hdfs):
+    self.path = "%s/%s" % (directory, name)
+    self.tmp_path = "%s/_%s.tmp" % (directory, name)
+    self.hdfs = hdfs
+    self.written = 0
+    if hdfs:
+      self.proc = subprocess.Popen(
+        ["hadoop", "fs", "-put", "-", self.tmp_path],
+        stdin=subprocess.PIPE, bufsize=BUFFER_SIZE)
+      self.out = self.proc.stdin
+    else:
+      self.out = open(self.tmp_path, "wb", BUFFER_SIZE)
+
+  def write(self, data):
+    self.out.write(data)
+    self.written += len(data)
+
+  def commit(self):
+    self.out.close()
+    if not self.hdfs:
+      os.rename(self.tmp_path, self.path)
+      return
+    if self.proc.wait() != 0:
+      raise IOError("Failed to write %s to HDFS" % self.tmp_path)
+    subprocess.check_call(["hadoop", "fs", "-mv", self.tmp_path, self.path])
+
+# Hadoop's variable length integers, as WritableUtils.writeVLong writes them
+def _vint(n):
+  if -112 <= n <= 127:
+    return chr(n & 0xff)
+  prefix = -112
+  if n < 0:
+    n ^= -1
+    prefix = -120
+  data = ""
+  while n:
+    data = chr(n & 0xff) + data
+    n >>= 8
+  return chr((prefix - len(data)) & 0xff) + data
+
+def _text(s):
+  return _vint(len(s)) + s
+
+# A buffer compressed as SnappyCodec's BlockCompressorStream does: its length,
+# then chunks, each preceded by its compressed length
+def _snappy_block(data):
+  out = [struct.pack(">i", len(data))]
+  for i in range(0, len(data), SNAPPY_CHUNK):
+    chunk = snappy.compress(data[i:i + SNAPPY_CHUNK])
+    out += [struct.pack(">i", len(chunk)), chunk]
+  return "".join(out)
+
+class _TextFile(object):
+  """Rows as lines of text, optionally deflated into one zlib stream, which
+     is what Hadoop's DefaultCodec reads."""
+
+  def __init__(self, writer, deflate=False):
+    self.writer = writer
+    self.deflater = deflate and zlib.compressobj(DEFLATE_LEVEL) or None
+
+  # Returns the number of uncompressed bytes written
+  def write(self, rows):
+    data = "".join(rows)
+    if self.deflater:
+      self.writer.write(self.deflater.compress(data))
+    else:
+      self.writer.write(data)
+    return len(data)
+
+  def close(self):
+    if self.deflater:
+      self.writer.write(self.deflater.flush())
+
+class _SequenceFile(object):
+  """Rows, without their newlines, as the Text values of a SequenceFile with
+     empty keys. Block compressed files hold the keys, values and their
+     lengths of about COMPRESS_BLOCK_SIZE bytes of rows in each block."""
+
+  def __init__(self, writer, sync, compress=False):
+    self.writer = writer
+    self.sync = sync
+    self.compress = compress
+    self.since_sync = 0
+    self.values = []
+    self.buffered = 0
+    header = [SEQUENCE_VERSION, _text(KEY_CLASS), _text(VALUE_CLASS),
+              chr(compress), chr(compress)]
+    if compress:
+      header.append(_text(SNAPPY_CODEC))
+    header += [struct.pack(">i", 0), sync]
+    writer.write("".join(header))
+
+  def write(self, rows):
+    raw = 0
+    records = []
+    for row in rows:
+      value = _text(row[:-1])
+      raw += len(row)
+      if self.compress:
+        self.values.append(value)
+        self.buffered += len(EMPTY_KEY) + len(value)
+        if self.buffered >= COMPRESS_BLOCK_SIZE:
+          self._write_block()
+        continue
+      if self.since_sync >= SYNC_INTERVAL:
+        records += [SYNC_ESCAPE, self.sync]
+        self.since_sync = 0
+      record = struct.pack(">ii", len(EMPTY_KEY) + len(value),
+                           len(EMPTY_KEY)) + EMPTY_KEY + value
+      records.append(record)
+      self.since_sync += len(record)
+    if records:
+      self.writer.write("".join(records))
+    return raw
+
+  def _write_block(self):
+    n = len(self.values)
+    block = [SYNC_ESCAPE, self.sync, _vint(n)]
+    for data in [_vint(len(EMPTY_KEY)) * n, EMPTY_KEY * n,
+                 "".join(_vint(len(v)) for v in self.values),
+                 "".join(self.values)]:
+      compressed = _snappy_block(data)
+      block += [_vint(len(compressed)), compressed]
+    self.writer.write("".join(block))
+    self.values = []
+    self.buffered = 0
+
+  def close(self):
+    if self.values:
+      self._write_block()
+
+def _open_format(writer, file_format, sync):
+  if file_format == "text":
+    return _TextFile(writer)
+  if file_format == "text-deflate":
+    return _TextFile(writer, deflate=True)
+  return _SequenceFile(writer, sync, file_format == "sequence-snappy")
+
+def _write_part(task):
+  table, (index, start, size), directory, file_format, seed, pages, hdfs = \
+    task
+  t0 = time.time()
+  rand = random.Random(_seed(seed, table, index))
+  writer = _Writer(directory, part_name(index, file_format), hdfs)
+  sync = hashlib.md5("%s:%s:%s:sync" % (seed, table, index)).digest()
+  out = _open_format(writer, file_format, sync)
+  raw = 0
+  batch = []
+  for row in GENERATORS[table](rand, _URLS, start, size, pages):
+    batch.append(row)
+    if len(batch) == BATCH_ROWS:
+      raw += out.write(batch)
+      batch = []
+  raw += out.write(batch)
+  out.close()
+  writer.commit()
+  return table, index, raw, writer.written, time.time() - t0
+
+# Names of the files in a directory, creating it if it doesn't exist
+def _existing(directory, hdfs):
+  if not hdfs:
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    return set(os.listdir(directory))
+  # Hadoop 1 creates parents by default and doesn't know -p
+  if subprocess.call(["hadoop", "fs", "-mkdir", "-p", directory]) != 0:
+    subprocess.call(["hadoop", "fs", "-mkdir", directory])
+  listing = subprocess.Popen(["hadoop", "fs", "-ls", directory],
+                             stdout=subprocess.PIPE).communicate()[0]
+  return set(line.split()[-1].rsplit("/", 1)[-1]
+             for line in listing.splitlines() if line.startswith(("-", "d")))
+
+def generate(output, scale_factor, tables=TABLES, file_format="text",
+             part_mb=None, seed=0, workers=None, hdfs=False, overwrite=False,
+             out=sys.stderr):
+  """Generate `tables` under `output`. Returns the number of bytes
+     written."""
+  if file_format == "sequence-snappy" and snappy is None:
+    raise ImportError("sequence-snappy needs the python-snappy module")
+  part_mb = part_mb or DEFAULT_PART_MB[file_format]
+  pages = table_size("rankings", scale_factor)
+  tasks = []
+  for table in tables:
+    directory = "%s/%s" % (output.rstrip("/"), TABLE_DIRS[table])
+    existing = _existing(directory, hdfs)
+    fmt = table_format(table, file_format)
+    for part in parts(table, scale_factor, part_mb):
+      if not overwrite and part_name(part[0], fmt) in existing:
+        continue
+      tasks.append((table, part, directory, fmt, seed, pages, hdfs))
+  if not tasks:
+    print >> out, "All parts already exist in %s" % output
+    return 0
+
+  t0 = time.time()
+  total = total_raw = 0
+  pool = multiprocessing.Pool(workers or multiprocessing.cpu_count(),
+                              _init_worker, [seed])
+  try:
+    for table, index, raw, written, took in pool.imap_unordered(_write_part,
+                                                                tasks):
+      total += written
+      total_raw += raw
+      print >> out, "Wrote %s/%s (%.1f MB of %.1f MB of rows) in %.1fs" % (
+        TABLE_DIRS[table], part_name(index, table_format(table, file_format)),
+        written / 1e6, raw / 1e6, took)
+    pool.close()
+  finally:
+    pool.terminate()
+    pool.join()
+  took = time.time() - t0
+  print >> out, "Wrote %d part(s), %.1f MB of %.1f MB of rows in %.1fs " \
+    "(%.1f MB/s of rows)" % (len(tasks), total / 1e6, total_raw / 1e6, took,
+                             total_raw / 1e6 / max(took, 1e-9))
+  return total
+
+def parse_args():
+  parser = OptionParser(usage="datagen.py [options]")
+  parser.add_option("-n", "--scale-factor", type="float", default=1,
+      help="Size of the data set in nodes' worth, as on S3 (0 for tiny)")
+  parser.add_option("-o", "--output",
+      help="Directory to write the rankings, uservisits and crawl data to")
+  parser.add_option("--hdfs", action="store_true", default=False,
+      help="Write to this directory on HDFS rather than the local disk")
+  parser.add_option("-t", "--tables", default=",".join(TABLES),
+      help="Comma separated tables to generate (default: all)")
+  parser.add_option("-f", "--file-format", default="text",
+      help="Format to write (text, text-deflate, sequence, or "
+           "sequence-snappy)")
+  parser.add_option("--part-size", type="float",
+      help="MB of rows in each file (default: 128, 384 for text-deflate, "
+           "256 for sequence-snappy)")
+  parser.add_option("--seed", type="int", default=0,
+      help="Seed of the data set; the same seed gives the same data")
+  parser.add_option("--workers", type="int",
+      help="Number of worker processes (default: one per core)")
+  parser.add_option("--overwrite", action="store_true", default=False,
+      help="Regenerate parts that already exist")
+  (opts, args) = parser.parse_args()
+  if not opts.output or opts.scale_factor < 0:
+    parser.print_help()
+    sys.exit(1)
+  opts.tables = opts.tables.split(",")
+  unknown = [t for t in opts.tables if t not in TABLES]
+  if unknown:
+    print >> sys.stderr, "Unknown table(s): %s" % ", ".join(unknown)
+    sys.exit(1)
+  if opts.file_format not in FORMATS:
+    print >> sys.stderr, "Unknown file format: %s" % opts.file_format
+    sys.exit(1)
+  if opts.file_format == "sequence-snappy" and snappy is None:
+    print >> sys.stderr, "sequence-snappy needs the python-snappy module"
+    sys.exit(1)
+  return opts
+
+def main():
+  opts = parse_args()
+  generate(opts.output, opts.scale_factor, opts.tables, opts.file_format,
+           opts.part_size, opts.seed, opts.workers, opts.hdfs, opts.overwrite)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,103 @@
+# Copyright 2013 The Regents of The University California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run a per-host operation on many hosts concurrently.
+
+   Clearing buffer caches, copying UDFs and killing stray processes used
+   to walk the host list one ssh at a time. fan_out() runs them with a
+   bounded number of threads and only returns once every host has
+   finished, so callers can use it as a barrier before starting a timed
+   trial.
+"""
+
+import sys
+import threading
+import time
+import traceback
+from Queue import Queue, Empty
+
+# Maximum number of hosts contacted at once, unless overridden
+DEFAULT_PARALLELISM = 32
+
+class HostResult(object):
+  def __init__(self, host):
+    self.host = host
+    self.value = None
+    self.error = None
+    self.traceback = None
+    self.elapsed = 0.0
+
+  def ok(self):
+    return self.error is None
+
+  def __repr__(self):
+    if self.ok():
+      return "%s: %.2fs" % (self.host, self.elapsed)
+    return "%s: FAILED after %.2fs (%s)" % (self.host, self.elapsed, self.error)
+
+class FanOutError(Exception):
+  """Raised when an operation failed on one or more hosts."""
+
+  def __init__(self, failures):
+    self.failures = failures
+    Exception.__init__(self, "Failed on %d host(s):\n%s" % (
+      len(failures), "\n".join(map(repr, failures))))
+
+def fan_out(func, hosts, parallelism=DEFAULT_PARALLELISM,
+            raise_on_error=True):
+  """Call func(host) for every host using at most `parallelism` threads.
+
+     Returns a list of HostResult in the same order as `hosts` once every
+     call has returned. If any call raised and `raise_on_error` is set, a
+     FanOutError listing every failed host is raised instead.
+  """
+  results = [HostResult(h) for h in hosts]
+  pending = Queue()
+  for r in results:
+    pending.put(r)
+
+  def worker():
+    while True:
+      try:
+        r = pending.get_nowait()
+      except Empty:
+        return
+      t0 = time.time()
+      try:
+        r.value = func(r.host)
+      except Exception as e:
+        r.error = e
+        r.traceback = traceback.format_exc()
+      r.elapsed = time.time() - t0
+
+  threads = [threading.Thread(target=worker)
+             for i in xrange(max(1, min(parallelism, len(results))))]
+  for t in threads:
+    t.daemon = True
+    t.start()
+  for t in threads:
+    t.join()
+
+  failures = [r for r in results if not r.ok()]
+  if failures and raise_on_error:
+    raise FanOutError(failures)
+  return results
+
+def summarize(label, results, out=sys.stderr):
+  """Print how long the slowest and fastest hosts took for an operation."""
+  if not results:
+    return
+  times = sorted(r.elapsed for r in results)
+  print >> out, "%s on %d host(s): fastest %.2fs, slowest %.2fs" % (
+    label, len(results), times[0], times[-1])
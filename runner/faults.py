@@ -0,0 +1,114 @@
+# Copyright 2013 The Regents of The University California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Kill a worker process on one slave partway through each trial.
+
+   The runner starts a FaultInjector with the slaves of the cluster under
+   test and arms it when a trial starts. If the trial is
+   still running `delay` seconds later, the injector kills every process
+   named `process` (the main class of a JVM worker, or a program name) on
+   one randomly chosen slave, and optionally runs `restore` there once the
+   trial is over, e.g. to restart a daemon the engine can't do without.
+   What was killed, where and when is kept per trial for the results store.
+"""
+
+import random
+import threading
+import time
+
+import ssh_pool
+
+# Worker killed on each engine unless told otherwise. On MR1 (CDH) this is
+# the per-task child JVM, not the TaskTracker, which nothing would restart.
+DEFAULT_PROCESS = {
+  "shark": "ExecutorBackend",
+  "hive": "YarnChild",
+  "hive_cdh": "org.apache.hadoop.mapred.Child",
+  "impala": "impalad"
+}
+
+# Kill every process whose command line contains `process` (a JVM's main
+# class or a program name) and print their pids. The first character is
+# bracketed so the pattern doesn't match the shell running it. May not
+# contain single quotes, since it is run through ssh.
+def kill_command(process):
+  return "pids=$(pgrep -f \"[%s]%s\"); " \
+         "[ -n \"$pids\" ] && sudo kill -9 $pids; echo $pids" % (
+           process[0], process[1:])
+
+class FaultInjector(object):
+  def __init__(self, delay, process, restore=None, seed=0):
+    self.delay = delay
+    self.process = process
+    self.restore = restore
+    self.rand = random.Random(seed)
+    self.lock = threading.Lock()
+    self.hosts = []
+    self.username = None
+    self.identity_file = None
+    self.timer = None
+    self.armed = None
+    self.faults = {}
+
+  # Choose workers to kill among `hosts` from now on
+  def start(self, hosts, username, identity_file):
+    self.hosts = hosts
+    self.username = username
+    self.identity_file = identity_file
+
+  def stop(self):
+    self.disarm()
+
+  def arm(self, key):
+    """Start the countdown to killing a worker during trial `key`."""
+    self.disarm()
+    with self.lock:
+      self.armed = key
+      self.faults[key] = {"injected": False, "process": self.process,
+                          "delay": self.delay, "armed_at": time.time()}
+      self.timer = threading.Timer(self.delay, self._inject, [key])
+      self.timer.daemon = True
+      self.timer.start()
+
+  def _inject(self, key):
+    with self.lock:
+      if self.armed != key:
+        return
+      host = self.rand.choice(self.hosts)
+      fault = self.faults[key]
+    proc = ssh_pool.POOL.popen(host, self.username, self.identity_file,
+                               kill_command(self.process))
+    proc.stdin.close()
+    pids = proc.stdout.read().split()
+    proc.wait()
+    fault.update({"injected": True, "host": host, "at": time.time(),
+                  "pids": pids, "killed": bool(pids)})
+
+  def disarm(self):
+    """End the trial armed last, restoring the slave if a worker died."""
+    with self.lock:
+      timer, key = self.timer, self.armed
+      self.timer = self.armed = None
+    if timer is None:
+      return
+    timer.cancel()
+    timer.join()
+    fault = self.faults[key]
+    if fault.get("killed") and self.restore:
+      ssh_pool.ssh(fault["host"], self.username, self.identity_file,
+                   self.restore)
+
+  def trial_fault(self, key):
+    """What was injected during trial `key`, or None if it wasn't armed."""
+    return self.faults.get(key)
@@ -0,0 +1,298 @@
+# Copyright 2013 The Regents of The University California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run the benchmark queries on local files, without a cluster.
+
+   LocalEngine executes every query of the catalog (see queries.py) over a
+   directory laid out like the benchmark data sets on S3 and HDFS:
+
+     <data dir>/rankings/*      pageURL, pageRank, avgDuration
+     <data dir>/uservisits/*    sourceIP, destURL, visitDate, adRevenue, ...
+     <data dir>/crawl/*         documents, one line of text per row
+
+   Fields may be delimited by commas, ^A or '|'. Only plain text is read,
+   not the compressed or SequenceFile outputs of datagen.py. Input files are
+   cut into splits like Hadoop's, and each split is scanned and partially
+   aggregated by one of a pool of worker processes; the partial results are
+   merged as they arrive. Query 3 joins against rankings, which is loaded
+   once before the workers are forked so they all share it. Comparisons
+   follow the HQL the other engines run, e.g. visitDate is compared as a
+   string.
+
+   It gives a laptop-scale baseline for run_query.py --local and the
+   reference answers engines can be checked against. Run as a script, it
+   prints the result of a query:
+
+     python local_engine.py --data /mnt/bdb -q 2a > 2a.tsv
+"""
+
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+from optparse import OptionParser
+
+from queries import QUERY_INFO, expand
+
+# Directory of each table under the data directory
+TABLE_DIRS = {"rankings": "rankings", "uservisits": "uservisits",
+              "documents": "crawl"}
+# Number of columns of each delimited table
+COLUMNS = {"rankings": 3, "uservisits": 9}
+DELIMITERS = [",", "\x01", "|"]
+
+SPLIT_SIZE = 64 * 1024 * 1024
+
+# Extensions of Hadoop's compression codecs, and the magic of SequenceFiles
+COMPRESSED = (".deflate", ".gz", ".bz2", ".snappy", ".lzo")
+SEQUENCE_FILE_MAGIC = "SEQ"
+
+# URLs counted by Query 4, as in udf/url_count.py
+URL = re.compile(r"https?://[^\s]+")
+
+# Rankings loaded by the parent for Query 3, inherited by the workers forked
+# while the lock is held
+_PAGE_RANKS = None
+_FORK_LOCK = threading.Lock()
+
+# Lines of the part of `path` from byte `start` to `end`. A line belongs to
+# the split it starts in, so every line is read by exactly one split.
+def _lines(path, start, end):
+  f = open(path, "rb")
+  try:
+    if start:
+      f.seek(start - 1)
+      f.readline()
+    pos = f.tell()
+    while pos < end:
+      line = f.readline()
+      if not line:
+        break
+      pos += len(line)
+      yield line.rstrip("\r\n")
+  finally:
+    f.close()
+
+# Rows of a delimited table, with the delimiter guessed from the first line
+def _rows(table, path, start, end):
+  delimiter = None
+  for line in _lines(path, start, end):
+    if delimiter is None:
+      matching = [d for d in DELIMITERS
+                  if len(line.split(d)) == COLUMNS[table]]
+      delimiter = matching and matching[0] or DELIMITERS[0]
+    yield line.split(delimiter)
+
+def _load_page_ranks(splits):
+  ranks = {}
+  for split in splits:
+    for row in _rows("rankings", *split):
+      ranks[row[0]] = int(row[1])
+  return ranks
+
+# Per-split work of each query family, run in the worker processes
+
+def _scan_1(task):
+  split, threshold = task
+  return [(row[0], int(row[1])) for row in _rows("rankings", *split)
+          if int(row[1]) > threshold]
+
+def _scan_2(task):
+  split, length = task
+  revenue = {}
+  for row in _rows("uservisits", *split):
+    key = row[0][:length]
+    revenue[key] = revenue.get(key, 0.0) + float(row[3])
+  return revenue
+
+def _scan_3(task):
+  split, end = task
+  groups = {}
+  for row in _rows("uservisits", *split):
+    if not "1980-01-01" < row[2] < end:
+      continue
+    rank = _PAGE_RANKS.get(row[1])
+    if rank is None:
+      continue
+    group = groups.get(row[0])
+    if group is None:
+      group = groups[row[0]] = [0.0, 0, 0]
+    group[0] += float(row[3])
+    group[1] += rank
+    group[2] += 1
+  return groups
+
+def _scan_4(task):
+  split, _ = task
+  counts = {}
+  for line in _lines(*split):
+    for url in URL.findall(line):
+      counts[url] = counts.get(url, 0) + 1
+  return counts
+
+def _merge_sums(total, partial):
+  for key, value in partial.iteritems():
+    total[key] = total.get(key, 0) + value
+
+def _merge_groups(total, partial):
+  for key, (revenue, ranks, count) in partial.iteritems():
+    group = total.get(key)
+    if group is None:
+      total[key] = [revenue, ranks, count]
+    else:
+      group[0] += revenue
+      group[1] += ranks
+      group[2] += count
+
+class LocalEngine(object):
+  def __init__(self, data_dir, workers=None, split_size=SPLIT_SIZE):
+    self.data_dir = data_dir
+    self.workers = workers or multiprocessing.cpu_count()
+    self.split_size = split_size
+
+  def files(self, table):
+    """Data files of `table`, skipping Hadoop's _SUCCESS and hidden files.
+       Raises IOError if one isn't plain text."""
+    table_dir = os.path.join(self.data_dir, TABLE_DIRS[table])
+    if not os.path.isdir(table_dir):
+      raise IOError("No data for %s in %s" % (table, table_dir))
+    files = [os.path.join(table_dir, name)
+             for name in sorted(os.listdir(table_dir))
+             if not name.startswith(("_", "."))]
+    for path in files:
+      f = open(path, "rb")
+      try:
+        magic = f.read(len(SEQUENCE_FILE_MAGIC))
+      finally:
+        f.close()
+      if path.endswith(COMPRESSED) or magic == SEQUENCE_FILE_MAGIC:
+        raise IOError("%s isn't plain text; the local engine only reads "
+                      "uncompressed text, e.g. from datagen.py -f text" % path)
+    return files
+
+  # (path, start, end) of each split of `table`
+  def splits(self, table):
+    splits = []
+    for path in self.files(table):
+      size = os.path.getsize(path)
+      for start in range(0, max(size, 1), self.split_size):
+        splits.append((path, start, min(start + self.split_size, size)))
+    return splits
+
+  def explain(self, query_num):
+    """Describe how a query is executed, in the manner of EXPLAIN."""
+    family, value, _ = QUERY_INFO[query_num]
+    if family == '1':
+      return ["Filter pageRank > %s" % value,
+              "  Parallel scan rankings"]
+    if family == '2':
+      return ["Merge partial SUM(adRevenue)",
+              "  Partial aggregate by SUBSTR(sourceIP, 1, %s)" % value,
+              "    Parallel scan uservisits"]
+    if family == '3':
+      return ["Top 1 by SUM(adRevenue)",
+              "  Merge partial SUM(adRevenue), AVG(pageRank)",
+              "    Partial aggregate by sourceIP",
+              "      Hash join on destURL = pageURL",
+              "        Load rankings",
+              "        Filter \"1980-01-01\" < visitDate < \"%s\"" % value,
+              "          Parallel scan uservisits"]
+    return ["Merge partial COUNT(*) by URL",
+            "  Extract URLs",
+            "    Parallel scan documents"]
+
+  def execute(self, query_num, timeout=None):
+    """Return the rows of the result table of a query, in no particular
+       order (except for Query 3, which has a single row). Raises
+       multiprocessing.TimeoutError if it takes more than `timeout`
+       seconds."""
+    global _PAGE_RANKS
+    family, value, _ = QUERY_INFO[query_num]
+    deadline = timeout and time.time() + timeout
+    page_ranks = None
+    if family == '1':
+      scan, table, total, merge = _scan_1, "rankings", [], list.extend
+    elif family == '2':
+      scan, table, total, merge = _scan_2, "uservisits", {}, _merge_sums
+    elif family == '3':
+      scan, table, total, merge = _scan_3, "uservisits", {}, _merge_groups
+      page_ranks = _load_page_ranks(self.splits("rankings"))
+    else:
+      scan, table, total, merge = _scan_4, "documents", {}, _merge_sums
+
+    tasks = [(split, value) for split in self.splits(table)]
+    # Concurrent queries (throughput streams) each fork their own pool
+    with _FORK_LOCK:
+      _PAGE_RANKS = page_ranks
+      pool = multiprocessing.Pool(self.workers)
+      _PAGE_RANKS = None
+    try:
+      partials = pool.imap_unordered(scan, tasks)
+      for _ in tasks:
+        # Waiting without a timeout couldn't be interrupted by Ctrl-C
+        remaining = 1e9
+        if deadline:
+          remaining = max(deadline - time.time(), 0)
+        merge(total, partials.next(remaining))
+      pool.close()
+    finally:
+      pool.terminate()
+      pool.join()
+
+    if family == '1':
+      return total
+    if family == '2':
+      return total.items()
+    if family == '3':
+      if not total:
+        return []
+      ip, (revenue, ranks, count) = max(total.iteritems(),
+                                        key=lambda g: g[1][0])
+      return [(ip, revenue, float(ranks) / count)]
+    return [(visits, url) for url, visits in total.iteritems()]
+
+def parse_args():
+  parser = OptionParser(usage="local_engine.py [options]")
+  parser.add_option("--data",
+      help="Directory holding the rankings, uservisits and crawl data")
+  parser.add_option("-q", "--query-num", default="1a",
+      help="Query to run, e.g. 2a or 1@5000")
+  parser.add_option("--workers", type="int",
+      help="Number of worker processes (default: one per core)")
+  (opts, args) = parser.parse_args()
+  if not opts.data:
+    parser.print_help()
+    sys.exit(1)
+  try:
+    opts.query_nums = expand(opts.query_num)
+  except ValueError as e:
+    print >> sys.stderr, e
+    sys.exit(1)
+  return opts
+
+def main():
+  opts = parse_args()
+  engine = LocalEngine(opts.data, opts.workers)
+  for query_num in opts.query_nums:
+    t0 = time.time()
+    rows = engine.execute(query_num)
+    print >> sys.stderr, "Query %s: %d row(s) in %.3fs" % (
+      query_num, len(rows), time.time() - t0)
+    for row in rows:
+      print "\t".join(str(v) for v in row)
+
+if __name__ == "__main__":
+  main()
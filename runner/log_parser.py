@@ -0,0 +1,196 @@
+# Copyright 2013 The Regents of The University California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Parse the console output of the Hive, Hive-on-Tez, Shark and Impala CLIs.
+
+   parse() splits output into statements, each ending with the line the CLI
+   prints when a statement completes ("Time taken: ..." or "Inserted ...
+   rows in ...s"). Every statement carries its time, its row count if one
+   was printed, and the stages (MapReduce jobs, Tez vertices or Spark
+   stages) it ran, with whatever the CLI reported about them: wall time,
+   task counts, CPU time and HDFS bytes read and written. The formats print
+   different things, so any field a CLI doesn't report is None. None of
+   them print shuffle volumes on the console.
+
+   recovery() tells whether a statement failed and how many tasks were
+   retried. Only Shark's scheduler log reports retries; Hive retries task
+   attempts without saying so on the console, and Impala doesn't retry. It
+   also tells whether the trial agent cancelled the statement for running
+   past its deadline.
+
+   INCLUDE matches every line parse() and recovery() use, so the cluster
+   only needs to send those back.
+"""
+
+import datetime
+import re
+
+# Hive and Shark: "Time taken: 12.3 seconds" or "... seconds, Fetched: 1 row(s)"
+STATEMENT_HIVE = re.compile(
+    r"Time taken: ([\d.]+) seconds(?:, Fetched: (\d+) row)?")
+# Impala: "Inserted 32888 rows in 1.23s" or "Returned 1 row(s) in 0.50s"
+STATEMENT_IMPALA = re.compile(
+    r"(?:Inserted|Returned|Fetched) (\d+) rows?(?:\(s\))? in ([\d.]+)s")
+
+# Hive on MapReduce
+MR_JOB_INFO = re.compile(r"Hadoop job information for (Stage-\d+): " \
+    r"number of mappers: (\d+); number of reducers: (\d+)")
+MR_PROGRESS = re.compile(
+    r"^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d),(\d+) (Stage-\d+) map = ")
+MR_SUMMARY = re.compile(r"(?:Job \d+|Stage-(Stage-\d+)):\s+Map: (\d+)\s+" \
+    r"(?:Reduce: (\d+)\s+)?(?:Cumulative CPU: ([\d.]+) sec\s+)?" \
+    r"HDFS Read: (\d+) HDFS Write: (\d+)")
+# Hive on Tez: progress lines ("Map 1: 4/4  Reducer 2: 0(+1)/1") and the
+# per-vertex summary table of later Hive versions
+TEZ_PROGRESS = re.compile(
+    r"((?:Map|Reducer) \d+): (?:-/-|\d+(?:\(\+\d+\))?/(\d+))")
+TEZ_VERTEX = re.compile(
+    r"^\s*((?:Map|Reducer) \d+)\s+(\d+)\s+\d+\s+\d+\s+([\d.]+)\s+([\d,]+)")
+# Shark (shark-withinfo logs the Spark scheduler)
+SPARK_TASKS = re.compile(r"Submitting (\d+) missing tasks from Stage (\d+)")
+SPARK_STAGE = re.compile(r"Stage (\d+) \(.*\) finished in ([\d.]+) s")
+
+# Failed statements: Hive and Shark ("FAILED: Execution Error ...", "Ended
+# Job = job_1 with errors") and Impala ("ERROR: ...", "Query aborted")
+FAILED = re.compile(r"^FAILED:|Ended Job = \S+ with errors|^ERROR:|" \
+    r"Query aborted")
+# Tasks Spark runs again after they or their executor were lost
+RETRY = re.compile(r"Lost TID \d+")
+# Added by trial_agent.py (and the Redshift runner) when a trial was
+# cancelled for running too long
+TIMED_OUT = re.compile(r"^Timed out after [\d.]+ seconds")
+
+INCLUDE = "|".join([
+    "Time taken:", r"(?:Inserted|Returned|Fetched) \d+ row",
+    "Hadoop job information", r"Stage-\d+ map = ", "HDFS Read:",
+    r"(?:Map|Reducer) \d+:", r"^\s*(?:Map|Reducer) \d+\s+\d",
+    "Submitting .* missing tasks from Stage", r"Stage \d+ \(.*\) finished in",
+    FAILED.pattern, RETRY.pattern])
+
+def new_stage(name):
+  return {"name": name, "wall": None, "maps": None, "reduces": None,
+          "tasks": None, "cpu": None, "hdfs_read": None, "hdfs_write": None}
+
+def _timestamp(date, millis):
+  t = datetime.datetime.strptime(date, "%Y-%m-%d %H:%M:%S")
+  return (t - datetime.datetime(1970, 1, 1)).total_seconds() + int(millis) / 1e3
+
+def parse(lines):
+  """Return a dict for every statement found in `lines`, in order."""
+  statements = []
+  stages = {}
+  order = []
+  progress = {}
+
+  def stage(name):
+    if name not in stages:
+      stages[name] = new_stage(name)
+      order.append(name)
+    return stages[name]
+
+  def end_statement(time, rows):
+    for name, (first, last) in progress.items():
+      stage(name)["wall"] = last - first
+    statements.append({"time": float(time),
+                       "rows": int(rows) if rows is not None else None,
+                       "stages": [stages[name] for name in order]})
+    stages.clear()
+    del order[:]
+    progress.clear()
+
+  summaries = 0
+  for line in lines:
+    m = STATEMENT_HIVE.search(line)
+    if m:
+      end_statement(m.group(1), m.group(2))
+      summaries = 0
+      continue
+    m = STATEMENT_IMPALA.search(line)
+    if m:
+      end_statement(m.group(2), m.group(1))
+      continue
+
+    m = MR_JOB_INFO.search(line)
+    if m:
+      s = stage(m.group(1))
+      s["maps"], s["reduces"] = int(m.group(2)), int(m.group(3))
+      s["tasks"] = s["maps"] + s["reduces"]
+      continue
+    m = MR_PROGRESS.search(line)
+    if m:
+      t = _timestamp(m.group(1), m.group(2))
+      first = progress.get(m.group(3), (t, t))[0]
+      progress[m.group(3)] = (first, t)
+      continue
+    m = MR_SUMMARY.search(line)
+    if m:
+      # Older Hive numbers jobs rather than naming their stage; those are
+      # listed in the order the stages ran.
+      if m.group(1):
+        s = stage(m.group(1))
+      elif summaries < len(order):
+        s = stages[order[summaries]]
+      else:
+        s = stage("Job %d" % summaries)
+      summaries += 1
+      s["maps"] = int(m.group(2))
+      if m.group(3):
+        s["reduces"] = int(m.group(3))
+      s["tasks"] = s["maps"] + (s["reduces"] or 0)
+      if m.group(4):
+        s["cpu"] = float(m.group(4))
+      s["hdfs_read"], s["hdfs_write"] = int(m.group(5)), int(m.group(6))
+      continue
+
+    m = TEZ_VERTEX.search(line)
+    if m:
+      s = stage(m.group(1))
+      s["tasks"], s["wall"] = int(m.group(2)), float(m.group(3))
+      s["cpu"] = int(m.group(4).replace(",", "")) / 1e3
+      continue
+    if TEZ_PROGRESS.search(line):
+      for name, total in TEZ_PROGRESS.findall(line):
+        s = stage(name)
+        if total:
+          s["tasks"] = int(total)
+      continue
+
+    m = SPARK_TASKS.search(line)
+    if m:
+      stage("Stage %s" % m.group(2))["tasks"] = int(m.group(1))
+      continue
+    m = SPARK_STAGE.search(line)
+    if m:
+      stage("Stage %s" % m.group(1))["wall"] = float(m.group(2))
+      continue
+
+  return statements
+
+def totals(statements):
+  """Sum the counters of every stage across `statements`."""
+  total = {"stages": 0}
+  for statement in statements:
+    for s in statement["stages"]:
+      total["stages"] += 1
+      for key in ["tasks", "cpu", "hdfs_read", "hdfs_write"]:
+        if s[key] is not None:
+          total[key] = total.get(key, 0) + s[key]
+  return total
+
+def recovery(lines):
+  """Whether the output in `lines` shows a failure or a timeout, and tasks
+     retried."""
+  return {"failed": any(FAILED.search(line) for line in lines),
+          "retries": len([line for line in lines if RETRY.search(line)]),
+          "timed_out": any(TIMED_OUT.search(line) for line in lines)}
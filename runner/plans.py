@@ -0,0 +1,147 @@
+# Copyright 2013 The Regents of The University California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Capture query plans and show how they changed between runs.
+
+   run_query.py --capture-plans stores the EXPLAIN output of every query it
+   runs as a "plan" record in the results store. Plans are compared after
+   normalization: CLI chatter is dropped and the numbers in row, size and
+   cost estimates are masked, since those move with table statistics even
+   when the plan itself does not.
+
+   Run as a script, this compares the plans of two runs of every engine and
+   query found in the given stores -- by default the two most recent runs
+   that captured one -- and prints a diff of each plan that changed next to
+   the median time of the query in both runs:
+
+     python plans.py results.jsonl
+     python plans.py results.jsonl --baseline RUN_ID --candidate RUN_ID
+"""
+
+import difflib
+import hashlib
+import re
+import sys
+from optparse import OptionParser
+
+import results_store
+import stats
+
+# Lines the Hive, Shark and Impala CLIs print around a plan
+NOISE = "|".join([
+    r"^\s*$", r"^OK$", "^Time taken:", "^Logging initialized", "^Hive history",
+    "^WARN", "^SLF4J:", r"^\d\d/\d\d/\d\d \d\d:\d\d:\d\d ", r"^\[\w+\]",
+    "^Starting Impala Shell", "^Connected to", "^Server version:",
+    "^Query:", "^Query submitted", "^Query progress", "^Fetched",
+    "^Welcome to", "^Shark history", "^Returned", r"^\+-*\+$",
+    "^Explain String$", "^Plan not optimized"])
+NOISE_LINE = re.compile(NOISE)
+
+# Estimates that change with the data rather than with the plan
+ESTIMATE = re.compile(r"(?i)(statistics|estimated|rows=|cost=|width=|" \
+                      r"size=|cardinality|per-host|mem-estimate)")
+NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+def explain(statement):
+  return "EXPLAIN %s;" % statement.strip().rstrip(";")
+
+def clean(lines):
+  """Strip CLI chatter from the output of an EXPLAIN statement."""
+  # Impala prints its plan as a table of one column
+  lines = [line.rstrip().strip("|").rstrip() for line in lines]
+  return [line for line in lines if not NOISE_LINE.search(line.strip())]
+
+def normalize(lines):
+  return [ESTIMATE.search(line) and NUMBER.sub("N", line) or line
+          for line in clean(lines)]
+
+def plan_hash(lines):
+  return hashlib.md5("\n".join(normalize(lines))).hexdigest()
+
+def diff(old, new, old_name="baseline", new_name="candidate"):
+  return list(difflib.unified_diff(normalize(old), normalize(new),
+                                   old_name, new_name, lineterm=""))
+
+# Median steady-state time of a query in a run, or None
+def median_time(latencies, run_id):
+  times = [r["time"] for r in latencies
+           if r["run_id"] == run_id and r.get("time") is not None]
+  steady = [r["time"] for r in latencies
+            if r["run_id"] == run_id and not r.get("warmup")
+            and r.get("time") is not None]
+  if not times:
+    return None
+  return stats.median(steady or times)
+
+def _format_time(t):
+  return t is None and "n/a" or "%.2fs" % t
+
+def report(records, out, baseline=None, candidate=None):
+  """Print the plans that differ between two runs. Returns how many did."""
+  latencies = results_store.group(
+      [r for r in records if r.get("kind") == "latency"], "engine", "query")
+  groups = results_store.group(
+      [r for r in records if r.get("kind") == "plan"], "engine", "query")
+  changed = 0
+  for (engine, query), plans in sorted(groups.items()):
+    by_run = {}
+    for plan in sorted(plans, key=lambda r: r["timestamp"]):
+      by_run[plan["run_id"]] = plan
+    runs = sorted(by_run, key=lambda run: by_run[run]["timestamp"])
+    old = baseline or (len(runs) > 1 and runs[-2] or None)
+    new = candidate or runs[-1]
+    if old not in by_run or new not in by_run or old == new:
+      continue
+    if by_run[old]["plan_hash"] == by_run[new]["plan_hash"]:
+      continue
+    changed += 1
+    times = latencies.get((engine, query), [])
+    print >> out, "=== %s, query %s: plan changed ===" % (engine, query)
+    print >> out, "  %s: median %s" % (
+      old, _format_time(median_time(times, old)))
+    print >> out, "  %s: median %s" % (
+      new, _format_time(median_time(times, new)))
+    for line in diff(by_run[old]["plan"], by_run[new]["plan"], old, new):
+      print >> out, "  " + line
+  return changed
+
+def parse_args():
+  parser = OptionParser(usage="plans.py [options] STORE...")
+  parser.add_option("--engine", action="append",
+      help="Only include this engine (may be repeated)")
+  parser.add_option("--query", action="append",
+      help="Only include this query (may be repeated)")
+  parser.add_option("--baseline",
+      help="Run to compare against (default: the second most recent)")
+  parser.add_option("--candidate",
+      help="Run to compare (default: the most recent)")
+  (opts, args) = parser.parse_args()
+  if not args:
+    parser.print_help()
+    sys.exit(1)
+  return opts, args
+
+def main():
+  opts, paths = parse_args()
+  filters = {"kind": ["plan", "latency"]}
+  if opts.engine:
+    filters["engine"] = opts.engine
+  if opts.query:
+    filters["query"] = opts.query
+  records = list(results_store.load(paths, **filters))
+  changed = report(records, sys.stdout, opts.baseline, opts.candidate)
+  print "%d plan(s) changed" % changed
+
+if __name__ == "__main__":
+  main()
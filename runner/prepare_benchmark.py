@@ -18,7 +18,6 @@
    into the provided cluster or clusters.
 """
 
-import subprocess
 import sys
 from sys import stderr
 from optparse import OptionParser
@@ -26,6 +25,11 @@ import os
 import time
 from pg8000 import DBAPI
 import pg8000.errors
+import ssh_pool
+from ssh_pool import ssh, scp_to, scp_from
+from fanout import fan_out, summarize, DEFAULT_PARALLELISM
+import columnar
+from hdfs_import import TableImport, run_imports
 
 # A scratch directory on your filesystem
 LOCAL_TMP_DIR = "/tmp"
@@ -85,6 +89,17 @@ def parse_args():
       help="File format to copy (text, text-deflate, "\
            "sequence, or sequence-snappy)")
 
+  parser.add_option("--columnar",
+      help="Also copy rankings and uservisits into these columnar formats, " \
+           "comma separated (%s), for run_query.py --table-variant" %
+           ", ".join(columnar.FORMATS))
+  parser.add_option("--columnar-compression", default="snappy",
+      help="Compression of the columnar copies (%s)" %
+           ", ".join(columnar.COMPRESSION))
+  parser.add_option("--row-group-size", type="float",
+      help="MB per ORC stripe, Parquet row group or RCFile record buffer " \
+           "(default: each engine's)")
+
   parser.add_option("-d", "--aws-key-id",
       help="Access key ID for AWS")
   parser.add_option("-k", "--aws-key",
@@ -92,6 +107,14 @@ def parse_args():
 
   parser.add_option("--skip-s3-import", action="store_true", default=False,
       help="Assumes s3 data is already loaded")
+  parser.add_option("--reimport", action="store_true", default=False,
+      help="Copy every file from S3 again, rather than only those missing " \
+           "or changed since the last import")
+  parser.add_option("--no-ssh-multiplexing", action="store_true",
+      default=False, help="Open a new SSH connection for every remote command")
+  parser.add_option("--host-parallelism", type="int",
+      default=DEFAULT_PARALLELISM,
+      help="Maximum number of hosts to contact concurrently")
 
   (opts, args) = parser.parse_args()
 
@@ -105,6 +128,18 @@ def parse_args():
 
   opts.data_prefix = SCALE_FACTOR_MAP[opts.scale_factor]
 
+  opts.columnar = opts.columnar and opts.columnar.split(",") or []
+  unknown = [f for f in opts.columnar if f not in columnar.FORMATS]
+  if unknown:
+    print >> stderr, "Unknown columnar format(s): %s" % ", ".join(unknown)
+    sys.exit(1)
+  if opts.columnar_compression not in columnar.COMPRESSION:
+    print >> stderr, "Unknown compression: %s" % opts.columnar_compression
+    sys.exit(1)
+
+  if opts.no_ssh_multiplexing:
+    ssh_pool.POOL.enabled = False
+
   if opts.impala and (opts.impala_identity_file is None or
                       opts.impala_host is None or
                       opts.aws_key_id is None or
@@ -132,24 +167,6 @@ def parse_args():
 
   return opts
 
-# Run a command on a host through ssh, throwing an exception if ssh fails
-def ssh(host, username, identity_file, command):
-  subprocess.check_call(
-      "ssh -t -o StrictHostKeyChecking=no -i %s %s@%s '%s'" %
-      (identity_file, username, host, command), shell=True)
-
-# Copy a file to a given host through scp, throwing an exception if scp fails
-def scp_to(host, identity_file, username, local_file, remote_file):
-  subprocess.check_call(
-      "scp -q -o StrictHostKeyChecking=no -i %s '%s' '%s@%s:%s'" %
-      (identity_file, local_file, username, host, remote_file), shell=True)
-
-# Copy a file to a given host through scp, throwing an exception if scp fails
-def scp_from(host, identity_file, username, remote_file, local_file):
-  subprocess.check_call(
-      "scp -q -o StrictHostKeyChecking=no -i %s '%s@%s:%s' '%s'" %
-      (identity_file, username, host, remote_file, local_file), shell=True)
-
 # Insert AWS credentials into a given XML file on the given remote host
 def add_aws_credentials(remote_host, remote_user, identity_file,
                        remote_xml_file, aws_key_id, aws_key):
@@ -174,6 +191,23 @@ def add_aws_credentials(remote_host, remote_user, identity_file,
   out.close()
   scp_to(remote_host, identity_file, remote_user, local_xml, remote_xml_file)
 
+# Copy rankings and uservisits into the --columnar formats `engine` reads,
+# running HiveQL with `hive` and, if given, Impala's SQL with `impala`
+def create_columnar_tables(opts, engine, hive, impala=None):
+  for fmt in opts.columnar:
+    if fmt not in columnar.ENGINE_FORMATS[engine]:
+      print >> stderr, "Skipping %s tables, which %s can't read" % (
+        fmt, engine)
+      continue
+    print "=== CREATING %s COPIES OF THE BENCHMARK TABLES ===" % fmt.upper()
+    for table in columnar.TABLES:
+      if impala and fmt == "parquet":
+        impala(" ".join(columnar.impala_statements(
+          table, opts.columnar_compression, opts.row_group_size)))
+      else:
+        hive(" ".join(columnar.hive_statements(
+          table, fmt, opts.columnar_compression, opts.row_group_size)))
+
 def prepare_shark_dataset(opts):
   def ssh_shark(command):
     command = "source /root/.bash_profile; %s" % command
@@ -191,27 +225,20 @@ def prepare_shark_dataset(opts):
 
     ssh_shark("/root/mapreduce/bin/start-mapred.sh")
 
-    ssh_shark(
-      "/root/mapreduce/bin/hadoop distcp " \
-      "s3n://big-data-benchmark/pavlo/%s/%s/rankings/ " \
-      "/user/shark/benchmark/rankings/" % (opts.file_format, opts.data_prefix))
-
-    ssh_shark(
-      "/root/mapreduce/bin/hadoop distcp " \
-      "s3n://big-data-benchmark/pavlo/%s/%s/uservisits/ " \
-      "/user/shark/benchmark/uservisits/" % (
-        opts.file_format, opts.data_prefix))
-
-    ssh_shark(
-      "/root/mapreduce/bin/hadoop distcp " \
-      "s3n://big-data-benchmark/pavlo/%s/%s/crawl/ " \
-      "/user/shark/benchmark/crawl/" % (opts.file_format, opts.data_prefix))
-
+    def shark_import(table, source):
+      return TableImport(table, source, "/user/shark/benchmark/%s" % table,
+        "source /root/.bash_profile; /root/ephemeral-hdfs/bin/hadoop",
+        "source /root/.bash_profile; /root/mapreduce/bin/hadoop distcp",
+        "/mnt")
+    s3 = "s3n://big-data-benchmark/pavlo/%s/%s" % (
+      opts.file_format, opts.data_prefix)
     # Scratch table used for JVM warmup
-    ssh_shark(
-      "/root/mapreduce/bin/hadoop distcp /user/shark/benchmark/rankings " \
-      "/user/shark/benchmark/scratch"
-    )
+    run_imports([[shark_import("rankings", s3 + "/rankings"),
+                  shark_import("scratch", "/user/shark/benchmark/rankings")],
+                 [shark_import("uservisits", s3 + "/uservisits")],
+                 [shark_import("crawl", s3 + "/crawl")]],
+                opts.shark_host, "root", opts.shark_identity_file,
+                opts.reimport, opts.host_parallelism)
 
   print "=== CREATING HIVE TABLES FOR BENCHMARK ==="
   hive_site = '''
@@ -274,6 +301,10 @@ def prepare_shark_dataset(opts):
     "CREATE EXTERNAL TABLE documents (line STRING) STORED AS TEXTFILE " \
     "LOCATION \\\"/user/shark/benchmark/crawl\\\";\"")
 
+  create_columnar_tables(opts, "shark",
+    lambda statements: ssh_shark("/root/shark/bin/shark -e \"%s\"" %
+                                 statements))
+
   print "=== FINISHED CREATING BENCHMARK DATA ==="
 
 def prepare_impala_dataset(opts):
@@ -295,15 +326,16 @@ def prepare_impala_dataset(opts):
     add_aws_credentials(opts.impala_host, "ubuntu", opts.impala_identity_file,
         "/etc/hadoop/conf/core-site.xml", opts.aws_key_id, opts.aws_key)
 
-    ssh_impala(
-      "sudo -u hdfs hadoop distcp s3n://big-data-benchmark/pavlo/%s/%s/rankings/ " \
-      "/tmp/benchmark/rankings/" % (opts.file_format, opts.data_prefix))
-    ssh_impala(
-      "sudo -u hdfs hadoop distcp s3n://big-data-benchmark/pavlo/%s/%s/uservisits/ " \
-      "/tmp/benchmark/uservisits/" % (opts.file_format, opts.data_prefix))
-    ssh_impala(
-      "sudo -u hdfs hadoop distcp s3n://big-data-benchmark/pavlo/%s/%s/rankings/ " \
-      "/tmp/benchmark/scratch/" % (opts.file_format, opts.data_prefix))
+    def impala_import(table, source):
+      return TableImport(table, source, "/tmp/benchmark/%s" % table,
+                         "sudo -u hdfs hadoop", state_dir="/tmp")
+    s3 = "s3n://big-data-benchmark/pavlo/%s/%s" % (
+      opts.file_format, opts.data_prefix)
+    run_imports([[impala_import("rankings", s3 + "/rankings")],
+                 [impala_import("uservisits", s3 + "/uservisits")],
+                 [impala_import("scratch", s3 + "/rankings")]],
+                opts.impala_host, "ubuntu", opts.impala_identity_file,
+                opts.reimport, opts.host_parallelism)
 
   print "=== CREATING HIVE TABLES FOR BENCHMARK ==="
   ssh_impala(
@@ -329,6 +361,10 @@ def prepare_impala_dataset(opts):
     "TERMINATED BY \\\"\\001\\\" " \
     "STORED AS SEQUENCEFILE LOCATION \\\"/tmp/benchmark/scratch\\\";\"")
 
+  create_columnar_tables(opts, "impala",
+    lambda statements: ssh_impala("sudo -u hdfs hive -e \"%s\"" % statements),
+    lambda statements: ssh_impala("impala-shell -r -q \"%s\"" % statements))
+
   print "=== FINISHED CREATING BENCHMARK DATA ==="
 
 def prepare_hive_dataset(opts):
@@ -339,43 +375,29 @@ def prepare_hive_dataset(opts):
   if not opts.skip_s3_import:
     print "=== IMPORTING BENCHMARK FROM S3 ==="
     try:
-      ssh_hive("hadoop dfs -rmr -skipTrash /tmp/benchmark", user="hdfs")
-      ssh_hive("hadoop dfs -rmr -skipTrash .Trash", user="hdfs")
-      ssh_hive("hadoop dfs -expunge", user="hdfs")
       ssh_hive("hadoop dfs -mkdir /tmp/benchmark", user="hdfs")
     except Exception:
       pass # Folder may already exist
 
-    cp_rankings = "hadoop distcp s3n://%s:%s@big-data-benchmark/pavlo/%s/%s/rankings/ " \
-                  "/tmp/benchmark/rankings/" % (opts.aws_key_id,
-                                                opts.aws_key,
-                                                opts.file_format, opts.data_prefix)
-
-    cp_uservisits = "hadoop distcp s3n://%s:%s@big-data-benchmark/pavlo/%s/%s/uservisits/ " \
-                    "/tmp/benchmark/uservisits/" % (opts.aws_key_id,
-                                                    opts.aws_key,
-                                                    opts.file_format, opts.data_prefix)
-
-    cp_crawl = "hadoop distcp s3n://%s:%s@big-data-benchmark/pavlo/%s/%s/crawl/ " \
-               "/tmp/benchmark/crawl/" % (opts.aws_key_id,
-                                          opts.aws_key,
-                                          "text", opts.data_prefix)
-
-    ssh_hive(cp_rankings, user='hdfs')
-    ssh_hive(cp_uservisits, user='hdfs')
-    ssh_hive(cp_crawl, user='hdfs')
+    def hive_import(table, source):
+      return TableImport(table, source, "/tmp/benchmark/%s" % table,
+                         "sudo -u hdfs hadoop", state_dir="/mnt")
+    s3 = "s3n://%s:%s@big-data-benchmark/pavlo/%%s/%s" % (
+      opts.aws_key_id, opts.aws_key, opts.data_prefix)
+    run_imports([[hive_import("rankings", s3 % opts.file_format + "/rankings"),
+                  hive_import("scratch", "/tmp/benchmark/rankings")],
+                 [hive_import("uservisits",
+                              s3 % opts.file_format + "/uservisits")],
+                 [hive_import("crawl", s3 % "text" + "/crawl")]],
+                opts.hive_host, "root", opts.hive_identity_file,
+                opts.reimport, opts.host_parallelism)
 
   print "=== CREATING HIVE TABLES FOR BENCHMARK ==="
-  scp_to(opts.hive_host, opts.hive_identity_file, "root", "udf/url_count.py",
-      "/tmp/url_count.py")
-  for slave in opts.hive_slaves.replace('"', '').split(","):
-    scp_to(slave, opts.hive_identity_file, "root", "udf/url_count.py",
+  def copy_udf(host):
+    scp_to(host, opts.hive_identity_file, "root", "udf/url_count.py",
         "/tmp/url_count.py")
-
-  mkdir = "hadoop dfs -mkdir /tmp/benchmark/scratch"
-  cp_scratch = "hadoop dfs -cp /tmp/benchmark/rankings/* /tmp/benchmark/scratch"
-  ssh_hive(mkdir, user='hdfs')
-  ssh_hive(cp_scratch, user='hdfs')
+  hosts = [opts.hive_host] + opts.hive_slaves.replace('"', '').split(",")
+  summarize("Copied UDF", fan_out(copy_udf, hosts, opts.host_parallelism))
 
   ssh_hive(
     "hive -e \"DROP TABLE IF EXISTS rankings; " \
@@ -418,6 +440,9 @@ def prepare_hive_dataset(opts):
     "STORED AS SEQUENCEFILE LOCATION \\\"/tmp/benchmark/scratch\\\";\"",
   user="hdfs")
 
+  create_columnar_tables(opts, "hive",
+    lambda statements: ssh_hive("hive -e \"%s\"" % statements, user="hdfs"))
+
   print "=== FINISHED CREATING BENCHMARK DATA ==="
 
 def prepare_tez(opts):
@@ -439,43 +464,29 @@ def prepare_hive_cdh_dataset(opts):
   if not opts.skip_s3_import:
     print "=== IMPORTING BENCHMARK FROM S3 ==="
     try:
-      ssh_hive("hadoop dfs -rmr -skipTrash /tmp/benchmark")
-      ssh_hive("hadoop dfs -rmr -skipTrash .Trash")
-      ssh_hive("hadoop dfs -expunge")
       ssh_hive("hadoop dfs -mkdir /tmp/benchmark")
     except Exception:
       pass # Folder may already exist
 
-    cp_rankings = "hadoop distcp s3n://%s:%s@big-data-benchmark/pavlo/%s/%s/rankings/ " \
-                  "/tmp/benchmark/rankings/" % (opts.aws_key_id,
-                                                opts.aws_key,
-                                                opts.file_format, opts.data_prefix)
-
-    cp_uservisits = "hadoop distcp s3n://%s:%s@big-data-benchmark/pavlo/%s/%s/uservisits/ " \
-                    "/tmp/benchmark/uservisits/" % (opts.aws_key_id,
-                                                    opts.aws_key,
-                                                    opts.file_format, opts.data_prefix)
-
-    cp_crawl = "hadoop distcp s3n://%s:%s@big-data-benchmark/pavlo/%s/%s/crawl/ " \
-               "/tmp/benchmark/crawl/" % (opts.aws_key_id,
-                                          opts.aws_key,
-                                          "text", opts.data_prefix)
-
-    ssh_hive(cp_rankings)
-    ssh_hive(cp_uservisits)
-    ssh_hive(cp_crawl)
+    def cdh_import(table, source):
+      return TableImport(table, source, "/tmp/benchmark/%s" % table,
+                         "HADOOP_USER_NAME=hdfs hadoop", state_dir="/tmp")
+    s3 = "s3n://%s:%s@big-data-benchmark/pavlo/%%s/%s" % (
+      opts.aws_key_id, opts.aws_key, opts.data_prefix)
+    run_imports([[cdh_import("rankings", s3 % opts.file_format + "/rankings"),
+                  cdh_import("scratch", "/tmp/benchmark/rankings")],
+                 [cdh_import("uservisits",
+                             s3 % opts.file_format + "/uservisits")],
+                 [cdh_import("crawl", s3 % "text" + "/crawl")]],
+                opts.hive_host, "ubuntu", opts.hive_identity_file,
+                opts.reimport, opts.host_parallelism)
 
   print "=== CREATING HIVE TABLES FOR BENCHMARK ==="
-  scp_to(opts.hive_host, opts.hive_identity_file, "ubuntu", "udf/url_count.py",
-      "/tmp/url_count.py")
-  for slave in opts.hive_slaves.replace('"', '').split(","):
-    scp_to(slave, opts.hive_identity_file, "ubuntu", "udf/url_count.py",
+  def copy_udf(host):
+    scp_to(host, opts.hive_identity_file, "ubuntu", "udf/url_count.py",
         "/tmp/url_count.py")
-
-  mkdir = "hadoop dfs -mkdir /tmp/benchmark/scratch"
-  cp_scratch = "hadoop dfs -cp /tmp/benchmark/rankings/* /tmp/benchmark/scratch"
-  ssh_hive(mkdir)
-  ssh_hive(cp_scratch)
+  hosts = [opts.hive_host] + opts.hive_slaves.replace('"', '').split(",")
+  summarize("Copied UDF", fan_out(copy_udf, hosts, opts.host_parallelism))
 
   ssh_hive(
     "hive -e \"DROP TABLE IF EXISTS rankings; " \
@@ -505,6 +516,9 @@ def prepare_hive_cdh_dataset(opts):
     "TERMINATED BY \\\"\\001\\\" " \
     "STORED AS SEQUENCEFILE LOCATION \\\"/tmp/benchmark/scratch\\\";\"")
 
+  create_columnar_tables(opts, "hive_cdh",
+    lambda statements: ssh_hive("hive -e \"%s\"" % statements))
+
   print "=== FINISHED CREATING BENCHMARK DATA ==="
 
 def prepare_redshift_dataset(opts):
@@ -0,0 +1,258 @@
+# Copyright 2013 The Regents of The University California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Catalog of the benchmark queries.
+
+   Queries 1-3 are families with one parameter each (a pageRank threshold,
+   a sourceIP prefix length and the end of a visitDate range). A family has
+   a template per dialect -- "hql" for Hive, Shark and Impala, "sql" for
+   Redshift -- and names the points the published benchmark runs ("1a",
+   "1b", ...) together with their result sizes on the 5nodes data set.
+
+   Any other point of a family is named "<family>@<value>", e.g. "1@5000",
+   and a sweep over many points can be written as a range:
+
+     1@1..10000*10     1@1, 1@10, 1@100, 1@1000, 1@10000
+     2@4..16           2@4, 2@5, ..., 2@16
+     2@4..16+4         2@4, 2@8, 2@12, 2@16
+
+   Ranges only apply to families with an integer parameter; dates of family
+   3 are given one at a time, e.g. "3@1981-06-01".
+"""
+
+import re
+import time
+
+TMP_TABLE = "result"
+TMP_TABLE_CACHED = "result_cached"
+CLEAN_QUERY = "DROP TABLE %s;" % TMP_TABLE
+
+def create_as(query):
+  return "CREATE TABLE %s AS %s;" % (TMP_TABLE, query)
+def insert_into(query):
+  return "INSERT INTO TABLE %s %s;" % (TMP_TABLE, query)
+def count(query):
+  return query
+  return "SELECT COUNT(*) FROM (%s) q;" % query
+
+# A visitDate as the queries compare it, YYYY-MM-DD. Raises ValueError for
+# anything else.
+def parse_date(value):
+  try:
+    time.strptime(value, "%Y-%m-%d")
+  except ValueError:
+    raise ValueError("Not a YYYY-MM-DD date: %s" % value)
+  return value
+
+class QueryFamily(object):
+  """A benchmark query with one tunable parameter.
+
+     `templates` maps each dialect to a SELECT statement with a {value}
+     placeholder, `impala_pre` creates the table Impala inserts into, and
+     `variants` maps each named variant to its parameter value.
+     `cardinalities` gives the size of each named variant's result on the
+     5nodes data set, measured in `cardinality_unit`. `columns` maps each
+     dialect, and "impala" for the table Impala inserts into, to the
+     (name, "string" or "number") columns of the result table, in order.
+  """
+
+  def __init__(self, name, param, templates, impala_pre, variants,
+               cardinalities, cardinality_unit, columns, parse=int):
+    self.name = name
+    self.param = param
+    self.templates = templates
+    self.impala_pre = impala_pre
+    self.columns = columns
+    self.variants = variants
+    self.cardinalities = cardinalities
+    self.cardinality_unit = cardinality_unit
+    self.parse = parse
+
+  def render(self, dialect, value):
+    return " ".join(self.templates[dialect].format(value=value).split())
+
+  # Entry in QUERY_MAP: (Hive/Shark, Impala, Redshift) statements
+  def entry(self, value):
+    return (create_as(self.render("hql", value)),
+            insert_into(self.render("hql", value)),
+            create_as(self.render("sql", value)))
+
+FAMILIES = {}
+
+def add_family(family):
+  FAMILIES[family.name] = family
+
+add_family(QueryFamily(
+  name="1", param="pageRank threshold",
+  templates={
+    "hql": "SELECT pageURL, pageRank FROM rankings WHERE pageRank > {value}",
+    "sql": "SELECT pageURL, pageRank FROM rankings WHERE pageRank > {value}"},
+  impala_pre="CREATE TABLE %s (pageURL STRING, pageRank INT);" % TMP_TABLE,
+  variants={"a": 1000, "b": 100, "c": 10},
+  cardinalities={"a": 32888, "b": 3331851, "c": 89974976},
+  cardinality_unit="results",
+  columns={
+    "hql": [("pageURL", "string"), ("pageRank", "number")],
+    "impala": [("pageURL", "string"), ("pageRank", "number")],
+    "sql": [("pageURL", "string"), ("pageRank", "number")]}))
+
+add_family(QueryFamily(
+  name="2", param="sourceIP prefix length",
+  templates={
+    "hql": "SELECT SUBSTR(sourceIP, 1, {value}), SUM(adRevenue) FROM "
+           "uservisits GROUP BY SUBSTR(sourceIP, 1, {value})",
+    "sql": "SELECT SUBSTRING(sourceIP, 1, {value}), SUM(adRevenue) FROM "
+           "uservisits GROUP BY SUBSTRING(sourceIP, 1, {value})"},
+  impala_pre="CREATE TABLE %s (sourceIP STRING, adRevenue DOUBLE);" % (
+    TMP_TABLE),
+  variants={"a": 8, "b": 10, "c": 12},
+  cardinalities={"a": 2067313, "b": 31348913, "c": 253890330},
+  cardinality_unit="groups",
+  columns={
+    "hql": [("_c0", "string"), ("_c1", "number")],
+    "impala": [("sourceIP", "string"), ("adRevenue", "number")],
+    "sql": [("substring", "string"), ("sum", "number")]}))
+
+add_family(QueryFamily(
+  name="3", param="end of the visitDate range",
+  templates={
+    "hql": """SELECT sourceIP,
+                     sum(adRevenue) as totalRevenue,
+                     avg(pageRank) as pageRank
+              FROM
+                rankings R JOIN
+                (SELECT sourceIP, destURL, adRevenue
+                 FROM uservisits UV
+                 WHERE UV.visitDate > "1980-01-01"
+                 AND UV.visitDate < "{value}")
+                 NUV ON (R.pageURL = NUV.destURL)
+              GROUP BY sourceIP
+              ORDER BY totalRevenue DESC
+              LIMIT 1""",
+    "sql": """SELECT sourceIP, totalRevenue, avgPageRank
+              FROM
+                (SELECT sourceIP,
+                        AVG(pageRank) as avgPageRank,
+                        SUM(adRevenue) as totalRevenue
+                FROM Rankings AS R, UserVisits AS UV
+                WHERE R.pageURL = UV.destinationURL
+                AND UV.visitDate
+                  BETWEEN Date('1980-01-01') AND Date('{value}')
+                GROUP BY UV.sourceIP)
+              ORDER BY totalRevenue DESC LIMIT 1"""},
+  impala_pre="CREATE TABLE %s (sourceIP STRING, " \
+    "adRevenue DOUBLE, pageRank DOUBLE);" % TMP_TABLE,
+  variants={"a": "1980-04-01", "b": "1983-01-01", "c": "2010-01-01"},
+  cardinalities={"a": 485312, "b": 53332015, "c": 533287121},
+  cardinality_unit="joined rows",
+  columns={
+    "hql": [("sourceIP", "string"), ("totalRevenue", "number"),
+            ("pageRank", "number")],
+    "impala": [("sourceIP", "string"), ("adRevenue", "number"),
+               ("pageRank", "number")],
+    "sql": [("sourceIP", "string"), ("totalRevenue", "number"),
+            ("avgPageRank", "number")]},
+  parse=parse_date))
+
+QUERY_4_HQL = """DROP TABLE IF EXISTS url_counts_partial;
+                 CREATE TABLE url_counts_partial AS
+                   SELECT TRANSFORM (line)
+                   USING "python /root/url_count.py" as (sourcePage,
+                     destPage, count) from documents;
+                 DROP TABLE IF EXISTS url_counts_total;
+                 CREATE TABLE url_counts_total AS
+                   SELECT SUM(count) AS totalCount, destpage
+                   FROM url_counts_partial GROUP BY destpage;"""
+QUERY_4_HQL = " ".join(QUERY_4_HQL.replace("\n", "").split())
+
+QUERY_4_HQL_HIVE_UDF = QUERY_4_HQL.replace("/root/url_count.py",
+                                           "/tmp/url_count.py")
+# Table Query 4 leaves its result in, and its columns
+QUERY_4_RESULT = ("url_counts_total",
+                  [("totalCount", "number"), ("destpage", "string")])
+
+# Statements for each query: (Hive/Shark, Impala, Redshift)
+QUERY_MAP = {'4': (QUERY_4_HQL, None, None),
+             '4_HIVE': (QUERY_4_HQL_HIVE_UDF, None, None)}
+# Table each query inserts into on Impala
+IMPALA_MAP = {}
+# Queries used with Tez, unused for now
+TEZ_MAP = {}
+
+# Family, parameter value and expected cardinality of every known query
+QUERY_INFO = {'4': ('4', None, None), '4_HIVE': ('4', None, None)}
+
+def register(query_num, family, value, cardinality=None):
+  QUERY_MAP[query_num] = family.entry(value)
+  IMPALA_MAP[query_num] = family.impala_pre
+  TEZ_MAP[query_num] = (count(family.render("hql", value)), )
+  QUERY_INFO[query_num] = (family.name, value, cardinality)
+
+for family in FAMILIES.values():
+  for variant, value in family.variants.items():
+    register(family.name + variant, family, value,
+             family.cardinalities.get(variant))
+
+# Queries run by "--query-num all", in order
+SUITE_QUERIES = ['1a', '1b', '1c', '2a', '2b', '2c', '3a', '3b', '3c', '4']
+
+# Name of the family a query belongs to, e.g. "2" for "2b" or "2@9"
+def family_of(query_num):
+  return QUERY_INFO[query_num][0]
+
+# Table a query leaves its result in and the columns of that table, for a
+# dialect of QueryFamily.columns
+def result_table(query_num, dialect):
+  if family_of(query_num) == '4':
+    return QUERY_4_RESULT
+  return TMP_TABLE, FAMILIES[family_of(query_num)].columns[dialect]
+
+def _sweep_values(family, spec):
+  match = re.match(r"^(\d+)\.\.(\d+)(?:([+*])(\d+))?$", spec)
+  if not match:
+    return [family.parse(spec)]
+  if family.parse is not int:
+    raise ValueError("The %s of query %s can't be swept as a range" % (
+      family.param, family.name))
+  low, high = int(match.group(1)), int(match.group(2))
+  op, step = match.group(3) or "+", int(match.group(4) or 1)
+  if (op == "+" and step < 1) or (op == "*" and (step < 2 or low < 1)):
+    raise ValueError("Sweep %s never ends" % spec)
+  values = []
+  while low <= high:
+    values.append(low)
+    low = low + step if op == "+" else low * step
+  return values
+
+def expand(query_spec):
+  """Return the names of the queries `query_spec` refers to, registering
+     each point of a family so it can be looked up in QUERY_MAP. Raises
+     ValueError for an unknown query or family."""
+  if query_spec in QUERY_MAP:
+    return [query_spec]
+  if "@" not in query_spec:
+    raise ValueError("Unknown query number: %s" % query_spec)
+  name, spec = query_spec.split("@", 1)
+  if name not in FAMILIES:
+    raise ValueError("Unknown query family: %s" % name)
+  family = FAMILIES[name]
+  query_nums = []
+  for value in _sweep_values(family, spec):
+    query_num = "%s@%s" % (name, value)
+    if query_num not in QUERY_MAP:
+      known = [v for v in family.variants if family.variants[v] == value]
+      register(query_num, family, value,
+               known and family.cardinalities.get(known[0]) or None)
+    query_nums.append(query_num)
+  return query_nums
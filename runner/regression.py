@@ -0,0 +1,187 @@
+# Copyright 2013 The Regents of The University California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare a candidate set of benchmark results against a baseline.
+
+   For every engine, scale factor and query present in both sets, the trial
+   times are compared with a two-sided Mann-Whitney U test, which assumes
+   nothing about how times are distributed. A query is flagged as a
+   regression (or improvement) when the difference is significant at
+   --alpha and its median moved by at least --min-change. Effect sizes are
+   given as Cliff's delta: the probability that a candidate trial is slower
+   than a baseline trial minus the probability that it is faster. Warmup
+   trials are left out unless --include-warmup is given. So are trials that
+   failed or timed out, whose times are only how long they ran before that;
+   they are counted separately, and a query that fails more often than in
+   the baseline, or always, is flagged as a regression too. A query whose
+   captured plan differs between the sets (see plans.py) is marked.
+
+   Results may be results stores (see results_store.py) or the results_*
+   files run_query.py writes. The exit status is 1 if anything regressed:
+
+     python regression.py --baseline old.jsonl --candidate new.jsonl
+"""
+
+import os
+import sys
+from optparse import OptionParser
+
+import results_store
+import stats
+
+# Times of the successful trials in a results_<engine>_<query>_<date> file
+# written by run_query.py, as (engine, query, times, failures)
+def load_results_file(path):
+  engine, query, date = os.path.basename(path)[len("results_"):].rsplit("_", 2)
+  times = []
+  failed = set()
+  for line in open(path):
+    if line.startswith("Results: "):
+      times = [float(t) for t in line[len("Results: "):].split(",")
+               if t.strip()]
+    elif line.startswith(("Timed out trials: ", "Failed trials: ")):
+      failed.update(int(t) - 1 for t in line.split(":", 1)[1].split(",")
+                    if t.strip())
+  return engine, query, [t for i, t in enumerate(times) if i not in failed], \
+         len(failed)
+
+# Times of every (engine, scale factor, query) in the given files, the plan
+# hashes captured for them and the number of trials that failed or timed out
+def load_times(paths, engines=None, queries=None, include_warmup=False):
+  times = {}
+  plans = {}
+  failures = {}
+  for path in paths:
+    if os.path.basename(path).startswith("results_") and \
+        not path.endswith(".jsonl"):
+      engine, query, values, failed = load_results_file(path)
+      if (engines and engine not in engines) or \
+          (queries and query not in queries):
+        continue
+      if not include_warmup:
+        values = values[stats.steady_state_start(values):]
+      times.setdefault((engine, None, query), []).extend(values)
+      if failed:
+        failures[(engine, None, query)] = \
+          failures.get((engine, None, query), 0) + failed
+      continue
+    filters = {"kind": ["latency", "plan"]}
+    if engines:
+      filters["engine"] = engines
+    if queries:
+      filters["query"] = queries
+    for r in results_store.load(path, **filters):
+      key = (r["engine"], r.get("scale_factor"), r["query"])
+      if r["kind"] == "plan":
+        plans.setdefault(key, set()).add(r["plan_hash"])
+      elif r.get("failed") or r.get("timed_out"):
+        failures[key] = failures.get(key, 0) + 1
+      elif r.get("time") is not None and (include_warmup or
+                                          not r.get("warmup")):
+        times.setdefault(key, []).append(r["time"])
+  return times, plans, failures
+
+def compare(baseline, candidate, alpha=0.05, min_change=0.05):
+  """Return (verdict, change, delta, p) for two lists of trial times."""
+  base, cand = stats.median(baseline), stats.median(candidate)
+  change = base and (cand - base) / base or 0.0
+  u, p = stats.mann_whitney(baseline, candidate)
+  delta = stats.cliffs_delta(baseline, candidate)
+  verdict = "same"
+  if p < alpha and abs(change) >= min_change:
+    verdict = change > 0 and "REGRESSION" or "improvement"
+  return verdict, change, delta, p
+
+# Fraction of the trials of a query that failed or timed out
+def failure_rate(times, failures):
+  total = len(times) + failures
+  return total and float(failures) / total or 0.0
+
+def report(base_times, cand_times, out, alpha=0.05, min_change=0.05,
+           base_plans={}, cand_plans={}, base_failures={}, cand_failures={}):
+  """Print one line per query of the baseline that the candidate ran too.
+     A query whose candidate trials all failed, or failed more often than
+     the baseline's, is a regression. Returns the regressions."""
+  regressions = []
+  print >> out, "Engine\tScale\tQuery\tTrials\tFailed\tBaseline\t" \
+                "Candidate\tChange\tDelta\tP\tVerdict"
+  for key in sorted(set(base_times) | set(base_failures)):
+    baseline, candidate = base_times.get(key, []), cand_times.get(key, [])
+    base_failed, cand_failed = base_failures.get(key, 0), \
+                               cand_failures.get(key, 0)
+    if not candidate and not cand_failed:
+      continue # Not run in the candidate
+    columns = ["-"] * 5
+    verdict = "same"
+    if baseline and candidate:
+      verdict, change, delta, p = compare(baseline, candidate, alpha,
+                                          min_change)
+      columns = ["%.2f" % stats.median(baseline),
+                 "%.2f" % stats.median(candidate), "%+.1f%%" % (change * 100),
+                 "%+.2f" % delta, "%.3f" % p]
+    elif baseline:
+      columns[0] = "%.2f" % stats.median(baseline)
+    elif candidate:
+      columns[1] = "%.2f" % stats.median(candidate)
+    if not candidate or failure_rate(candidate, cand_failed) > \
+        failure_rate(baseline, base_failed):
+      verdict = "REGRESSION (failures)"
+    if key in base_plans and key in cand_plans and \
+        base_plans[key] != cand_plans[key]:
+      verdict += " (plan changed)"
+    engine, scale_factor, query = key
+    print >> out, "%s\t%s\t%s\t%d/%d\t%d/%d\t%s\t%s" % (
+      engine, scale_factor, query, len(baseline), len(candidate),
+      base_failed, cand_failed, "\t".join(columns), verdict)
+    if verdict.startswith("REGRESSION"):
+      regressions.append(key)
+  return regressions
+
+def parse_args():
+  parser = OptionParser(usage="regression.py [options] " \
+                              "--baseline FILE... --candidate FILE...")
+  parser.add_option("--baseline", action="append", default=[],
+      help="Results store or results file of the baseline (may be repeated)")
+  parser.add_option("--candidate", action="append", default=[],
+      help="Results store or results file of the candidate (may be repeated)")
+  parser.add_option("--engine", action="append",
+      help="Only include this engine (may be repeated)")
+  parser.add_option("--query", action="append",
+      help="Only include this query (may be repeated)")
+  parser.add_option("--alpha", type="float", default=0.05,
+      help="Significance level of the test")
+  parser.add_option("--min-change", type="float", default=0.05,
+      help="Smallest relative change of the median worth flagging")
+  parser.add_option("--include-warmup", action="store_true", default=False,
+      help="Include trials detected as warmup")
+  (opts, args) = parser.parse_args()
+  if not opts.baseline or not opts.candidate:
+    parser.print_help()
+    sys.exit(1)
+  return opts
+
+def main():
+  opts = parse_args()
+  base_times, base_plans, base_failures = load_times(
+    opts.baseline, opts.engine, opts.query, opts.include_warmup)
+  cand_times, cand_plans, cand_failures = load_times(
+    opts.candidate, opts.engine, opts.query, opts.include_warmup)
+  regressions = report(base_times, cand_times, sys.stdout, opts.alpha,
+                       opts.min_change, base_plans, cand_plans,
+                       base_failures, cand_failures)
+  print "%d regression(s)" % len(regressions)
+  return regressions and 1 or 0
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,114 @@
+# Copyright 2013 The Regents of The University California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Collect resource_sampler.py samples from every host while a suite runs.
+
+   A Monitor starts one sampler per host over its multiplexed ssh session,
+   keeps every sample it streams back, and is told the wall-clock window
+   of each trial. Trial records then get the samples that fall inside
+   their window, a per-host mean, and the resource that was closest to
+   saturation.
+"""
+
+import json
+import os
+import threading
+
+import ssh_pool
+from fanout import fan_out, summarize
+
+METRICS = ["cpu_busy", "cpu_iowait", "disk_util", "disk_read", "disk_write",
+           "net_rx", "net_tx"]
+
+class Monitor(object):
+  def __init__(self, interval=1.0, net_capacity=125e6,
+               parallelism=32, remote_dir="/tmp"):
+    self.interval = interval
+    self.net_capacity = net_capacity
+    self.parallelism = parallelism
+    self.remote_dir = remote_dir
+    self.procs = {}
+    self.threads = []
+    self.samples = {}
+    self.windows = {}
+
+  def start(self, hosts, username, identity_file):
+    local = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "resource_sampler.py")
+    remote = "%s/resource_sampler.py" % self.remote_dir
+    summarize("Copied resource sampler", fan_out(
+        lambda h: ssh_pool.scp_to(h, identity_file, username, local, remote),
+        hosts, self.parallelism))
+    for host in hosts:
+      proc = ssh_pool.POOL.popen(host, username, identity_file,
+                                 "python %s %s" % (remote, self.interval))
+      self.procs[host] = proc
+      self.samples[host] = []
+      thread = threading.Thread(target=self._read, args=(host, proc))
+      thread.daemon = True
+      thread.start()
+      self.threads.append(thread)
+
+  def _read(self, host, proc):
+    for line in iter(proc.stdout.readline, ""):
+      try:
+        self.samples[host].append(json.loads(line))
+      except ValueError:
+        pass # Login banners and other noise
+
+  def stop(self):
+    for proc in self.procs.values():
+      proc.stdin.close()
+    for proc in self.procs.values():
+      proc.wait()
+    for thread in self.threads:
+      thread.join()
+    self.procs = {}
+    self.threads = []
+
+  # Record the wall-clock window a trial ran in
+  def mark(self, query_num, trial, start, end):
+    self.windows[(query_num, trial)] = (start, end)
+
+  def trial_resources(self, query_num, trial):
+    """Samples, means and likely bottleneck of one trial, or None."""
+    if (query_num, trial) not in self.windows:
+      return None
+    start, end = self.windows[(query_num, trial)]
+    hosts = {}
+    for host, samples in self.samples.items():
+      window = [s for s in samples if start <= s["t"] <= end]
+      mean = None
+      if window:
+        mean = dict((m, sum(s[m] for s in window) / len(window))
+                    for m in METRICS)
+      hosts[host] = {"samples": window, "mean": mean}
+    return {"start": start, "end": end, "hosts": hosts,
+            "bound": self.bottleneck(hosts)}
+
+  # The resource with the highest mean utilization on its busiest host.
+  # Network utilization is relative to `net_capacity` bytes per second.
+  def bottleneck(self, hosts):
+    utilization = {}
+    for host in hosts.values():
+      mean = host["mean"]
+      if mean is None:
+        continue
+      for resource, value in [
+          ("cpu", mean["cpu_busy"]), ("disk", mean["disk_util"]),
+          ("network", max(mean["net_rx"], mean["net_tx"]) / self.net_capacity)]:
+        utilization[resource] = max(utilization.get(resource, 0), value)
+    if not utilization:
+      return None
+    return max(utilization.items(), key=lambda kv: kv[1])[0]
@@ -0,0 +1,103 @@
+# Copyright 2013 The Regents of The University California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sample CPU, disk and network utilization on a cluster node.
+
+   Usage: python resource_sampler.py [interval]
+
+   Every `interval` seconds (default 1) this prints one JSON record with
+   the wall-clock time and, for the interval just ended, the fraction of
+   CPU time spent busy and in iowait, the busiest disk's utilization, and
+   disk and network (excluding loopback) bytes per second. It reads only
+   /proc/stat, /proc/diskstats and /proc/net/dev, and exits as soon as its
+   stdin is closed, so closing the ssh channel that started it stops it.
+
+   This runs on the cluster nodes, so it must stay compatible with the
+   Python 2.6 found there and may only use the standard library.
+"""
+
+import json
+import re
+import select
+import sys
+import time
+
+# Whole disks, not partitions
+DISK = re.compile(r"^(sd[a-z]+|xvd[a-z]+|hd[a-z]+|vd[a-z]+|nvme\d+n\d+)$")
+SECTOR_BYTES = 512
+
+def read_cpu():
+  fields = [int(x) for x in open("/proc/stat").readline().split()[1:]]
+  idle, iowait = fields[3], fields[4]
+  return sum(fields), idle, iowait
+
+def read_disks():
+  disks = {}
+  for line in open("/proc/diskstats"):
+    fields = line.split()
+    if DISK.match(fields[2]):
+      # Sectors read, sectors written, milliseconds spent doing I/O
+      disks[fields[2]] = (int(fields[5]), int(fields[9]), int(fields[12]))
+  return disks
+
+def read_net():
+  rx = tx = 0
+  for line in open("/proc/net/dev").readlines()[2:]:
+    name, data = line.split(":", 1)
+    if name.strip() == "lo":
+      continue
+    fields = data.split()
+    rx += int(fields[0])
+    tx += int(fields[8])
+  return rx, tx
+
+def snapshot():
+  return time.time(), read_cpu(), read_disks(), read_net()
+
+def sample(before, after):
+  t0, (total0, idle0, iowait0), disks0, (rx0, tx0) = before
+  t1, (total1, idle1, iowait1), disks1, (rx1, tx1) = after
+  elapsed = max(t1 - t0, 1e-6)
+  ticks = max(total1 - total0, 1)
+  read = write = 0
+  disk_util = 0.0
+  for name in disks1:
+    if name in disks0:
+      read += disks1[name][0] - disks0[name][0]
+      write += disks1[name][1] - disks0[name][1]
+      disk_util = max(disk_util,
+                      (disks1[name][2] - disks0[name][2]) / (elapsed * 1e3))
+  return {"t": t1,
+          "cpu_busy": 1 - float(idle1 - idle0 + iowait1 - iowait0) / ticks,
+          "cpu_iowait": float(iowait1 - iowait0) / ticks,
+          "disk_util": min(disk_util, 1.0),
+          "disk_read": read * SECTOR_BYTES / elapsed,
+          "disk_write": write * SECTOR_BYTES / elapsed,
+          "net_rx": (rx1 - rx0) / elapsed,
+          "net_tx": (tx1 - tx0) / elapsed}
+
+def main():
+  interval = len(sys.argv) > 1 and float(sys.argv[1]) or 1.0
+  last = snapshot()
+  while True:
+    readable = select.select([sys.stdin], [], [], interval)[0]
+    if readable and not sys.stdin.readline():
+      return 0
+    now = snapshot()
+    sys.stdout.write(json.dumps(sample(last, now)) + "\n")
+    sys.stdout.flush()
+    last = now
+
+if __name__ == "__main__":
+  sys.exit(main())
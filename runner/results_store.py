@@ -0,0 +1,110 @@
+# Copyright 2013 The Regents of The University California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Append-only store of structured benchmark results.
+
+   Every trial is one JSON object on its own line (engine, query, scale
+   factor, cache mode, trial index, wall time, parsed sub-times, hosts...).
+   Appends take an exclusive lock, so several runner processes can share
+   one file. Run this module directly to summarize a store:
+
+     python results_store.py results.jsonl --engine shark_mem --query 1a
+"""
+
+import fcntl
+import json
+import sys
+from optparse import OptionParser
+
+import stats
+
+# Default store used by run_query.py
+DEFAULT_STORE = "results.jsonl"
+
+def append(path, records):
+  """Atomically append a list of records to the store at `path`."""
+  if not records:
+    return
+  data = "".join(json.dumps(r, sort_keys=True) + "\n" for r in records)
+  out = open(path, 'a')
+  try:
+    fcntl.flock(out, fcntl.LOCK_EX)
+    out.write(data)
+    out.flush()
+  finally:
+    fcntl.flock(out, fcntl.LOCK_UN)
+    out.close()
+
+def load(paths, **filters):
+  """Yield every record in the given stores whose fields match `filters`.
+
+     A filter value may be a single value or a list of accepted values.
+  """
+  if isinstance(paths, basestring):
+    paths = [paths]
+  for key, value in filters.items():
+    if not isinstance(value, (list, tuple, set)):
+      filters[key] = [value]
+  for path in paths:
+    for line in open(path):
+      # Skip the JSON decoding of lines that can't possibly match
+      if any(not any(json.dumps(v) in line for v in values)
+             for values in filters.values()):
+        continue
+      record = json.loads(line)
+      if all(record.get(k) in values for k, values in filters.items()):
+        yield record
+
+def group(records, *keys):
+  """Group records into a dict keyed by the tuple of the given fields."""
+  groups = {}
+  for r in records:
+    groups.setdefault(tuple(r.get(k) for k in keys), []).append(r)
+  return groups
+
+def parse_args():
+  parser = OptionParser(usage="results_store.py [options] STORE...")
+  parser.add_option("--engine", action="append",
+      help="Only include this engine (may be repeated)")
+  parser.add_option("--query", action="append",
+      help="Only include this query (may be repeated)")
+  parser.add_option("--run-id", action="append",
+      help="Only include this run (may be repeated)")
+  parser.add_option("--kind", default="latency",
+      help="Kind of record to summarize (latency or throughput)")
+  (opts, args) = parser.parse_args()
+  if not args:
+    parser.print_help()
+    sys.exit(1)
+  return opts, args
+
+def main():
+  opts, paths = parse_args()
+  filters = {"kind": opts.kind}
+  for key in ["engine", "query", "run_id"]:
+    if getattr(opts, key):
+      filters[key] = getattr(opts, key)
+
+  groups = group(load(paths, **filters), "engine", "scale_factor", "query")
+  print "Engine\tScale\tQuery\tTrials\tMin\tMedian\tMax"
+  for (engine, scale_factor, query), records in sorted(groups.items()):
+    times = [r["time"] for r in records if r.get("time") is not None]
+    if not times:
+      continue
+    print "%s\t%s\t%s\t%d\t%.2f\t%.2f\t%.2f" % (
+      engine, scale_factor, query, len(times), min(times),
+      stats.median(times), max(times))
+
+if __name__ == "__main__":
+  main()
@@ -12,146 +12,57 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Run a single query from the big data benchmark on a remote EC2 cluster.
-
-   This will execute a single query from the benchmark multiple times
-   and output percentile results. Note that to run an entire suite of
-   queries, you'll need to wrap this script and call run multiple times.
+"""Run queries from the big data benchmark on a remote EC2 cluster.
+
+   This will execute one or more queries from the benchmark multiple times
+   and output percentile results for each. When several queries are given,
+   they run as a suite in one session: cluster setup, warmup queries and
+   cached tables are shared instead of being redone for every query. When
+   several engines are given, each is benchmarked on its own cluster at
+   the same time. --local runs the queries on local files instead (see
+   local_engine.py), without a cluster.
 """
 
 import subprocess
 import sys
 from sys import stderr
-from optparse import OptionParser
+from optparse import OptionParser, Values
 import os
 import time
 import datetime
 import re
 import multiprocessing
+import json
+import socket
 from StringIO import StringIO
 from pg8000 import DBAPI
+import ssh_pool
+from ssh_pool import ssh, scp_to, scp_from
+from fanout import fan_out, summarize, DEFAULT_PARALLELISM
+import throughput
+import results_store
+import stats
+import queries
+import log_parser
+import plans
+import verify
+import columnar
+from resource_monitor import Monitor
+from faults import FaultInjector, DEFAULT_PROCESS
+from table_state import DerivedTable
+from local_engine import LocalEngine
+from queries import TMP_TABLE, TMP_TABLE_CACHED, CLEAN_QUERY, QUERY_MAP, \
+    IMPALA_MAP, SUITE_QUERIES, family_of
 
 # A scratch directory on your filesystem
 LOCAL_TMP_DIR = "/tmp"
 
 ### Benchmark Queries ###
-TMP_TABLE = "result"
-TMP_TABLE_CACHED = "result_cached"
-CLEAN_QUERY = "DROP TABLE %s;" % TMP_TABLE
-
-# TODO: Factor this out into a separate file
-QUERY_1a_HQL = "SELECT pageURL, pageRank FROM rankings WHERE pageRank > 1000"
-QUERY_1b_HQL = QUERY_1a_HQL.replace("1000", "100")
-QUERY_1c_HQL = QUERY_1a_HQL.replace("1000", "10")
-
-QUERY_2a_HQL = "SELECT SUBSTR(sourceIP, 1, 8), SUM(adRevenue) FROM " \
-                 "uservisits GROUP BY SUBSTR(sourceIP, 1, 8)"
-QUERY_2b_HQL = QUERY_2a_HQL.replace("8", "10")
-QUERY_2c_HQL = QUERY_2a_HQL.replace("8", "12")
-
-QUERY_3a_HQL = """SELECT sourceIP,
-                          sum(adRevenue) as totalRevenue,
-                          avg(pageRank) as pageRank
-                   FROM
-                     rankings R JOIN
-                     (SELECT sourceIP, destURL, adRevenue
-                      FROM uservisits UV
-                      WHERE UV.visitDate > "1980-01-01"
-                      AND UV.visitDate < "1980-04-01")
-                      NUV ON (R.pageURL = NUV.destURL)
-                   GROUP BY sourceIP
-                   ORDER BY totalRevenue DESC
-                   LIMIT 1"""
-QUERY_3a_HQL = " ".join(QUERY_3a_HQL.replace("\n", "").split())
-QUERY_3b_HQL = QUERY_3a_HQL.replace("1980-04-01", "1983-01-01")
-QUERY_3c_HQL = QUERY_3a_HQL.replace("1980-04-01", "2010-01-01")
-
-QUERY_4_HQL = """DROP TABLE IF EXISTS url_counts_partial;
-                 CREATE TABLE url_counts_partial AS
-                   SELECT TRANSFORM (line)
-                   USING "python /root/url_count.py" as (sourcePage,
-                     destPage, count) from documents;
-                 DROP TABLE IF EXISTS url_counts_total;
-                 CREATE TABLE url_counts_total AS
-                   SELECT SUM(count) AS totalCount, destpage
-                   FROM url_counts_partial GROUP BY destpage;"""
-QUERY_4_HQL = " ".join(QUERY_4_HQL.replace("\n", "").split())
-
-QUERY_4_HQL_HIVE_UDF = """DROP TABLE IF EXISTS url_counts_partial;
-                 CREATE TABLE url_counts_partial AS
-                   SELECT TRANSFORM (line)
-                   USING "python /tmp/url_count.py" as (sourcePage,
-                     destPage, count) from documents;
-                 DROP TABLE IF EXISTS url_counts_total;
-                 CREATE TABLE url_counts_total AS
-                   SELECT SUM(count) AS totalCount, destpage
-                   FROM url_counts_partial GROUP BY destpage;"""
-QUERY_4_HQL_HIVE_UDF = " ".join(QUERY_4_HQL_HIVE_UDF.replace("\n", "").split())
-
-QUERY_1_PRE = "CREATE TABLE %s (pageURL STRING, pageRank INT);" % TMP_TABLE
-QUERY_2_PRE = "CREATE TABLE %s (sourceIP STRING, adRevenue DOUBLE);" % TMP_TABLE
-QUERY_3_PRE = "CREATE TABLE %s (sourceIP STRING, " \
-    "adRevenue DOUBLE, pageRank DOUBLE);" % TMP_TABLE
-
-QUERY_1a_SQL = QUERY_1a_HQL
-QUERY_1b_SQL = QUERY_1b_HQL
-QUERY_1c_SQL = QUERY_1c_HQL
-
-QUERY_2a_SQL = QUERY_2a_HQL.replace("SUBSTR", "SUBSTRING")
-QUERY_2b_SQL = QUERY_2b_HQL.replace("SUBSTR", "SUBSTRING")
-QUERY_2c_SQL = QUERY_2c_HQL.replace("SUBSTR", "SUBSTRING")
-QUERY_3a_SQL = """SELECT sourceIP, totalRevenue, avgPageRank
-                    FROM
-                      (SELECT sourceIP,
-                              AVG(pageRank) as avgPageRank,
-                              SUM(adRevenue) as totalRevenue
-                      FROM Rankings AS R, UserVisits AS UV
-                      WHERE R.pageURL = UV.destinationURL
-                      AND UV.visitDate
-                        BETWEEN Date('1980-01-01') AND Date('1980-04-01')
-                      GROUP BY UV.sourceIP)
-                   ORDER BY totalRevenue DESC LIMIT 1""".replace("\n", "")
-QUERY_3a_SQL = " ".join(QUERY_3a_SQL.replace("\n", "").split())
-QUERY_3b_SQL = QUERY_3a_SQL.replace("1980-04-01", "1983-01-01")
-QUERY_3c_SQL = QUERY_3a_SQL.replace("1980-04-01", "2010-01-01")
-
-def create_as(query):
-  return "CREATE TABLE %s AS %s;" % (TMP_TABLE, query)
-def insert_into(query):
-  return "INSERT INTO TABLE %s %s;" % (TMP_TABLE, query)
-def count(query):
-  return query
-  return "SELECT COUNT(*) FROM (%s) q;" % query
-
-IMPALA_MAP = {'1a': QUERY_1_PRE, '1b': QUERY_1_PRE, '1c': QUERY_1_PRE,
-              '2a': QUERY_2_PRE, '2b': QUERY_2_PRE, '2c': QUERY_2_PRE,
-              '3a': QUERY_3_PRE, '3b': QUERY_3_PRE, '3c': QUERY_3_PRE}
-
-TEZ_MAP =    {'1a':(count(QUERY_1a_HQL),), '1b':(count(QUERY_1b_HQL),), '1c': (count(QUERY_1c_HQL),),
-              '2a':(count(QUERY_2a_HQL),), '2b':(count(QUERY_2b_HQL),), '2c': (count(QUERY_2c_HQL),),
-              '3a':(count(QUERY_3a_HQL),), '3b':(count(QUERY_3b_HQL),), '3c': (count(QUERY_3c_HQL),)}
-
-QUERY_MAP = {
-             '1a':  (create_as(QUERY_1a_HQL), insert_into(QUERY_1a_HQL),
-                     create_as(QUERY_1a_SQL)),
-             '1b':  (create_as(QUERY_1b_HQL), insert_into(QUERY_1b_HQL),
-                     create_as(QUERY_1b_SQL)),
-             '1c':  (create_as(QUERY_1c_HQL), insert_into(QUERY_1c_HQL),
-                     create_as(QUERY_1c_SQL)),
-             '2a': (create_as(QUERY_2a_HQL), insert_into(QUERY_2a_HQL),
-                    create_as(QUERY_2a_SQL)),
-             '2b': (create_as(QUERY_2b_HQL), insert_into(QUERY_2b_HQL),
-                    create_as(QUERY_2b_SQL)),
-             '2c': (create_as(QUERY_2c_HQL), insert_into(QUERY_2c_HQL),
-                    create_as(QUERY_2c_SQL)),
-             '3a': (create_as(QUERY_3a_HQL), insert_into(QUERY_3a_HQL),
-                    create_as(QUERY_3a_SQL)),
-             '3b': (create_as(QUERY_3b_HQL), insert_into(QUERY_3b_HQL),
-                    create_as(QUERY_3b_SQL)),
-             '3c': (create_as(QUERY_3c_HQL), insert_into(QUERY_3c_HQL),
-                    create_as(QUERY_3c_SQL)),
-             '4':  (QUERY_4_HQL, None, None),
-             '4_HIVE':  (QUERY_4_HQL_HIVE_UDF, None, None)}
+# Hive variables used to tag trials that share one CLI session, and the
+# checksums of their results
+TRIAL_MARKER = "bdb.trial"
+CHECK_MARKER = "bdb.check"
+MARKER_LINE = re.compile(r"^bdb\.\w+=")
 
 # Turn a given query into a version using cached tables
 def make_input_cached(query):
@@ -165,6 +76,21 @@ def make_input_cached(query):
 def make_output_cached(query):
   return query.replace(TMP_TABLE, TMP_TABLE_CACHED)
 
+# Turn a given query into one reading the --table-variant copies of the
+# benchmark tables. Cached tables are left alone: they are built from the
+# copies instead.
+def make_input_variant(opts, query):
+  return columnar.use_variant(query, opts.table_variant)
+
+STREAM_TABLES = re.compile(r"\b(%s|%s|url_counts_partial|url_counts_total" \
+    r"|url_counts_partial_cached|url_counts_total_cached)\b" % (
+      TMP_TABLE, TMP_TABLE_CACHED))
+
+# Turn a given query into one whose output tables belong to a single
+# concurrent stream
+def make_stream_tables(query, stream):
+  return STREAM_TABLES.sub(r"\1_s%d" % stream, query)
+
 ### Runner ###
 def parse_args():
   parser = OptionParser(usage="run_query.py [options]")
@@ -181,6 +107,8 @@ def parse_args():
       help="Use in conjunction with --hive")
   parser.add_option("--hive-cdh", action="store_true", default=False,
       help="Hive on CDH cluster")
+  parser.add_option("--local", action="store_true", default=False,
+      help="Whether to include the local reference engine")
 
   parser.add_option("-g", "--shark-no-cache", action="store_true",
       default=False, help="Disable caching in Shark")
@@ -201,6 +129,10 @@ def parse_args():
       help="Hostname of Hive master node")
   parser.add_option("--hive-slaves",
       help="Hostnames of Hive slaves (comma seperated)")
+  parser.add_option("--local-data",
+      help="Local directory holding the rankings, uservisits and crawl data")
+  parser.add_option("--local-workers", type="int",
+      help="Worker processes of the local engine (default: one per core)")
 
   parser.add_option("-x", "--impala-identity-file",
       help="SSH private key file to use for logging into Impala node")
@@ -215,20 +147,114 @@ def parse_args():
   parser.add_option("-e", "--redshift-database",
       help="Database to use in Redshift")
   parser.add_option("--num-trials", type="int", default=10,
-      help="Number of trials to run for this query")
+      help="Number of trials to run for this query (the most to run, " \
+           "with --target-ci-width)")
+  parser.add_option("--target-ci-width", type="float",
+      help="Stop running trials of a query once the confidence interval " \
+           "of its median time is narrower than this fraction of the " \
+           "median, e.g. 0.05")
+  parser.add_option("--min-trials", type="int", default=3,
+      help="Fewest trials to run with --target-ci-width")
+  parser.add_option("--confidence", type="float", default=0.95,
+      help="Confidence level of reported and target intervals")
+  parser.add_option("--sample-resources", action="store_true",
+      default=False, help="Sample CPU, disk and network use on every " \
+      "worker during each trial and record it in the results store")
+  parser.add_option("--sample-interval", type="float", default=1.0,
+      help="Seconds between resource samples")
+  parser.add_option("--net-capacity", type="float", default=125,
+      help="Network bandwidth of each worker in MB/s, used to judge " \
+           "whether a trial was network bound")
+  parser.add_option("--no-warmup-queries", action="store_false",
+      dest="warmup_queries", default=True,
+      help="Skip the throwaway warmup queries and rely on warmup trials " \
+           "being detected and reported separately")
+  parser.add_option("--kill-worker-after", type="float",
+      help="Kill a worker process on one slave this many seconds into " \
+           "every trial, to measure how the engine recovers. Counted from " \
+           "the trial's first statement on Shark, once its result table " \
+           "exists on Impala, and from the start of the CLI on Hive")
+  parser.add_option("--kill-process",
+      help="Main class or program name of the worker to kill (default: %s)" %
+           ", ".join("%s for %s" % (p, e) for e, p in
+                     sorted(DEFAULT_PROCESS.items())))
+  parser.add_option("--restore-command",
+      help="Command run on the slave after a trial in which a worker was " \
+           "killed (default for Impala: restart impalad)")
+  parser.add_option("--trial-timeout", type="float",
+      help="Cancel a trial that runs longer than this many seconds, record " \
+           "it as timed out and go on with the next one")
+  parser.add_option("--verify", action="store_true", default=False,
+      help="Checksum the result of every query on the engine after its " \
+           "last trial, check it against the catalog and store it " \
+           "(compare engines with verify.py)")
+  parser.add_option("--capture-plans", action="store_true", default=False,
+      help="Store the EXPLAIN output of every query in the results store " \
+           "(compare plans between runs with plans.py)")
+  parser.add_option("--table-variant",
+      help="Run queries 1-3 against the copies of rankings and uservisits " \
+           "in this columnar format (%s), made by prepare_benchmark.py " \
+           "--columnar" % ", ".join(columnar.FORMATS))
+  parser.add_option("--rebuild-derived-tables", action="store_true",
+      default=False,
+      help="Rebuild tables derived from the benchmark data (such as " \
+           "scratch_rank) even if the data is unchanged since they were built")
   parser.add_option("--prefix", type="string", default="",
       help="Prefix result files with this string")
+  parser.add_option("--no-ssh-multiplexing", action="store_true",
+      default=False, help="Open a new SSH connection for every remote command")
+  parser.add_option("--host-parallelism", type="int",
+      default=DEFAULT_PARALLELISM,
+      help="Maximum number of hosts to contact concurrently")
+  parser.add_option("--setup-timeout", type="int", default=300,
+      help="Seconds to wait for Spark executors to stop or workers to start")
+
+  parser.add_option("--results-store", default=results_store.DEFAULT_STORE,
+      help="JSON-lines file every trial is appended to")
+  parser.add_option("--scale-factor", type="int",
+      help="Scale factor the data was prepared with (see " \
+           "prepare_benchmark.py), recorded with each trial")
+  parser.add_option("--num-nodes", type="int",
+      help="Number of worker nodes in the cluster, recorded with each " \
+           "trial (default: the number of hosts given)")
+
+  parser.add_option("--streams",
+      help="Measure throughput instead of latency, running this many " \
+           "concurrent query streams (comma separated to compare levels)")
+  parser.add_option("--stream-mix",
+      help="Queries each stream draws from, with optional weights, " \
+           "e.g. 1a:3,2a,3a:2 (default: the --query-num queries)")
+  parser.add_option("--queries-per-stream", type="int", default=5,
+      help="Number of queries each throughput stream runs")
+  parser.add_option("--seed", type="int", default=0,
+      help="Random seed for the order of queries in each stream")
 
   parser.add_option("-q", "--query-num", default="1a",
-                    help="Which query to run in benchmark: " \
-                    "%s" % ", ".join(QUERY_MAP.keys()))
+                    help="Which queries to run in benchmark, comma " \
+                    "separated, or \"all\": %s. Other points of queries " \
+                    "1-3 are named <query>@<value>, and for queries 1 and 2 " \
+                    "<query>@<low>..<high>[+step|*factor] sweeps over " \
+                    "many of them, " \
+                    "e.g. 1@1..10000*10" % ", ".join(SUITE_QUERIES))
 
   (opts, args) = parser.parse_args()
 
-  if not (opts.impala or opts.shark or opts.redshift or opts.hive or opts.hive_cdh):
+  if not (opts.impala or opts.shark or opts.redshift or opts.hive or
+          opts.hive_cdh or opts.local):
     parser.print_help()
     sys.exit(1)
 
+  if opts.local and opts.local_data is None:
+    print >> stderr, "The local engine requires a data directory"
+    sys.exit(1)
+
+  if opts.table_variant:
+    for engine in ENGINES:
+      if getattr(opts, engine) and opts.table_variant not in \
+          columnar.ENGINE_FORMATS.get(engine, []):
+        print >> stderr, "%s has no %s tables" % (engine, opts.table_variant)
+        sys.exit(1)
+
   if opts.impala and (opts.impala_identity_file is None or
                       opts.impala_hosts is None):
     print >> stderr, "Impala requires identity file and hostname"
@@ -257,31 +283,205 @@ def parse_args():
     opts.hive_slaves = opts.hive_slaves.split(",")
     print >> stderr, "Hive slaves:\n%s" % "\n".join(opts.hive_slaves)
 
-  if opts.query_num not in QUERY_MAP:
-    print >> stderr, "Unknown query number: %s" % opts.query_num
-    sys.exit(1)
-
-  return opts
-
-# Run a command on a host through ssh, throwing an exception if ssh fails
-def ssh(host, username, identity_file, command):
-  return subprocess.check_call(
-      "ssh -t -o StrictHostKeyChecking=no -i %s %s@%s '%s'" %
-      (identity_file, username, host, command), shell=True)
+  if opts.no_ssh_multiplexing:
+    ssh_pool.POOL.enabled = False
 
-# Copy a file to a given host through scp, throwing an exception if scp fails
-def scp_to(host, identity_file, username, local_file, remote_file):
-  subprocess.check_call(
-      "scp -q -o StrictHostKeyChecking=no -i %s '%s' '%s@%s:%s'" %
-      (identity_file, local_file, username, host, remote_file), shell=True)
+  opts.all_queries = opts.query_num == "all"
+  if opts.all_queries:
+    opts.query_nums = list(SUITE_QUERIES)
+  else:
+    try:
+      opts.query_nums = [q for spec in opts.query_num.split(",")
+                         for q in queries.expand(spec)]
+    except ValueError as e:
+      print >> stderr, e
+      sys.exit(1)
+  opts.query_num = opts.query_nums[0]
 
-# Copy a file to a given host through scp, throwing an exception if scp fails
-def scp_from(host, identity_file, username, remote_file, local_file):
-  subprocess.check_call(
-      "scp -q -o StrictHostKeyChecking=no -i %s '%s@%s:%s' '%s'" %
-      (identity_file, username, host, remote_file, local_file), shell=True)
+  return opts
 
-def run_shark_benchmark(opts):
+# Time of a trial from the timings the CLI printed while running it, or None
+# if there are none. This is the time of the trial's last statement, except
+# for Query 4, which times only the statements creating its two tables.
+def parse_trial_time(query_num, content):
+  statements = log_parser.parse(content)
+  if not statements:
+    return None
+
+  if family_of(query_num) == '4':
+    texts = [q for q in QUERY_MAP['4'][0].split(";") if q.strip()]
+    parts = [st["time"] for text, st in
+             zip(texts, statements[-len(texts):])
+             if not text.strip().upper().startswith("DROP")]
+    print "Parts: %s" % ", ".join(map(str, parts))
+    return sum(parts)
+  return statements[-1]["time"] # Only want time of last query
+
+# Reported for a trial whose output has no timings, e.g. because it was cut
+# short, in the format of Hive's failures (see log_parser.FAILED)
+NO_TIMINGS = "FAILED: No statement timings in the output"
+
+# Time of a trial, or if it failed (e.g. because a worker was killed) or was
+# cancelled for running too long, how long it ran before that. A trial without
+# timings is marked failed in `content`.
+def trial_time(query_num, content, start, end):
+  recovery = log_parser.recovery(content)
+  if recovery["failed"] or recovery["timed_out"]:
+    return end - start
+  result = parse_trial_time(query_num, content)
+  if result is None:
+    print >> stderr, "Query %s: %s" % (query_num, NO_TIMINGS)
+    content.append(NO_TIMINGS)
+    return end - start
+  return result
+
+# Reported for a trial cancelled after running `timeout` seconds, in the
+# format trial_agent.py uses (see log_parser.TIMED_OUT)
+TIMED_OUT = "Timed out after %g seconds"
+
+# Seconds an interrupted query gets to exit before it is killed
+CANCEL_GRACE = 15
+
+# Redshift's error for a statement cancelled by statement_timeout
+STATEMENT_TIMEOUT = re.compile(r"(?i)statement timeout|cancel")
+
+# Have Redshift cancel any statement of this session running longer than
+# `timeout` seconds. Committed, so rolling back a cancelled statement doesn't
+# undo it.
+def set_statement_timeout(conn, timeout):
+  conn.cursor().execute("SET statement_timeout TO %d" % int(timeout * 1000))
+  conn.commit()
+
+# Hive and Shark print "<key>=<value>" for a bare "SET <key>;", which lets a
+# single CLI session tag the output of each trial it runs.
+def mark_trial(query_num, trial):
+  return "SET %s=%s:%s; SET %s;" % (
+    TRIAL_MARKER, query_num, trial, TRIAL_MARKER)
+
+def mark_check(query_num):
+  return "SET %s=%s; SET %s;" % (CHECK_MARKER, query_num, CHECK_MARKER)
+
+# Split CLI output into (value, lines) groups, one for every line printed for
+# `marker`. A group ends at the next marker of any kind. Lines before the
+# first marker belong to setup statements and are dropped.
+def split_marked(lines, marker):
+  groups = []
+  group = None
+  for line in lines:
+    if MARKER_LINE.match(line):
+      group = None
+      if line.startswith(marker + "="):
+        group = []
+        groups.append((line.strip().split("=", 1)[1], group))
+    elif group is not None:
+      group.append(line)
+  return groups
+
+# Split CLI output into ((query_num, trial), lines) groups using the markers
+# emitted by mark_trial()
+def split_trials(lines):
+  trials = []
+  for value, group in split_marked(lines, TRIAL_MARKER):
+    query_num, trial = value.rsplit(":", 1)
+    trials.append(((query_num, int(trial)), group))
+  return trials
+
+# Wall-clock window of every trial in an agent step record whose output was
+# tagged by mark_trial(). A trial runs from its marker to the next marker.
+def trial_windows(record):
+  marks = [(line, t) for line, t in zip(record["lines"], record["line_times"])
+           if MARKER_LINE.match(line)]
+  ends = [t for line, t in marks[1:]] + [record["wall_end"]]
+  windows = {}
+  for (line, t), end in zip(marks, ends):
+    if line.startswith(TRIAL_MARKER + "="):
+      q, i = line.strip().split("=", 1)[1].rsplit(":", 1)
+      windows[(q, int(i))] = (t, end)
+  return windows
+
+# Statement whose plan is captured for a query: the one a trial times, or for
+# Query 4 the first of its two (the second reads the table the first creates)
+def explained_statement(query_num, statements):
+  texts = [q for q in statements.split(";")
+           if q.strip() and q.split()[0].upper() not in ("SET", "DROP")]
+  if family_of(query_num) == '4':
+    return texts[0]
+  return texts[-1]
+
+# Agent step that runs `command` to capture the plan of a query
+def plan_step(query_num, command):
+  return {"id": ["plan", query_num], "command": command,
+          "exclude": plans.NOISE}
+
+def is_plan(record):
+  return isinstance(record["id"], list) and record["id"][0] == "plan"
+
+# Agent step that runs `command` to checksum the result of a query
+def checksum_step(query_num, command):
+  return {"id": ["checksum", query_num], "command": command,
+          "include": verify.CHECKSUM_ROW.pattern}
+
+def is_checksum(record):
+  return isinstance(record["id"], list) and record["id"][0] == "checksum"
+
+# Write a shell script locally, copy it to the given host and make it
+# executable there
+def push_script(host, identity_file, username, lines, remote_file):
+  local_file = os.path.join(LOCAL_TMP_DIR, os.path.basename(remote_file))
+  script = open(local_file, 'w')
+  script.write("".join(lines))
+  script.close()
+  scp_to(host, identity_file, username, local_file, remote_file)
+  ssh(host, username, identity_file, "chmod 775 %s" % remote_file)
+  os.remove(local_file)
+
+# Hosts and paths the trial agent has already been copied to
+AGENT_COPIES = set()
+
+# Run steps on a remote host through trial_agent.py, copying the agent there
+# the first time. Yields the agent's record for each step as soon as it
+# finishes. Before any step marked as a barrier, on_barrier(step_id) is called
+# while the agent waits; the step is skipped if it returns False. Lines a step
+# is to notify about are passed to on_line(step_id, line) as they are printed.
+def run_agent(host, identity_file, username, remote_dir, steps,
+              on_barrier=None, env="", on_line=None):
+  remote_agent = "%s/trial_agent.py" % remote_dir
+  if (host, remote_agent) not in AGENT_COPIES:
+    local_agent = os.path.join(
+      os.path.dirname(os.path.abspath(__file__)), "trial_agent.py")
+    scp_to(host, identity_file, username, local_agent, remote_agent)
+    AGENT_COPIES.add((host, remote_agent))
+
+  proc = ssh_pool.POOL.popen(host, username, identity_file,
+                             "%spython %s" % (env, remote_agent))
+  proc.stdin.write(json.dumps({"steps": steps}) + "\n")
+  proc.stdin.flush()
+  for line in iter(proc.stdout.readline, ""):
+    try:
+      record = json.loads(line)
+    except ValueError:
+      continue # Login banners and other noise
+    if not isinstance(record, dict):
+      continue
+    if record["type"] == "ready":
+      if on_barrier is not None and on_barrier(record["id"]) is False:
+        proc.stdin.write("skip\n")
+      else:
+        proc.stdin.write("go\n")
+      proc.stdin.flush()
+    elif record["type"] == "line":
+      if on_line is not None:
+        on_line(record["id"], record["line"].encode("utf-8"))
+    elif record["type"] == "step":
+      record["lines"] = [l.encode("utf-8") for l in record["lines"]]
+      yield record
+  proc.stdin.close()
+  ret = proc.wait()
+  if ret != 0:
+    raise subprocess.CalledProcessError(ret, "trial agent on %s" % host)
+
+def run_shark_suite(opts, query_nums, monitor=None, plans_out=None,
+                    injector=None, checksums_out=None, quiesce_out=None):
   def ssh_shark(command):
     command = "source /root/.bash_profile; %s" % command
     ssh(opts.shark_host, "root", opts.shark_identity_file, command)
@@ -290,14 +490,8 @@ def run_shark_benchmark(opts):
   local_query_map = QUERY_MAP
 
   prefix = str(time.time()).split(".")[0]
-  query_file_name = "%s_workload.sh" % prefix
   slaves_file_name = "%s_slaves" % prefix
-  local_query_file = os.path.join(LOCAL_TMP_DIR, query_file_name)
   local_slaves_file = os.path.join(LOCAL_TMP_DIR, slaves_file_name)
-  query_file = open(local_query_file, 'w')
-  remote_result_file = "/mnt/%s_results" % prefix
-  remote_tmp_file = "/mnt/%s_out" % prefix
-  remote_query_file = "/mnt/%s" % query_file_name
 
   runner = "/root/shark/bin/shark-withinfo"
 
@@ -305,24 +499,22 @@ def run_shark_benchmark(opts):
   scp_from(opts.shark_host, opts.shark_identity_file, "root",
            "/root/spark-ec2/slaves", local_slaves_file)
   slaves = map(str.strip, open(local_slaves_file).readlines())
+  os.remove(local_slaves_file)
 
   print "Restarting standalone scheduler..."
   ssh_shark("/root/spark/bin/stop-all.sh")
-  ensure_spark_stopped_on_slaves(slaves)
-  time.sleep(30)
-  ssh_shark("/root/spark/bin/stop-all.sh")
+  startup_wait = ensure_spark_stopped_on_slaves(slaves)
   ssh_shark("/root/spark/bin/start-all.sh")
-  time.sleep(10)
+  startup_wait += wait_for_spark_workers(len(slaves))
+
+  warmup_table = DerivedTable("warmup", ["/user/shark/benchmark/scratch"],
+                              "/root/ephemeral-hdfs/bin/hadoop", "/mnt")
+  if opts.warmup_queries and any(family_of(q) == '1' for q in query_nums):
+    check_derived_table(opts, warmup_table, opts.shark_host, "root",
+                        opts.shark_identity_file)
 
   # Two modes here: Shark Mem and Shark Disk. If using Shark disk clear buffer
   # cache in-between each query. If using Shark Mem, used cached tables.
-
-  query_list = "set mapred.reduce.tasks = %s;" % opts.reduce_tasks
-
-  # Throw away query for JVM warmup
-  query_list += "SELECT COUNT(*) FROM scratch;"
-
-  # Create cached queries for Shark Mem
   if not opts.shark_no_cache:
     local_clean_query = make_output_cached(CLEAN_QUERY)
 
@@ -331,227 +523,435 @@ def run_shark_benchmark(opts):
 
     local_query_map = {k: convert_to_cached(v) for k, v in QUERY_MAP.items()}
 
-    # Set up cached tables
-    if '4' in opts.query_num:
-      # Query 4 uses entirely different tables
-      query_list += """
-                    DROP TABLE IF EXISTS documents_cached;
-                    CREATE TABLE documents_cached AS SELECT * FROM documents;
-                    """
-    else:
-      query_list += """
-                    DROP TABLE IF EXISTS uservisits_cached;
-                    DROP TABLE IF EXISTS rankings_cached;
-                    CREATE TABLE uservisits_cached AS SELECT * FROM uservisits;
-                    CREATE TABLE rankings_cached AS SELECT * FROM rankings;
-                    """
-
-  # Warm up for Query 1
-  if '1' in opts.query_num:
-    query_list += "DROP TABLE IF EXISTS warmup;"
-    query_list += "CREATE TABLE warmup AS SELECT pageURL, pageRank FROM scratch WHERE pageRank > 1000;"
-
-  if '4' not in opts.query_num:
-    query_list += local_clean_query
-  query_list += local_query_map[opts.query_num][0]
-
-  query_list = re.sub("\s\s+", " ", query_list.replace('\n', ' '))
-
-  print "\nQuery:"
-  print query_list.replace(';', ";\n")
-
+  # Statements run at the start of a session that runs the given queries
+  def make_setup(session_queries):
+    setup = "set mapred.reduce.tasks = %s;" % opts.reduce_tasks
+
+    # Throw away query for JVM warmup
+    if opts.warmup_queries:
+      setup += "SELECT COUNT(*) FROM scratch;"
+
+    # Set up cached tables for Shark Mem, once per session. These live in the
+    # memory of the session's Shark CLI, so unlike tables on disk they can't
+    # be reused by later sessions.
+    if not opts.shark_no_cache:
+      if any(family_of(q) == '4' for q in session_queries):
+        # Query 4 uses entirely different tables
+        setup += """
+                 DROP TABLE IF EXISTS documents_cached;
+                 CREATE TABLE documents_cached AS SELECT * FROM documents;
+                 """
+      if any(family_of(q) != '4' for q in session_queries):
+        setup += """
+                 DROP TABLE IF EXISTS uservisits_cached;
+                 DROP TABLE IF EXISTS rankings_cached;
+                 CREATE TABLE uservisits_cached AS SELECT * FROM uservisits;
+                 CREATE TABLE rankings_cached AS SELECT * FROM rankings;
+                 """
+
+    # Warm up for Query 1
+    if opts.warmup_queries and not warmup_table.current and \
+        any(family_of(q) == '1' for q in session_queries):
+      setup += "DROP TABLE IF EXISTS warmup;"
+      setup += "CREATE TABLE warmup AS SELECT pageURL, pageRank FROM scratch WHERE pageRank > 1000;"
+    return setup
+
+  def trial_statements(query_num, trial):
+    statements = mark_trial(query_num, trial)
+    if family_of(query_num) != '4':
+      statements += local_clean_query
+    return statements + local_query_map[query_num][0]
+
+  # The cached result table only exists inside the session, so it is
+  # checksummed right after the last trial of its query there
+  def check_statements(query_num):
+    statement = verify.checksum_statement(query_num, "hql")
+    if not opts.shark_no_cache:
+      statement = make_input_cached(make_output_cached(statement))
+    return mark_check(query_num) + statement
+
+  # Each session is one Shark CLI invocation. Trials that need a cold buffer
+  # cache must each get their own session so the cache can be dropped first.
+  # When stopping adaptively, each session runs a batch of --min-trials trials
+  # of one query, so the remaining batches can be skipped once the query's
+  # time is known precisely enough. Otherwise every trial of every query
+  # shares one warmed session and the cached tables are built only once.
+  rule = stopping_rule(opts)
+  trials = [(q, i) for q in query_nums for i in range(opts.num_trials)]
   if opts.clear_buffer_cache:
-    query_file.write("python /root/shark/bin/dev/clear-buffer-cache.py\n")
-
-  query_file.write(
-    "%s -e '%s' > %s 2>&1\n" % (runner, query_list, remote_tmp_file))
-
-  query_file.write(
-      "cat %s | grep Time | grep -v INFO |grep -v MapReduce >> %s\n" % (
-        remote_tmp_file, remote_result_file))
-
-  query_file.close()
+    sessions = [[t] for t in trials]
+  elif opts.target_ci_width is not None:
+    batch = max(rule.min_trials, 1)
+    sessions = [[(q, i) for i in range(b, min(b + batch, opts.num_trials))]
+                for q in query_nums for b in range(0, opts.num_trials, batch)]
+  else:
+    sessions = [trials]
+
+  # Plans are explained against the tables on disk: the cached tables only
+  # exist inside the session that builds them
+  steps = []
+  if plans_out is not None:
+    for query_num in query_nums:
+      statement = explained_statement(
+        query_num, make_input_variant(opts, QUERY_MAP[query_num][0]))
+      steps.append(plan_step(query_num, "/root/shark/bin/shark -e '%s%s'" % (
+        "set mapred.reduce.tasks = %s;" % opts.reduce_tasks,
+        plans.explain(statement))))
+
+  # Agent step running session `n`. A trial's deadline starts at its marker,
+  # so building the cached tables doesn't count against the first one.
+  def session_step(n):
+    session = sessions[n]
+    query_list = make_setup(set(q for q, i in session))
+    for k, (q, i) in enumerate(session):
+      query_list += trial_statements(q, i)
+      if checksums_out is not None and \
+          q not in [later for later, j in session[k + 1:]]:
+        query_list += check_statements(q)
+    query_list = re.sub("\s\s+", " ", query_list.replace('\n', ' '))
+    query_list = make_input_variant(opts, query_list)
+
+    print "\nQuery:"
+    print query_list.replace(';', ";\n")
+
+    pre = []
+    if opts.clear_buffer_cache:
+      pre.append("python /root/shark/bin/dev/clear-buffer-cache.py")
+    return {"id": n, "barrier": True, "pre": pre,
+            "command": "%s -e '%s'" % (runner, query_list),
+            "include": "|".join([log_parser.INCLUDE, MARKER_LINE.pattern,
+                                 verify.CHECKSUM_ROW.pattern]),
+            "notify": injector and "^%s=" % TRIAL_MARKER,
+            "timeout": opts.trial_timeout,
+            "timeout_from": MARKER_LINE.pattern}
+
+  steps.extend(session_step(n) for n in range(len(sessions)))
+
+  results = {q: ([], []) for q in query_nums}
+
+  # Seconds spent waiting for the cluster to quiesce before each session,
+  # counting the restart above towards the first one
+  session_waits = {}
+  def before_session(step_id):
+    if not any(rule.wants_more(results[q][0]) for q, i in sessions[step_id]):
+      return False
+    print "Stopping Executors on Slaves....."
+    session_waits[step_id] = ensure_spark_stopped_on_slaves(slaves)
+    if len(session_waits) == 1:
+      session_waits[step_id] += startup_wait
 
-  print "Copying files to Shark"
-  scp_to(opts.shark_host, opts.shark_identity_file, "root", local_query_file,
-      remote_query_file)
-  ssh_shark("chmod 775 %s" % remote_query_file)
+  # A trial starts when its marker is printed
+  def on_marker(step_id, line):
+    query_num, trial = line.strip().split("=", 1)[1].rsplit(":", 1)
+    injector.arm((query_num, int(trial)))
 
   # Run benchmark
   print "Running remote benchmark..."
+  if monitor:
+    monitor.start(slaves, "root", opts.shark_identity_file)
+  if injector:
+    injector.start(slaves, "root", opts.shark_identity_file)
+  # A session cancelled because one of its trials timed out loses the trials
+  # after it, so those get a new session of their own
+  while steps:
+    retries = []
+    for record in run_agent(opts.shark_host, opts.shark_identity_file, "root",
+                            "/mnt", steps, on_barrier=before_session,
+                            env="source /root/.bash_profile; ",
+                            on_line=on_marker):
+      if is_plan(record):
+        plans_out[record["id"][1]] = record["lines"]
+        continue
+      if injector:
+        injector.disarm()
+      print "Session %s took %.2fs on the master" % (
+        record["id"], record["elapsed"])
+      if record["returncode"] == 0 and \
+          any(family_of(q) == '1' for q, i in sessions[record["id"]]):
+        warmup_table.commit(opts.shark_host, "root", opts.shark_identity_file)
+
+      # Collect results
+      windows = trial_windows(record)
+      ran = set()
+      for (query_num, trial), content in split_trials(record["lines"]):
+        ran.add((query_num, trial))
+        if monitor:
+          monitor.mark(query_num, trial, *windows[(query_num, trial)])
+        print "Query %s : Trial %i" % (query_num, trial + 1)
+        result = trial_time(query_num, content, *windows[(query_num, trial)])
+        print "Result: ", result
+        print "Raw Times: ", content
+        results[query_num][0].append(result)
+        results[query_num][1].append(content)
+        if quiesce_out is not None:
+          quiesce_out[(query_num, len(results[query_num][0]) - 1)] = \
+            session_waits.get(record["id"])
+      for query_num, lines in split_marked(record["lines"], CHECK_MARKER):
+        checksums_out[query_num] = verify.parse_checksum(lines)
+
+      rest = [t for t in sessions[record["id"]] if t not in ran]
+      if record.get("timed_out") and rest:
+        print >> stderr, "Session %s timed out, running its %d remaining " \
+            "trial(s) in a new session" % (record["id"], len(rest))
+        sessions.append(rest)
+        retries.append(session_step(len(sessions) - 1))
+    steps = retries
+  if monitor:
+    monitor.stop()
+  if injector:
+    injector.stop()
+
+  return results
 
-  # Collect results
-  results = []
-  contents = []
-
-  for i in range(opts.num_trials):
-    print "Stopping Executors on Slaves....."
-    ensure_spark_stopped_on_slaves(slaves)
-    print "Query %s : Trial %i" % (opts.query_num, i+1)
-    ssh_shark("%s" % remote_query_file)
-    local_results_file = os.path.join(LOCAL_TMP_DIR, "%s_results" % prefix)
-    scp_from(opts.shark_host, opts.shark_identity_file, "root",
-        "/mnt/%s_results" % prefix, local_results_file)
-    content = open(local_results_file).readlines()
-    all_times = map(lambda x: float(x.split(": ")[1].split(" ")[0]), content)
-
-    if '4' in opts.query_num:
-      query_times = all_times[-4:]
-      part_a = query_times[1]
-      part_b = query_times[3]
-      print "Parts: %s, %s" % (part_a, part_b)
-      result = float(part_a) + float(part_b)
-    else:
-      result = all_times[-1] # Only want time of last query
-
-    print "Result: ", result
-    print "Raw Times: ", content
-
-    results.append(result)
-    contents.append(content)
-
-    # Clean-up
-    #ssh_shark("rm /mnt/%s*" % prefix)
-    print "Clean Up...."
-    ssh_shark("rm /mnt/%s_results" % prefix)
-    os.remove(local_results_file)
-
-  os.remove(local_slaves_file)
-  os.remove(local_query_file)
-
-  return results, contents
+def run_shark_benchmark(opts):
+  return run_shark_suite(opts, [opts.query_num])[opts.query_num]
 
-def run_impala_benchmark(opts):
+def run_impala_suite(opts, query_nums, monitor=None, plans_out=None,
+                     injector=None, checksums_out=None):
   impala_host = opts.impala_hosts[0]
-  def ssh_impala(command):
-    ssh(impala_host, "ubuntu", opts.impala_identity_file, command)
 
   def clear_buffer_cache_impala(host):
     ssh(host, "ubuntu", opts.impala_identity_file,
         "sudo bash -c \"sync && echo 3 > /proc/sys/vm/drop_caches\"")
 
   runner = "impala-shell -r -q"
+  checksum_runner = "impala-shell -B -q"
   if (opts.impala_use_hive):
     runner = "hive -e"
-
-  prefix = str(time.time()).split(".")[0]
-  query_file_name = "%s_workload.sh" % prefix
-  local_query_file = os.path.join(LOCAL_TMP_DIR, query_file_name)
-  query_file = open(local_query_file, 'w')
-  remote_tmp_file = "/tmp/%s_tmp" % prefix
-  remote_result_file = "/tmp/%s_results" % prefix
-
-  query_file.write("hive -e '%s'\n" % IMPALA_MAP[opts.query_num])
-  query = QUERY_MAP[opts.query_num][1]
-
-  if '3c' in opts.query_num:
-    query = query.replace('JOIN', 'JOIN [SHUFFLE]')
-
-  query = "INSERT INTO TABLE warmup  SELECT pageURL, pageRank FROM scratch WHERE pageRank > 1000;" + query
-  query = "CREATE TABLE warmup (pageURL STRING, pageRank INT);" + query
-  query = "DROP TABLE IF EXISTS warmup;" + query
-
-  # Populate the full buffer cache if running Impala + cached
-  if (not opts.impala_use_hive) and (not opts.clear_buffer_cache):
-    query = "set mem_limit=68g;" + query
-    query = "select count(*) from rankings;" + query
-    query = "select count(*) from uservisits;" + query
+    checksum_runner = "hive -e"
 
   connect_stmt = "connect localhost;"
   if (opts.impala_use_hive):
     connect_stmt = ""
 
-  query_file.write(
-      "%s '%s%s' > %s 2>&1;\n" % (runner, connect_stmt, query, remote_tmp_file))
-  query_file.write("cat %s |egrep 'Inserted|Time' |grep -v MapReduce >> %s;\n" % (
-      remote_tmp_file, remote_result_file))
-  query_file.write("hive -e '%s';\n" % CLEAN_QUERY)
-  query_file.close()
-
-  remote_query_file = "/tmp/%s" % query_file_name
-  print >> stderr, "Copying files to Impala"
-  scp_to(impala_host, opts.impala_identity_file, "ubuntu",
-      local_query_file, remote_query_file)
-  ssh_impala("chmod 775 %s" % remote_query_file)
+  # Warm up once for the whole suite, rebuilding the warmup table only if
+  # scratch changed since it was last built and otherwise just scanning it
+  warmup_table = DerivedTable("warmup", ["/tmp/benchmark/scratch"],
+                              "hadoop", "/tmp")
+  warmup = ""
+  if opts.warmup_queries and check_derived_table(
+      opts, warmup_table, impala_host, "ubuntu", opts.impala_identity_file):
+    warmup += WARMUP_QUERY
+  elif opts.warmup_queries:
+    warmup += "DROP TABLE IF EXISTS warmup;"
+    warmup += "CREATE TABLE warmup (pageURL STRING, pageRank INT);"
+    warmup += "INSERT INTO TABLE warmup  SELECT pageURL, pageRank FROM scratch WHERE pageRank > 1000;"
 
-  print query
-
-  # Run benchmark
-  print >> stderr, "Running remote benchmark..."
-  for i in range(opts.num_trials):
+  # Populate the full buffer cache if running Impala + cached
+  if (not opts.impala_use_hive) and (not opts.clear_buffer_cache):
+    warmup = "select count(*) from rankings;" + warmup
+    warmup = "select count(*) from uservisits;" + warmup
+  warmup = make_input_variant(opts, warmup)
+
+  steps = []
+  if opts.warmup_queries and warmup:
+    steps.append({"id": "warmup", "include": "^$",
+                  "command": "%s '%s%s'" % (runner, connect_stmt, warmup)})
+
+  # Each trial waits at a barrier if caches must be cleared first, the
+  # remaining trials may be skipped or a worker is to be killed during it
+  rule = stopping_rule(opts)
+  barrier = opts.clear_buffer_cache or opts.target_ci_width is not None or \
+      injector is not None
+
+  for query_num in query_nums:
+    query = make_input_variant(opts, QUERY_MAP[query_num][1])
+
+    if query_num == '3c':
+      query = query.replace('JOIN', 'JOIN [SHUFFLE]')
+
+    settings = ""
+    if (not opts.impala_use_hive) and (not opts.clear_buffer_cache):
+      settings = "set mem_limit=68g;"
+
+    print settings + query
+
+    # The table inserted into must exist while the plan is explained. It is
+    # dropped first in case a cancelled trial left it behind, and is kept
+    # afterwards if its checksum is to be taken. A trial marker is printed
+    # once it exists, so a worker isn't killed while Hive is creating it.
+    def run_with_table(statements, keep=False):
+      command = "hive -e '%s%s' > /dev/null 2>&1; " % (
+        "DROP TABLE IF EXISTS %s;" % TMP_TABLE, IMPALA_MAP[query_num])
+      command += "echo %s=; " % TRIAL_MARKER
+      command += "%s '%s%s%s'" % (runner, connect_stmt, settings, statements)
+      if not keep:
+        command += "; hive -e '%s' > /dev/null 2>&1" % CLEAN_QUERY
+      return command
+
+    if plans_out is not None:
+      steps.append(plan_step(query_num, run_with_table(plans.explain(query))))
+    command = run_with_table(query, keep=checksums_out is not None)
+    for i in range(opts.num_trials):
+      steps.append({"id": [query_num, i], "barrier": barrier,
+                    "command": command, "include": log_parser.INCLUDE,
+                    "notify": injector and "^%s=" % TRIAL_MARKER,
+                    "timeout": opts.trial_timeout})
+    if checksums_out is not None:
+      steps.append(checksum_step(query_num, "%s '%s%s'; %s" % (
+        checksum_runner, connect_stmt,
+        verify.checksum_statement(query_num, "impala"),
+        "hive -e '%s' > /dev/null 2>&1" % CLEAN_QUERY)))
+
+  results = {q: ([], []) for q in query_nums}
+
+  def before_trial(step_id):
+    if not rule.wants_more(results[step_id[0]][0]):
+      return False
     if opts.clear_buffer_cache:
       print >> stderr, "Clearing Buffer Cache..."
-      map(clear_buffer_cache_impala, opts.impala_hosts)
-    ssh_impala("sudo -u hdfs %s" % remote_query_file)
-
-  # Collect results
-  local_result_file = os.path.join(LOCAL_TMP_DIR, "%s_results" % prefix)
-  scp_from(impala_host, opts.impala_identity_file, "ubuntu",
-      remote_result_file, local_result_file)
-  contents = open(local_result_file).readlines()
+      summarize("Cleared buffer cache", fan_out(clear_buffer_cache_impala,
+          opts.impala_hosts, opts.host_parallelism))
 
-  if opts.impala_use_hive:
-    results = map(lambda x: float(x.split(": ")[1].split(" ")[0]), contents)
-  else:
-    results = map(lambda x: float(x.split("in ")[1].split("s")[0]), contents)
-    results = results[1::2]
+  # A trial's query starts once its result table was created
+  def on_marker(step_id, line):
+    injector.arm(tuple(step_id))
 
-  # Clean-up
-  #ssh_impala("rm -f /tmp/%s*" % prefix) # Temporarily disabled
-  os.unlink(local_query_file)
-  os.unlink(local_result_file)
+  # Run benchmark
+  print >> stderr, "Running remote benchmark..."
+  if monitor:
+    monitor.start(opts.impala_hosts, "ubuntu", opts.impala_identity_file)
+  if injector:
+    # Spare the coordinator, unless it is the only impalad
+    injector.start(opts.impala_hosts[1:] or opts.impala_hosts, "ubuntu",
+                   opts.impala_identity_file)
+  for record in run_agent(impala_host, opts.impala_identity_file, "ubuntu",
+                          "/tmp", steps, on_barrier=before_trial,
+                          env="sudo -u hdfs ", on_line=on_marker):
+    if record["id"] == "warmup":
+      commit_derived_table(warmup_table, record, impala_host, "ubuntu",
+                           opts.impala_identity_file)
+      continue
+    if is_plan(record):
+      plans_out[record["id"][1]] = record["lines"]
+      continue
+    if is_checksum(record):
+      checksums_out[record["id"][1]] = verify.parse_checksum(record["lines"])
+      continue
+    if injector:
+      injector.disarm()
+    query_num, trial = record["id"]
+    if monitor:
+      monitor.mark(query_num, trial, record["wall_start"], record["wall_end"])
+    content = record["lines"]
+    result = trial_time(query_num, content, record["wall_start"],
+                        record["wall_end"])
+    print >> stderr, "Query %s : Trial %i: %s" % (query_num, trial + 1, result)
+    results[query_num][0].append(result)
+    results[query_num][1].append(content)
+  if monitor:
+    monitor.stop()
+  if injector:
+    injector.stop()
+
+  return results
 
-  return results, contents
+def run_impala_benchmark(opts):
+  return run_impala_suite(opts, [opts.query_num])[opts.query_num]
 
-def run_redshift_benchmark(opts):
-  conn = DBAPI.connect(
+def connect_redshift(opts):
+  return DBAPI.connect(
     host = opts.redshift_host,
     database = opts.redshift_database,
     user = opts.redshift_username,
     password = opts.redshift_password,
     port = 5439,
     socket_timeout=6000)
+
+def run_redshift_suite(opts, query_nums, plans_out=None, checksums_out=None):
+  conn = connect_redshift(opts)
   print >> stderr, "Connecting to Redshift..."
   cursor = conn.cursor()
 
   print >> stderr, "Connection succeeded..."
-  times = []
+  if opts.trial_timeout:
+    set_statement_timeout(conn, opts.trial_timeout)
   # Clean up old table if still exists
   try:
     cursor.execute(CLEAN_QUERY)
   except:
     pass
-  for i in range(opts.num_trials):
-    t0 = time.time()
-    cursor.execute(QUERY_MAP[opts.query_num][2])
-    times.append(time.time() - t0)
-    cursor.execute(CLEAN_QUERY)
-  return times
+  rule = stopping_rule(opts)
+  results = {}
+  for query_num in query_nums:
+    if plans_out is not None:
+      cursor.execute(plans.explain(QUERY_MAP[query_num][2]))
+      plans_out[query_num] = [row[0] for row in cursor.fetchall()]
+    times = []
+    contents = []
+    while rule.wants_more(times):
+      t0 = time.time()
+      try:
+        cursor.execute(QUERY_MAP[query_num][2])
+      except Exception as e:
+        if not (opts.trial_timeout and STATEMENT_TIMEOUT.search(str(e))):
+          raise
+        # Cancelled before creating the result table, so nothing to clean
+        conn.rollback()
+        times.append(time.time() - t0)
+        contents.append([TIMED_OUT % opts.trial_timeout])
+        print >> stderr, "Query %s : Trial %i: %s" % (
+          query_num, len(times), contents[-1][0])
+        continue
+      times.append(time.time() - t0)
+      contents.append([])
+      if checksums_out is not None and not rule.wants_more(times):
+        cursor.execute(verify.checksum_statement(query_num, "sql"))
+        checksums_out[query_num] = verify.fetched_checksum(cursor.fetchone())
+      cursor.execute(CLEAN_QUERY)
+    results[query_num] = (times, contents)
+  return results
+
+def run_local_suite(opts, query_nums, plans_out=None, checksums_out=None):
+  engine = LocalEngine(opts.local_data, opts.local_workers)
+
+  def clear_buffer_cache_local():
+    if subprocess.call("sync && sudo -n sh -c " \
+                       "\"echo 3 > /proc/sys/vm/drop_caches\"", shell=True):
+      print >> stderr, "Could not clear the buffer cache"
+
+  rule = stopping_rule(opts)
+  results = {}
+  for query_num in query_nums:
+    if plans_out is not None:
+      plans_out[query_num] = engine.explain(query_num)
+    times = []
+    contents = []
+    while rule.wants_more(times):
+      if opts.clear_buffer_cache:
+        clear_buffer_cache_local()
+      t0 = time.time()
+      try:
+        rows = engine.execute(query_num, opts.trial_timeout)
+      except multiprocessing.TimeoutError:
+        times.append(time.time() - t0)
+        contents.append([TIMED_OUT % opts.trial_timeout])
+      else:
+        times.append(time.time() - t0)
+        # As the Hive CLI reports it, so the row count is parsed like theirs
+        contents.append(["Time taken: %.3f seconds, Fetched: %d row(s)" % (
+          times[-1], len(rows))])
+        if checksums_out is not None and not rule.wants_more(times):
+          checksums_out[query_num] = verify.row_checksum(query_num, rows)
+      print >> stderr, "Query %s : Trial %i: %s" % (
+        query_num, len(times), contents[-1][0])
+    results[query_num] = (times, contents)
+  return results
+
+def run_local_benchmark(opts):
+  return run_local_suite(opts, [opts.query_num])[opts.query_num][0]
 
-def run_hive_benchmark(opts):
-  def ssh_hive(command, user="root"):
-    command = 'sudo -u %s %s' % (user, command)
-    print command
-    ssh(opts.hive_host, "root", opts.hive_identity_file, command)
+def run_redshift_benchmark(opts):
+  return run_redshift_suite(opts, [opts.query_num])[opts.query_num][0]
 
+def run_hive_suite(opts, query_nums, monitor=None, plans_out=None,
+                   injector=None, checksums_out=None):
   def clear_buffer_cache_hive(host):
     print >> stderr, "Clearing", host
     ssh(host, "root", opts.hive_identity_file,
         "sudo bash -c \"sync && echo 3 > /proc/sys/vm/drop_caches\"")
 
-  prefix = str(time.time()).split(".")[0]
-  query_file_name = "%s_workload.sh" % prefix
-  slaves_file_name = "%s_slaves" % prefix
-  local_query_file = os.path.join(LOCAL_TMP_DIR, query_file_name)
-  local_slaves_file = os.path.join(LOCAL_TMP_DIR, slaves_file_name)
-  query_file = open(local_query_file, 'w')
-  remote_result_file = "/mnt/%s_results" % prefix
-  remote_tmp_file = "/mnt/%s_out" % prefix
-  remote_query_file = "/mnt/%s" % query_file_name
-
-  query_list = "set mapreduce.reduce.input.limit = -1; set mapred.reduce.tasks = %s; " % opts.reduce_tasks
-  query_list += "DROP TABLE IF EXISTS scratch_rank;"
-  query_list += "CREATE TABLE scratch_rank AS SELECT pageURL, pageRank FROM scratch WHERE pageRank > 1000;"
+  settings = "set mapreduce.reduce.input.limit = -1; set mapred.reduce.tasks = %s; " % opts.reduce_tasks
 
   if opts.tez:
     # Page 6 of the following doc:
@@ -577,264 +977,664 @@ def run_hive_benchmark(opts):
     runner = "HADOOP_USER_NAME=hdfs hive"
     query_map = QUERY_MAP
 
-  # Throw away query for JVM warmup
-  # query_list += "SELECT COUNT(*) FROM scratch;"
+  scratch_rank = DerivedTable("scratch_rank", ["/tmp/benchmark/scratch"],
+                              "hadoop", "/mnt")
 
-  if '4' not in opts.query_num:
-    query_list += CLEAN_QUERY
-  else:
-    opts.query_num = '4_HIVE'
+  # Warm up once for the whole suite, rebuilding scratch_rank only if
+  # scratch changed since it was last built and otherwise just scanning it
+  warmup = settings
+  warmup += "DROP TABLE IF EXISTS scratch_rank;"
+  warmup += "CREATE TABLE scratch_rank AS SELECT pageURL, pageRank FROM scratch WHERE pageRank > 1000;"
 
-  query_list += query_map[opts.query_num][0]
+  # Throw away query for JVM warmup
+  # warmup += "SELECT COUNT(*) FROM scratch;"
+
+  steps = []
+  if opts.warmup_queries:
+    if check_derived_table(opts, scratch_rank, opts.hive_host, "root",
+                           opts.hive_identity_file):
+      warmup = settings + WARMUP_QUERY
+    steps.append({"id": "warmup", "include": "^$",
+                  "command": "%s -e '%s'" % (runner, warmup)})
+
+  # Each trial waits at a barrier if caches must be cleared first, the
+  # remaining trials may be skipped or a worker is to be killed during it
+  rule = stopping_rule(opts)
+  barrier = opts.clear_buffer_cache or opts.target_ci_width is not None or \
+      injector is not None
+
+  for query_num in query_nums:
+    query_list = settings
+    if family_of(query_num) != '4':
+      query_list += CLEAN_QUERY
+      query_list += query_map[query_num][0]
+    else:
+      query_list += query_map['4_HIVE'][0]
 
-  query_list = re.sub("\s\s+", " ", query_list.replace('\n', ' '))
+    query_list = re.sub("\s\s+", " ", query_list.replace('\n', ' '))
+    query_list = make_input_variant(opts, query_list)
 
-  print "\nQuery:"
-  print query_list.replace(';', ";\n")
+    print "\nQuery:"
+    print query_list.replace(';', ";\n")
 
-  query_file.write(
-    "%s -e '%s' > %s 2>&1\n" % (runner, query_list, remote_tmp_file))
+    if plans_out is not None:
+      statement = explained_statement(query_num, query_list)
+      steps.append(plan_step(query_num, "%s -e '%s%s'" % (
+        runner, settings, plans.explain(statement))))
 
-  query_file.write(
-      "cat %s | grep Time | grep -v INFO |grep -v MapReduce >> %s\n" % (
-        remote_tmp_file, remote_result_file))
+    for i in range(opts.num_trials):
+      steps.append({"id": [query_num, i], "barrier": barrier,
+                    "command": "%s -e '%s'" % (runner, query_list),
+                    "include": log_parser.INCLUDE,
+                    "timeout": opts.trial_timeout})
+    if checksums_out is not None:
+      steps.append(checksum_step(query_num, "%s -e '%s'" % (
+        runner, verify.checksum_statement(query_num, "hql"))))
 
-  query_file.close()
+  results = {q: ([], []) for q in query_nums}
 
-  print "Copying query files to Hive host"
-  scp_to(opts.hive_host, opts.hive_identity_file, "root", local_query_file,
-      remote_query_file)
-  ssh_hive("chmod 775 %s" % remote_query_file)
+  def before_trial(step_id):
+    if not rule.wants_more(results[step_id[0]][0]):
+      return False
+    if opts.clear_buffer_cache:
+      print >> stderr, "Clearing Buffer Cache..."
+      summarize("Cleared buffer cache", fan_out(clear_buffer_cache_hive,
+          opts.hive_slaves, opts.host_parallelism))
+    if injector:
+      injector.arm(tuple(step_id))
 
   # Run benchmark
   print "Running remote benchmark..."
 
   # Collect results
-  results = []
-  contents = []
-
-  for i in range(opts.num_trials):
-    print "Query %s : Trial %i" % (opts.query_num, i+1)
-    if opts.clear_buffer_cache:
-      print >> stderr, "Clearing Buffer Cache..."
-      map(clear_buffer_cache_hive, opts.hive_slaves)
-    ssh_hive("%s" % remote_query_file)
-    local_results_file = os.path.join(LOCAL_TMP_DIR, "%s_results" % prefix)
-    scp_from(opts.hive_host, opts.hive_identity_file, "root",
-        "/mnt/%s_results" % prefix, local_results_file)
-    content = open(local_results_file).readlines()
-    all_times = map(lambda x: float(x.split(": ")[1].split(" ")[0]), content)
-
-    if '4' in opts.query_num:
-      query_times = all_times[-4:]
-      part_a = query_times[1]
-      part_b = query_times[3]
-      print "Parts: %s, %s" % (part_a, part_b)
-      result = float(part_a) + float(part_b)
-    else:
-      result = all_times[-1] # Only want time of last query
+  if monitor:
+    monitor.start(opts.hive_slaves, "root", opts.hive_identity_file)
+  if injector:
+    injector.start(opts.hive_slaves, "root", opts.hive_identity_file)
+  for record in run_agent(opts.hive_host, opts.hive_identity_file, "root",
+                          "/mnt", steps, on_barrier=before_trial):
+    if record["id"] == "warmup":
+      commit_derived_table(scratch_rank, record, opts.hive_host, "root",
+                           opts.hive_identity_file)
+      continue
+    if is_plan(record):
+      plans_out[record["id"][1]] = record["lines"]
+      continue
+    if is_checksum(record):
+      checksums_out[record["id"][1]] = verify.parse_checksum(record["lines"])
+      continue
+    if injector:
+      injector.disarm()
+    query_num, trial = record["id"]
+    if monitor:
+      monitor.mark(query_num, trial, record["wall_start"], record["wall_end"])
+    print "Query %s : Trial %i" % (query_num, trial + 1)
+    content = record["lines"]
+    result = trial_time(query_num, content, record["wall_start"],
+                        record["wall_end"])
 
     print "Result: ", result
     print "Raw Times: ", content
 
-    results.append(result)
-    contents.append(content)
-
-    # Clean-up
-    #ssh_hive("rm /mnt/%s*" % prefix)
-    print "Clean Up...."
-    ssh_hive("rm /mnt/%s_results" % prefix)
-    os.remove(local_results_file)
+    results[query_num][0].append(result)
+    results[query_num][1].append(content)
+  if monitor:
+    monitor.stop()
+  if injector:
+    injector.stop()
 
-  os.remove(local_query_file)
+  return results
 
-  return results, contents
-
-
-def run_hive_cdh_benchmark(opts):
-  def ssh_hive(command):
-    command = 'HADOOP_USER_NAME=%s %s' % ("hdfs", command)
-    print command
-    ssh(opts.hive_host, "ubuntu", opts.hive_identity_file, command)
+def run_hive_benchmark(opts):
+  return run_hive_suite(opts, [opts.query_num])[opts.query_num]
 
+def run_hive_cdh_suite(opts, query_nums, monitor=None, plans_out=None,
+                       injector=None, checksums_out=None):
   def clear_buffer_cache_hive(host):
     print >> stderr, "Clearing", host
     ssh(host, "ubuntu", opts.hive_identity_file,
         "sudo bash -c \"sync && echo 3 > /proc/sys/vm/drop_caches\"")
 
-  prefix = str(time.time()).split(".")[0]
-  query_file_name = "%s_workload.sh" % prefix
-  slaves_file_name = "%s_slaves" % prefix
-  local_query_file = os.path.join(LOCAL_TMP_DIR, query_file_name)
-  local_slaves_file = os.path.join(LOCAL_TMP_DIR, slaves_file_name)
-  query_file = open(local_query_file, 'w')
-  remote_result_file = "/tmp/%s_results" % prefix
-  remote_tmp_file = "/tmp/%s_out" % prefix
-  remote_query_file = "/tmp/%s" % query_file_name
-
   runner = "hive"
+  query_map = QUERY_MAP
 
-  query_list = "set mapred.reduce.tasks = %s;" % opts.reduce_tasks
-  query_list += "DROP TABLE IF EXISTS scratch_rank;"
-  query_list += "CREATE TABLE scratch_rank AS SELECT pageURL, pageRank FROM scratch WHERE pageRank > 1000;"
+  settings = "set mapred.reduce.tasks = %s;" % opts.reduce_tasks
 
-  # Throw away query for JVM warmup
-  # query_list += "SELECT COUNT(*) FROM scratch;"
+  scratch_rank = DerivedTable("scratch_rank", ["/tmp/benchmark/scratch"],
+                              "hadoop", "/tmp")
 
-  if '4' not in opts.query_num:
-    query_list += CLEAN_QUERY
-  else:
-    opts.query_num = '4_HIVE'
+  # Warm up once for the whole suite, rebuilding scratch_rank only if
+  # scratch changed since it was last built and otherwise just scanning it
+  warmup = settings
+  warmup += "DROP TABLE IF EXISTS scratch_rank;"
+  warmup += "CREATE TABLE scratch_rank AS SELECT pageURL, pageRank FROM scratch WHERE pageRank > 1000;"
 
-  query_list += QUERY_MAP[opts.query_num][0]
+  # Throw away query for JVM warmup
+  # warmup += "SELECT COUNT(*) FROM scratch;"
+
+  steps = []
+  if opts.warmup_queries:
+    if check_derived_table(opts, scratch_rank, opts.hive_host, "ubuntu",
+                           opts.hive_identity_file):
+      warmup = settings + WARMUP_QUERY
+    steps.append({"id": "warmup", "include": "^$",
+                  "command": "%s -e '%s'" % (runner, warmup)})
+
+  # Each trial waits at a barrier if caches must be cleared first, the
+  # remaining trials may be skipped or a worker is to be killed during it
+  rule = stopping_rule(opts)
+  barrier = opts.clear_buffer_cache or opts.target_ci_width is not None or \
+      injector is not None
+
+  for query_num in query_nums:
+    query_list = settings
+    if family_of(query_num) != '4':
+      query_list += CLEAN_QUERY
+      query_list += query_map[query_num][0]
+    else:
+      query_list += query_map['4_HIVE'][0]
 
-  query_list = re.sub("\s\s+", " ", query_list.replace('\n', ' '))
+    query_list = re.sub("\s\s+", " ", query_list.replace('\n', ' '))
+    query_list = make_input_variant(opts, query_list)
 
-  print "\nQuery:"
-  print query_list.replace(';', ";\n")
+    print "\nQuery:"
+    print query_list.replace(';', ";\n")
 
-  query_file.write(
-    "%s -e '%s' > %s 2>&1\n" % (runner, query_list, remote_tmp_file))
+    if plans_out is not None:
+      statement = explained_statement(query_num, query_list)
+      steps.append(plan_step(query_num, "%s -e '%s%s'" % (
+        runner, settings, plans.explain(statement))))
 
-  query_file.write(
-      "cat %s | grep Time | grep -v INFO |grep -v MapReduce >> %s\n" % (
-        remote_tmp_file, remote_result_file))
+    for i in range(opts.num_trials):
+      steps.append({"id": [query_num, i], "barrier": barrier,
+                    "command": "%s -e '%s'" % (runner, query_list),
+                    "include": log_parser.INCLUDE,
+                    "timeout": opts.trial_timeout})
+    if checksums_out is not None:
+      steps.append(checksum_step(query_num, "%s -e '%s'" % (
+        runner, verify.checksum_statement(query_num, "hql"))))
 
-  query_file.close()
+  results = {q: ([], []) for q in query_nums}
 
-  print "Copying files to Hive"
-  scp_to(opts.hive_host, opts.hive_identity_file, "ubuntu", local_query_file,
-      remote_query_file)
-  ssh_hive("chmod 775 %s" % remote_query_file)
+  def before_trial(step_id):
+    if not rule.wants_more(results[step_id[0]][0]):
+      return False
+    if opts.clear_buffer_cache:
+      print >> stderr, "Clearing Buffer Cache..."
+      summarize("Cleared buffer cache", fan_out(clear_buffer_cache_hive,
+          opts.hive_slaves, opts.host_parallelism))
+    if injector:
+      injector.arm(tuple(step_id))
 
   # Run benchmark
   print "Running remote benchmark..."
 
   # Collect results
-  results = []
-  contents = []
-
-  for i in range(opts.num_trials):
-    print "Query %s : Trial %i" % (opts.query_num, i+1)
-    if opts.clear_buffer_cache:
-      print >> stderr, "Clearing Buffer Cache..."
-      map(clear_buffer_cache_hive, opts.hive_slaves)
-    ssh_hive("%s" % remote_query_file)
-    local_results_file = os.path.join(LOCAL_TMP_DIR, "%s_results" % prefix)
-    scp_from(opts.hive_host, opts.hive_identity_file, "ubuntu",
-        "/tmp/%s_results" % prefix, local_results_file)
-    content = open(local_results_file).readlines()
-    all_times = map(lambda x: float(x.split(": ")[1].split(" ")[0]), content)
-
-    if '4' in opts.query_num:
-      query_times = all_times[-4:]
-      part_a = query_times[1]
-      part_b = query_times[3]
-      print "Parts: %s, %s" % (part_a, part_b)
-      result = float(part_a) + float(part_b)
-    else:
-      result = all_times[-1] # Only want time of last query
+  if monitor:
+    monitor.start(opts.hive_slaves, "ubuntu", opts.hive_identity_file)
+  if injector:
+    injector.start(opts.hive_slaves, "ubuntu", opts.hive_identity_file)
+  for record in run_agent(opts.hive_host, opts.hive_identity_file, "ubuntu",
+                          "/tmp", steps, on_barrier=before_trial,
+                          env="HADOOP_USER_NAME=hdfs "):
+    if record["id"] == "warmup":
+      commit_derived_table(scratch_rank, record, opts.hive_host, "ubuntu",
+                           opts.hive_identity_file)
+      continue
+    if is_plan(record):
+      plans_out[record["id"][1]] = record["lines"]
+      continue
+    if is_checksum(record):
+      checksums_out[record["id"][1]] = verify.parse_checksum(record["lines"])
+      continue
+    if injector:
+      injector.disarm()
+    query_num, trial = record["id"]
+    if monitor:
+      monitor.mark(query_num, trial, record["wall_start"], record["wall_end"])
+    print "Query %s : Trial %i" % (query_num, trial + 1)
+    content = record["lines"]
+    result = trial_time(query_num, content, record["wall_start"],
+                        record["wall_end"])
 
     print "Result: ", result
     print "Raw Times: ", content
 
-    results.append(result)
-    contents.append(content)
+    results[query_num][0].append(result)
+    results[query_num][1].append(content)
+  if monitor:
+    monitor.stop()
+  if injector:
+    injector.stop()
 
-    # Clean-up
-    #ssh_hive("rm /mnt/%s*" % prefix)
-    print "Clean Up...."
-    ssh_hive("rm /tmp/%s_results" % prefix)
-    os.remove(local_results_file)
+  return results
 
-  os.remove(local_query_file)
+def run_hive_cdh_benchmark(opts):
+  return run_hive_cdh_suite(opts, [opts.query_num])[opts.query_num]
 
-  return results, contents
+# Build a function that runs a single query once on behalf of concurrent
+# stream `stream` and returns its latency in seconds. Scripts for every query
+# the stream may run are copied up front so copying is never timed.
+def make_stream_executor(opts, stream, query_nums, prefix):
+  if opts.redshift:
+    conn = connect_redshift(opts)
+    cursor = conn.cursor()
+    if opts.trial_timeout:
+      set_statement_timeout(conn, opts.trial_timeout)
+    try:
+      cursor.execute(make_stream_tables(CLEAN_QUERY, stream))
+    except:
+      conn.rollback()
+
+    def run_redshift(query_num):
+      t0 = time.time()
+      try:
+        cursor.execute(make_stream_tables(QUERY_MAP[query_num][2], stream))
+      except Exception as e:
+        conn.rollback()
+        if opts.trial_timeout and STATEMENT_TIMEOUT.search(str(e)):
+          raise RuntimeError(TIMED_OUT % opts.trial_timeout)
+        raise
+      latency = time.time() - t0
+      cursor.execute(make_stream_tables(CLEAN_QUERY, stream))
+      return latency
+    return run_redshift
+
+  if opts.local:
+    engine = LocalEngine(opts.local_data, opts.local_workers)
+
+    def run_local(query_num):
+      t0 = time.time()
+      try:
+        engine.execute(query_num, opts.trial_timeout)
+      except multiprocessing.TimeoutError:
+        raise RuntimeError(TIMED_OUT % opts.trial_timeout)
+      return time.time() - t0
+    return run_local
+
+  # Scripts to run before, during and after the timed part of each query
+  scripts = {}
+  if opts.impala:
+    # Any impalad can coordinate a query, so spread streams over all of them
+    host = opts.impala_hosts[stream % len(opts.impala_hosts)]
+    user, identity_file, tmp_dir = "ubuntu", opts.impala_identity_file, "/tmp"
+    run_as = "sudo -u hdfs "
+    if opts.impala_use_hive:
+      runner, connect_stmt = "hive -e", ""
+    else:
+      runner, connect_stmt = "impala-shell -r -q", "connect localhost;"
+    for query_num in query_nums:
+      query = make_input_variant(opts, QUERY_MAP[query_num][1])
+      if query_num == '3c':
+        query = query.replace('JOIN', 'JOIN [SHUFFLE]')
+      scripts[query_num] = (
+        "hive -e '%s'\n" % make_stream_tables(IMPALA_MAP[query_num], stream),
+        "%s '%s%s' > /dev/null 2>&1\n" % (
+          runner, connect_stmt, make_stream_tables(query, stream)),
+        "hive -e '%s'\n" % make_stream_tables(CLEAN_QUERY, stream))
+  else:
+    if opts.shark:
+      if not opts.shark_no_cache:
+        print >> stderr, "Cached tables are private to a Shark session, " \
+            "so concurrent streams read the on-disk tables"
+      host, user, identity_file = opts.shark_host, "root", opts.shark_identity_file
+      tmp_dir, run_as = "/mnt", ""
+      runner = "source /root/.bash_profile; /root/shark/bin/shark-withinfo"
+      settings = "set mapred.reduce.tasks = %s;" % opts.reduce_tasks
+    elif opts.hive:
+      host, user, identity_file = opts.hive_host, "root", opts.hive_identity_file
+      tmp_dir, run_as = "/mnt", "sudo -u root "
+      runner = "HADOOP_USER_NAME=hdfs hive"
+      if opts.tez:
+        runner += " -hiveconf hive.execution.engine=tez"
+      settings = "set mapreduce.reduce.input.limit = -1; " \
+          "set mapred.reduce.tasks = %s; " % opts.reduce_tasks
+    else:
+      host, user, identity_file = opts.hive_host, "ubuntu", opts.hive_identity_file
+      tmp_dir, run_as = "/tmp", "HADOOP_USER_NAME=hdfs "
+      runner = "hive"
+      settings = "set mapred.reduce.tasks = %s;" % opts.reduce_tasks
+    for query_num in query_nums:
+      if family_of(query_num) == '4':
+        query = QUERY_MAP['4_HIVE' if not opts.shark else '4'][0]
+      else:
+        query = CLEAN_QUERY + QUERY_MAP[query_num][0]
+      query = re.sub("\s\s+", " ", (settings + query).replace('\n', ' '))
+      query = make_input_variant(opts, query)
+      scripts[query_num] = (None, "%s -e '%s' > /dev/null 2>&1\n" % (
+        runner, make_stream_tables(query, stream)), None)
+
+  remote_files = {}
+  for query_num, parts in scripts.items():
+    for part, lines in zip(["pre", "run", "post"], parts):
+      if lines is not None:
+        remote_file = "%s/%s_s%d_%s_%s.sh" % (
+          tmp_dir, prefix, stream, query_num, part)
+        push_script(host, identity_file, user, [lines], remote_file)
+        remote_files[(query_num, part)] = remote_file
+
+  # The timed part of a query is interrupted like the trial agent would
+  # interrupt it if it runs past --trial-timeout
+  def run_remote(query_num, part):
+    if (query_num, part) not in remote_files:
+      return
+    command = remote_files[(query_num, part)]
+    if part == "run" and opts.trial_timeout:
+      command = "timeout -s INT -k %d %g %s" % (
+        CANCEL_GRACE, opts.trial_timeout, command)
+    try:
+      ssh(host, user, identity_file, run_as + command)
+    except subprocess.CalledProcessError as e:
+      # Status of timeout(1) when it had to interrupt or kill the query
+      if part == "run" and opts.trial_timeout and e.returncode in (124, 137):
+        raise RuntimeError(TIMED_OUT % opts.trial_timeout)
+      raise
+
+  def run_query(query_num):
+    run_remote(query_num, "pre")
+    try:
+      t0 = time.time()
+      run_remote(query_num, "run")
+      latency = time.time() - t0
+    finally:
+      run_remote(query_num, "post")
+    return latency
+  return run_query
+
+# Run the query mix with each requested number of concurrent streams
+def run_throughput(opts, fname, run_id):
+  mix = throughput.parse_mix(opts.stream_mix or ",".join(opts.query_nums))
+  query_nums = sorted(set(q for (q, weight) in mix))
+  for query_num in query_nums:
+    try:
+      if queries.expand(query_num) != [query_num]:
+        raise ValueError("Stream mixes cannot contain sweeps: %s" % query_num)
+    except ValueError as e:
+      print >> stderr, e
+      sys.exit(1)
+    if family_of(query_num) == '4' and (opts.impala or opts.redshift):
+      print >> stderr, "Query %s is not supported on this engine" % query_num
+      sys.exit(1)
+
+  prefix = "%s_%s" % (fname, str(time.time()).split(".")[0])
+  levels = []
+  for num_streams in map(int, opts.streams.split(",")):
+    print >> stderr, "Running %d concurrent stream(s)..." % num_streams
+    records, makespan = throughput.run_streams(
+      lambda s: make_stream_executor(opts, s, query_nums, prefix),
+      num_streams, mix, opts.queries_per_stream, opts.seed)
+    levels.append((num_streams, records, makespan))
+    results_store.append(opts.results_store, [
+      dict(base_record(opts, run_id, "throughput", r.query_num),
+           streams=num_streams, stream=r.stream, start=r.start,
+           time=r.latency, makespan=makespan,
+           error=r.error and str(r.error))
+      for r in records])
+
+  output = StringIO()
+  throughput.report(levels, output)
+  print output.getvalue()
+  outfile = open('results_%s_throughput_%s' % (fname, datetime.datetime.now()), 'w')
+  print >> outfile, output.getvalue()
+  outfile.close()
+
+# How many trials to run of each query, see stats.StoppingRule
+def stopping_rule(opts):
+  return stats.StoppingRule(opts.num_trials, opts.min_trials,
+                            opts.target_ci_width, opts.confidence)
 
 def get_percentiles(in_list):
-  def get_pctl(lst, pctl):
-    return lst[int(len(lst) * pctl)]
-  in_list = sorted(in_list)
-  return "%s\t%s\t%s" % (
-    get_pctl(in_list, 0.05),
-    get_pctl(in_list, .5),
-    get_pctl(in_list, .95)
+  return "%.3f\t%.3f\t%.3f" % (
+    stats.percentile(in_list, 0.05),
+    stats.percentile(in_list, .5),
+    stats.percentile(in_list, .95)
   )
 
+# Bootstrap confidence interval of the median
+def get_median_ci(in_list, confidence):
+  return "%.3f\t%.3f" % stats.bootstrap_ci(in_list, confidence=confidence)
+
+# Check whether a table derived from the benchmark data can be reused, i.e.
+# its sources are unchanged since it was built and no rebuild was asked for
+def check_derived_table(opts, table, host, user, id_file):
+  if table.check(host, user, id_file, opts.rebuild_derived_tables):
+    print >> stderr, "Reusing %s, its sources are unchanged" % table.name
+  return table.current
+
+# Throw away query warming up the JVMs and caches when the warmup table
+# built from the same scan is reused
+WARMUP_QUERY = "SELECT COUNT(*) FROM scratch WHERE pageRank > 1000;"
+
+# Record that a derived table was rebuilt by the agent step `record`, unless
+# the step failed, in which case it is rebuilt on the next run
+def commit_derived_table(table, record, host, user, id_file):
+  if record["returncode"] != 0 or record.get("timed_out"):
+    print >> stderr, "Building %s failed, it will be rebuilt next time" % (
+      table.name)
+    return
+  table.commit(host, user, id_file)
+
 def ssh_ret_code(host, user, id_file, cmd):
   try:
     return ssh(host, user, id_file, cmd)
   except subprocess.CalledProcessError as e:
     return e.returncode
 
+# Build a remote shell loop that runs `action` (if any) until `condition`
+# succeeds, checking every `interval` seconds. The loop exits 0 as soon as the
+# condition holds and 1 once `timeout` seconds have passed, so each host
+# reports back the moment it is ready instead of being polled over ssh.
+# Neither argument may contain single quotes, since ssh() wraps the command
+# in them.
+def remote_wait_command(condition, timeout, interval, action=None):
+  step = "if %s; then exit 0; fi; " % condition
+  if action is not None:
+    step += "%s; " % action
+  return "end=$(($(date +%%s) + %d)); while [ $(date +%%s) -lt $end ]; do " \
+         "%ssleep %s; done; %s" % (
+           timeout, step, interval, "if %s; then exit 0; fi; exit 1" % condition)
+
+# Kill ExecutorBackend processes on every slave in parallel and wait until none
+# are left. Returns the number of seconds spent waiting.
 def ensure_spark_stopped_on_slaves(slaves):
-  stop = False
-  while not stop:
-    cmd = "jps | grep ExecutorBackend"
-    ret_vals = map(lambda s: ssh_ret_code(s, "root", opts.shark_identity_file, cmd), slaves)
-    print ret_vals
-    if 0 in ret_vals:
-      print "Spark is still running on some slaves... sleeping"
-      cmd = "jps | grep ExecutorBackend | cut -d \" \" -f 1 | xargs -rn1 kill -9"
-      map(lambda s: ssh_ret_code(s, "root", opts.shark_identity_file, cmd), slaves)
-      time.sleep(2)
-    else:
-      stop = True
-
-def main():
-  global opts
-  opts = parse_args()
-
-  print "Query %s:" % opts.query_num
-
-  if opts.impala:
-    results, contents = run_impala_benchmark(opts)
-  if opts.shark:
-    results, contents = run_shark_benchmark(opts)
-  if opts.redshift:
-    results = run_redshift_benchmark(opts)
-  if opts.hive:
-    results, contents = run_hive_benchmark(opts)
-  if opts.hive_cdh:
-    results, contents = run_hive_cdh_benchmark(opts)
-
+  find_pids = "jps | grep ExecutorBackend | cut -d \" \" -f 1"
+  cmd = remote_wait_command("[ -z \"$(%s)\" ]" % find_pids,
+                            opts.setup_timeout, 0.2,
+                            action="%s | xargs -rn1 kill -9" % find_pids)
+  t0 = time.time()
+  results = fan_out(
+      lambda s: ssh_ret_code(s, "root", opts.shark_identity_file, cmd),
+      slaves, opts.host_parallelism)
+  waited = time.time() - t0
+  summarize("Stopped executors", results)
+  stuck = [r.host for r in results if r.value != 0]
+  if stuck:
+    print >> stderr, "Executors still running after %ss on: %s" % (
+      opts.setup_timeout, ", ".join(stuck))
+  return waited
+
+# Wait until the standalone master reports every slave's worker as ALIVE.
+# Returns the number of seconds spent waiting.
+def wait_for_spark_workers(num_workers):
+  alive = "curl -s http://localhost:8080/json | " \
+          "grep -o \"\\\"state\\\"[ :]*\\\"ALIVE\" | wc -l"
+  cmd = remote_wait_command("[ $(%s) -ge %d ]" % (alive, num_workers),
+                            opts.setup_timeout, 0.5)
+  t0 = time.time()
+  ret = ssh_ret_code(opts.shark_host, "root", opts.shark_identity_file, cmd)
+  waited = time.time() - t0
+  if ret != 0:
+    print >> stderr, "Only some Spark workers registered after %ss" % (
+      opts.setup_timeout)
+  print >> stderr, "Waited %.2fs for %d Spark workers" % (waited, num_workers)
+  return waited
+
+# Name of the engine and mode being benchmarked, used in result file names
+def engine_name(opts):
+  if opts.table_variant:
+    return "%s_%s" % (base_engine_name(opts), opts.table_variant)
+  return base_engine_name(opts)
+
+def base_engine_name(opts):
   if opts.impala:
     if opts.clear_buffer_cache:
-      fname = "impala_disk"
+      return "impala_disk"
     else:
-      fname = "impala_mem"
+      return "impala_mem"
   elif opts.shark and opts.shark_no_cache:
-    fname = "shark_disk"
+    return "shark_disk"
   elif opts.shark:
-    fname = "shark_mem"
+    return "shark_mem"
   elif opts.redshift:
-    fname = "redshift"
+    return "redshift"
   elif opts.hive:
     if opts.clear_buffer_cache:
-      fname = "hive_clear_cache"
+      return "hive_clear_cache"
     else:
-      fname = "hive"
+      return "hive"
   elif opts.hive_cdh:
     if opts.clear_buffer_cache:
-      fname = "cdh_hive_clear_cache"
+      return "cdh_hive_clear_cache"
     else:
-      fname = "cdh_hive"
-
-  fname = opts.prefix + fname
+      return "cdh_hive"
+  elif opts.local:
+    if opts.clear_buffer_cache:
+      return "local_disk"
+    else:
+      return "local"
 
+# Hosts the benchmarked engine runs on, the first being the one queried
+def engine_hosts(opts):
+  if opts.impala:
+    return opts.impala_hosts
+  elif opts.shark:
+    return [opts.shark_host]
+  elif opts.redshift:
+    return [opts.redshift_host]
+  elif opts.local:
+    return [socket.gethostname()]
+  else:
+    return [opts.hive_host] + opts.hive_slaves
+
+# Fields shared by every record this run appends to the results store
+def base_record(opts, run_id, kind, query_num):
+  hosts = engine_hosts(opts)
+  family, value, cardinality = queries.QUERY_INFO[query_num]
+  return {
+    "run_id": run_id,
+    "kind": kind,
+    "timestamp": datetime.datetime.now().isoformat(),
+    "engine": engine_name(opts),
+    "query": query_num,
+    "family": family,
+    "param_value": value,
+    "expected_cardinality": cardinality,
+    "scale_factor": opts.scale_factor,
+    "cache_mode": "disk" if (opts.clear_buffer_cache or
+                             opts.shark_no_cache) else "mem",
+    "clear_buffer_cache": opts.clear_buffer_cache,
+    "table_variant": opts.table_variant,
+    "host": hosts[0],
+    "num_hosts": len(hosts),
+    "num_nodes": opts.num_nodes or len(hosts),
+    "client": socket.gethostname(),
+  }
+
+def store_results(opts, run_id, query_num, results, contents, monitor=None,
+                  injector=None, quiesce_waits=None):
+  # Steady state is detected among the trials that neither failed nor timed
+  # out, and starts at the first of those after the warmup, if any
+  recoveries = [log_parser.recovery(content) for content in contents]
+  done = [i for i in range(len(results)) if i >= len(recoveries) or
+          not (recoveries[i]["failed"] or recoveries[i]["timed_out"])]
+  warmup = stats.steady_state_start([results[i] for i in done])
+  warmup = warmup and done[warmup]
+  records = []
+  for trial, result in enumerate(results):
+    record = base_record(opts, run_id, "latency", query_num)
+    record["trial"] = trial
+    record["time"] = result
+    record["quiesce_wait"] = (quiesce_waits or {}).get((query_num, trial))
+    record["warmup"] = trial < warmup
+    if trial < len(contents):
+      statements = log_parser.parse(contents[trial])
+      record["sub_times"] = [st["time"] for st in statements]
+      record["statements"] = statements
+      record["counters"] = log_parser.totals(statements)
+      record.update(log_parser.recovery(contents[trial]))
+      record["output"] = [line.strip() for line in contents[trial]]
+    if monitor:
+      record["resources"] = monitor.trial_resources(query_num, trial)
+    if injector:
+      record["fault"] = injector.trial_fault((query_num, trial))
+    records.append(record)
+  results_store.append(opts.results_store, records)
+
+# Store the plan captured for a query, printing it as well
+def store_plan(opts, run_id, query_num, lines):
+  plan = plans.clean(lines)
+  print "Plan for query %s:" % query_num
+  print "\n".join(plan)
+  record = base_record(opts, run_id, "plan", query_num)
+  record["plan"] = plan
+  record["plan_hash"] = plans.plan_hash(plan)
+  results_store.append(opts.results_store, [record])
+
+# Check the checksum of a query's result against the catalog and store it,
+# printing what didn't match
+def store_checksum(opts, run_id, query_num, checksum):
+  mismatches = verify.check(query_num, checksum, opts.scale_factor)
+  print "Checksum of query %s: %s" % (query_num, checksum)
+  for mismatch in mismatches:
+    print >> stderr, "Query %s result mismatch: %s" % (query_num, mismatch)
+  record = base_record(opts, run_id, "checksum", query_num)
+  record["checksum"] = checksum
+  record["mismatches"] = mismatches
+  results_store.append(opts.results_store, [record])
+
+def write_results(opts, fname, query_num, results, contents):
   def prettylist(lst):
     return ",".join([str(k) for k in lst])
 
   output = StringIO()
-  outfile = open('results_%s_%s_%s' % (fname, opts.query_num, datetime.datetime.now()), 'w')
+  outfile = open('results_%s_%s_%s' % (fname, query_num, datetime.datetime.now()), 'w')
 
   try:
     if not opts.redshift:
       print >> output, "Contents: \n%s" % str(prettylist(contents))
     print >> output, "=================================="
     print >> output, "Results: %s" % prettylist(results)
-    print >> output, "Percentiles: %s" % get_percentiles(results)
-    print >> output, "Best: %s"  % min(results)
+    print >> output, "Trials: %d" % len(results)
+    # The time of a trial that failed or timed out is only how long it ran
+    # before that, so it is left out of the statistics below
+    recoveries = [log_parser.recovery(content) for content in contents]
+    timed_out = [i for i, r in enumerate(recoveries) if r["timed_out"]]
+    failed = [i for i, r in enumerate(recoveries)
+              if r["failed"] and not r["timed_out"]]
+    if timed_out:
+      print >> output, "Timed out trials: %s" % prettylist(
+        [i + 1 for i in timed_out])
+    if failed:
+      print >> output, "Failed trials: %s" % prettylist(
+        [i + 1 for i in failed])
+    results = [r for i, r in enumerate(results)
+               if i not in timed_out and i not in failed]
+    print >> output, "Successful trials: %d" % len(results)
+    if results:
+      print >> output, "Percentiles: %s" % get_percentiles(results)
+      print >> output, "Median %d%% CI: %s" % (
+        opts.confidence * 100, get_median_ci(results, opts.confidence))
+      # Trials before the detected steady state, summarized separately
+      warmup = stats.steady_state_start(results)
+      print >> output, "Warmup trials: %d" % warmup
+      if warmup:
+        print >> output, "Warmup results: %s" % prettylist(results[:warmup])
+        print >> output, "Steady-state percentiles: %s" % get_percentiles(
+          results[warmup:])
+        print >> output, "Steady-state median %d%% CI: %s" % (
+          opts.confidence * 100,
+          get_median_ci(results[warmup:], opts.confidence))
+      print >> output, "Best: %s"  % min(results)
     if not opts.redshift:
       print >> output, "Contents: \n%s" % str(prettylist(contents))
     print output.getvalue()
@@ -846,5 +1646,130 @@ def main():
   output.close()
   outfile.close()
 
+# Flags of the engines run_query.py can benchmark
+ENGINES = ["impala", "shark", "redshift", "hive", "hive_cdh", "local"]
+
+# Options selecting only `engine` out of those given on the command line
+def engine_opts(opts, engine):
+  engine_opts = Values(vars(opts))
+  for e in ENGINES:
+    setattr(engine_opts, e, e == engine)
+  if opts.all_queries and engine in ["impala", "redshift"]:
+    # Impala and Redshift have no implementation of Query 4
+    engine_opts.query_nums = [q for q in opts.query_nums
+                              if family_of(q) != '4']
+  engine_opts.query_num = engine_opts.query_nums[0]
+  return engine_opts
+
+# Benchmark the one engine selected in opts and write its results
+def run_engine(opts):
+  fname = opts.prefix + engine_name(opts)
+  run_id = "%s_%s" % (fname, datetime.datetime.now().strftime("%Y%m%dT%H%M%S"))
+
+  if opts.streams:
+    run_throughput(opts, fname, run_id)
+    return
+
+  monitor = None
+  if opts.sample_resources:
+    if opts.redshift:
+      print >> stderr, "Resources can't be sampled on Redshift nodes"
+    elif opts.local:
+      print >> stderr, "Resources are only sampled on cluster nodes"
+    else:
+      monitor = Monitor(opts.sample_interval, opts.net_capacity * 1e6,
+                        opts.host_parallelism)
+
+  injector = None
+  if opts.kill_worker_after is not None:
+    if opts.redshift:
+      print >> stderr, "Workers can't be killed on Redshift nodes"
+    elif opts.local:
+      print >> stderr, "Workers are only killed on cluster nodes"
+    else:
+      engine = [e for e in ENGINES if getattr(opts, e)][0]
+      restore = opts.restore_command
+      if restore is None and opts.impala:
+        restore = "sudo service impala-server start"
+      injector = FaultInjector(opts.kill_worker_after,
+                               opts.kill_process or DEFAULT_PROCESS[engine],
+                               restore, opts.seed)
+
+  plans_out = None
+  if opts.capture_plans:
+    plans_out = {}
+
+  checksums_out = None
+  if opts.verify:
+    checksums_out = {}
+
+  # Only Shark waits for its workers to quiesce between sessions
+  quiesce_out = {}
+
+  if opts.impala:
+    suite = run_impala_suite(opts, opts.query_nums, monitor, plans_out,
+                             injector, checksums_out)
+  if opts.shark:
+    suite = run_shark_suite(opts, opts.query_nums, monitor, plans_out,
+                            injector, checksums_out, quiesce_out)
+  if opts.redshift:
+    suite = run_redshift_suite(opts, opts.query_nums, plans_out,
+                               checksums_out)
+  if opts.hive:
+    suite = run_hive_suite(opts, opts.query_nums, monitor, plans_out,
+                           injector, checksums_out)
+  if opts.hive_cdh:
+    suite = run_hive_cdh_suite(opts, opts.query_nums, monitor, plans_out,
+                               injector, checksums_out)
+  if opts.local:
+    suite = run_local_suite(opts, opts.query_nums, plans_out, checksums_out)
+
+  for query_num in opts.query_nums:
+    if plans_out and query_num in plans_out:
+      store_plan(opts, run_id, query_num, plans_out[query_num])
+    if checksums_out is not None:
+      store_checksum(opts, run_id, query_num, checksums_out.get(query_num))
+    print "Query %s:" % query_num
+    results, contents = suite[query_num]
+    write_results(opts, fname, query_num, results, contents)
+    store_results(opts, run_id, query_num, results, contents, monitor,
+                  injector, quiesce_out)
+
+def main():
+  global opts
+  opts = parse_args()
+
+  print "Queries %s:" % ", ".join(opts.query_nums)
+
+  engines = [e for e in ENGINES if getattr(opts, e)]
+  if len(engines) == 1:
+    run_engine(engine_opts(opts, engines[0]))
+    return
+
+  # Each engine runs on its own cluster, so they can all be benchmarked at
+  # once, each writing its own results files and records
+  def run(engine):
+    try:
+      run_engine(engine_opts(opts, engine))
+    except SystemExit as e:
+      raise Exception("exited with status %s" % e.code)
+  print >> stderr, "Benchmarking %s concurrently" % ", ".join(engines)
+  started = datetime.datetime.now().isoformat()
+  results = fan_out(run, engines, len(engines), raise_on_error=False)
+  summarize("Benchmarked engines", results)
+  failed = [r for r in results if not r.ok()]
+  for r in failed:
+    print >> stderr, "%s failed:\n%s" % (r.host, r.traceback)
+
+  # Compare the results of the engines that just ran
+  if opts.verify:
+    checksums = [r for r in results_store.load(opts.results_store,
+                                               kind="checksum")
+                 if r["timestamp"] >= started]
+    mismatches = verify.report(checksums, sys.stdout)
+    print "%d result mismatch(es) across engines" % mismatches
+  if failed:
+    sys.exit(1)
+
 if __name__ == "__main__":
   main()
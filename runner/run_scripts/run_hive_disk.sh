@@ -26,14 +26,12 @@ RUN_DIR=..
 queries=(1a)
 out_file=hive_disk_`date +%s`
 
-for i in "${queries[@]}"
-do
-  $RUN_DIR/run-query.sh \
-    --impala \
-    --query-num=$i \
-    --impala-use-hive \
-    --clear-buffer-cache \
-    --num-trials=$NUM_TRIALS \
-    --impala-hosts=$IMPALA_HOSTS \
-    --impala-identity-file=$IMPALA_IDENTITY_FILE >> $out_file
-done
+# Run every query as one suite so cluster setup and warmup are shared
+$RUN_DIR/run-query.sh \
+  --impala \
+  --query-num=$(IFS=,; echo "${queries[*]}") \
+  --impala-use-hive \
+  --clear-buffer-cache \
+  --num-trials=$NUM_TRIALS \
+  --impala-hosts=$IMPALA_HOSTS \
+  --impala-identity-file=$IMPALA_IDENTITY_FILE >> $out_file
@@ -26,15 +26,13 @@ RUN_DIR=..
 queries=(3a 3b 3c)
 out_file=impala_disk_`date +%s`
 
-for i in "${queries[@]}"
-do
-  $RUN_DIR/run-query.sh \
-    --impala \
-    --query-num=$i \
-    --clear-buffer-cache \
-    --num-trials=$NUM_TRIALS \
-    --impala-hosts=$IMPALA_HOSTS \
-    --impala-identity-file=$IMPALA_IDENTITY_FILE >> $out_file
-done
+# Run every query as one suite so cluster setup and warmup are shared
+$RUN_DIR/run-query.sh \
+  --impala \
+  --query-num=$(IFS=,; echo "${queries[*]}") \
+  --clear-buffer-cache \
+  --num-trials=$NUM_TRIALS \
+  --impala-hosts=$IMPALA_HOSTS \
+  --impala-identity-file=$IMPALA_IDENTITY_FILE >> $out_file
 
 
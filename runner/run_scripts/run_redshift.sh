@@ -24,15 +24,13 @@ RUN_DIR=..
 queries=(1a)
 out_file=redshift_`date +%s`
 
-for i in "${queries[@]}"
-do
-  $RUN_DIR/run-query.sh \
-    --redshift \
-    --query-num=$i \
-    --num-trials=$NUM_TRIALS \
-    --redshift-host=$REDSHIFT_HOST \
-    --redshift-username=$REDSHIFT_USERNAME \
-    --redshift-database=$REDSHIFT_DATABASE \
-    --redshift-password=$REDSHIFT_PASSWORD >> $out_file
-done
+# Run every query as one suite so cluster setup and warmup are shared
+$RUN_DIR/run-query.sh \
+  --redshift \
+  --query-num=$(IFS=,; echo "${queries[*]}") \
+  --num-trials=$NUM_TRIALS \
+  --redshift-host=$REDSHIFT_HOST \
+  --redshift-username=$REDSHIFT_USERNAME \
+  --redshift-database=$REDSHIFT_DATABASE \
+  --redshift-password=$REDSHIFT_PASSWORD >> $out_file
 
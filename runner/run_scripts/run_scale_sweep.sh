@@ -0,0 +1,58 @@
+#!/bin/bash
+
+# Copyright 2013 The Regents of The University California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Prepare and run the suite at several scale factors, then fit scaling
+# curves to the results. Each scale factor runs on its own Shark cluster
+# (SHARK_HOSTS[i] is the master for SCALE_FACTORS[i], with NUM_NODES[i]
+# slaves), since re-importing a data set on top of another mixes the two.
+# Use the same node count for every point to measure data scaling alone.
+
+SCALE_FACTORS=(1 5 10)
+NUM_NODES=(1 5 10)
+SHARK_HOSTS=(ec2-184-73-94-24.compute-1.amazonaws.com \
+ec2-54-226-72-108.compute-1.amazonaws.com \
+ec2-23-20-84-156.compute-1.amazonaws.com)
+SHARK_IDENTITY_FILE=~/.ssh/patkey.pem
+AWS_KEY_ID=
+AWS_KEY=
+NUM_TRIALS=5
+RUN_DIR=..
+queries=(1a 1b 1c 2a 2b 2c 3a 3b 3c)
+store=scale_sweep_`date +%s`.jsonl
+out_file=$store.log
+
+for i in ${!SCALE_FACTORS[@]}; do
+  $RUN_DIR/prepare-benchmark.sh \
+    --shark \
+    --scale-factor=${SCALE_FACTORS[$i]} \
+    --shark-host=${SHARK_HOSTS[$i]} \
+    --shark-identity-file=$SHARK_IDENTITY_FILE \
+    --aws-key-id=$AWS_KEY_ID \
+    --aws-key=$AWS_KEY >> $out_file
+
+  $RUN_DIR/run-query.sh \
+    --shark \
+    --query-num=$(IFS=,; echo "${queries[*]}") \
+    --reduce-tasks=500 \
+    --num-trials=$NUM_TRIALS \
+    --scale-factor=${SCALE_FACTORS[$i]} \
+    --num-nodes=${NUM_NODES[$i]} \
+    --results-store=`pwd`/$store \
+    --shark-host=${SHARK_HOSTS[$i]} \
+    --shark-identity-file=$SHARK_IDENTITY_FILE >> $out_file
+done
+
+python $RUN_DIR/scaling.py $store --predict=20,50,100
@@ -22,17 +22,15 @@ RUN_DIR=..
 queries=(1a)
 out_file=shark_disk_`date +%s`
 
-for i in "${queries[@]}"
-do
-  $RUN_DIR/run-query.sh \
-    --shark \
-    --query-num=$i \
-    --shark-no-cache \
-    --clear-buffer-cache \
-    --reduce-tasks=500 \
-    --num-trials=$NUM_TRIALS \
-    --shark-host=$SHARK_HOST \
-    --shark-identity-file=$SHARK_IDENTITY_FILE >> $out_file
-done
+# Run every query as one suite so cluster setup and warmup are shared
+$RUN_DIR/run-query.sh \
+  --shark \
+  --query-num=$(IFS=,; echo "${queries[*]}") \
+  --shark-no-cache \
+  --clear-buffer-cache \
+  --reduce-tasks=500 \
+  --num-trials=$NUM_TRIALS \
+  --shark-host=$SHARK_HOST \
+  --shark-identity-file=$SHARK_IDENTITY_FILE >> $out_file
 
 
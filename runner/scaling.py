@@ -0,0 +1,152 @@
+# Copyright 2013 The Regents of The University California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Fit per-query scaling curves to runs at several scale factors.
+
+   Reads latency records from results stores (see results_store.py) that
+   were run with --scale-factor and --num-nodes, takes the median
+   steady-state time of every (engine, query, scale factor, nodes) point
+   and fits power laws
+
+     time = a * size ^ b      for a fixed number of nodes
+     time = a * nodes ^ b     for a fixed scale factor
+     time = a * nodes ^ b     with data growing with the cluster
+                              (scale factor == nodes, as the benchmark
+                              data sets are sized)
+
+   Ideal exponents are 1, -1 and 0 respectively. Efficiency compares each
+   point to the smallest one; the first point falling below
+   --min-efficiency is where an engine stops scaling. Usage:
+
+     python scaling.py results.jsonl --predict 20,50
+"""
+
+import math
+import sys
+from optparse import OptionParser
+
+import results_store
+import stats
+
+# Total size of the Rankings, UserVisits and crawl data of each scale factor
+DATA_SIZE_GB = {
+  0: 0.0086,
+  1: 55.7,
+  5: 270.1,
+  10: 540.2
+}
+
+def data_size(scale_factor):
+  return DATA_SIZE_GB.get(scale_factor, 54.0 * scale_factor)
+
+def fit_power_law(points):
+  """Least-squares fit of y = a * x^b in log space. Returns (a, b)."""
+  logs = [(math.log(x), math.log(y)) for (x, y) in points]
+  n = float(len(logs))
+  mean_x = sum(x for x, y in logs) / n
+  mean_y = sum(y for x, y in logs) / n
+  sxx = sum((x - mean_x) ** 2 for x, y in logs)
+  if sxx == 0:
+    raise ValueError("Need at least two distinct sizes to fit a curve")
+  b = sum((x - mean_x) * (y - mean_y) for x, y in logs) / sxx
+  return math.exp(mean_y - b * mean_x), b
+
+# Median steady-state time of each (scale factor, nodes) point, leaving out
+# trials that failed or timed out
+def median_times(records):
+  times = {}
+  for r in records:
+    nodes = r.get("num_nodes") or r.get("num_hosts")
+    if r.get("scale_factor") is None or not nodes or r.get("time") is None:
+      continue
+    if r.get("failed") or r.get("timed_out"):
+      continue
+    times.setdefault((r["scale_factor"], nodes), []).append(r)
+  medians = {}
+  for point, rs in times.items():
+    steady = [r["time"] for r in rs if not r.get("warmup")]
+    medians[point] = stats.median(steady or [r["time"] for r in rs])
+  return medians
+
+# Fit one curve and print it with the efficiency of every point.
+# `ideal(x0, x)` is the time ratio t(x) / t(x0) of a perfectly scaling system.
+def report_curve(label, points, ideal, predict, min_efficiency, out):
+  points = sorted(points)
+  if len(set(x for x, t in points)) < 2:
+    return
+  a, b = fit_power_law(points)
+  print >> out, "  %s: time = %.3g * x^%.2f" % (label, a, b)
+  x0, t0 = points[0]
+  fall_off = None
+  for x, t in points:
+    efficiency = ideal(x0, x) * t0 / t
+    print >> out, "    x=%-8g time=%-10.2f efficiency=%.2f" % (x, t, efficiency)
+    if fall_off is None and efficiency < min_efficiency:
+      fall_off = x
+  if fall_off is not None:
+    print >> out, "    efficiency falls below %.2f at x=%g" % (
+      min_efficiency, fall_off)
+  for x in predict:
+    print >> out, "    predicted time at x=%g: %.2f" % (x, a * x ** b)
+
+def report(records, out, predict=[], min_efficiency=0.8):
+  groups = results_store.group(records, "engine", "query")
+  for (engine, query), rs in sorted(groups.items()):
+    medians = median_times(rs)
+    if len(medians) < 2:
+      continue
+    print >> out, "=== %s, query %s ===" % (engine, query)
+    for nodes in sorted(set(n for sf, n in medians)):
+      report_curve("time vs data size (GB) on %d nodes" % nodes,
+                   [(data_size(sf), t) for (sf, n), t in medians.items()
+                    if n == nodes],
+                   lambda x0, x: x / x0, [], min_efficiency, out)
+    for scale_factor in sorted(set(sf for sf, n in medians)):
+      report_curve("time vs nodes at scale factor %d" % scale_factor,
+                   [(n, t) for (sf, n), t in medians.items()
+                    if sf == scale_factor],
+                   lambda x0, x: x0 / float(x), predict, min_efficiency, out)
+    report_curve("time vs nodes, data growing with nodes",
+                 [(n, t) for (sf, n), t in medians.items() if sf == n],
+                 lambda x0, x: 1.0, predict, min_efficiency, out)
+
+def parse_args():
+  parser = OptionParser(usage="scaling.py [options] STORE...")
+  parser.add_option("--engine", action="append",
+      help="Only include this engine (may be repeated)")
+  parser.add_option("--query", action="append",
+      help="Only include this query (may be repeated)")
+  parser.add_option("--predict", default="",
+      help="Node counts to predict query times for (comma separated)")
+  parser.add_option("--min-efficiency", type="float", default=0.8,
+      help="Efficiency below which a query is reported as no longer scaling")
+  (opts, args) = parser.parse_args()
+  if not args:
+    parser.print_help()
+    sys.exit(1)
+  return opts, args
+
+def main():
+  opts, paths = parse_args()
+  filters = {"kind": "latency"}
+  if opts.engine:
+    filters["engine"] = opts.engine
+  if opts.query:
+    filters["query"] = opts.query
+  predict = [float(x) for x in opts.predict.split(",") if x]
+  report(list(results_store.load(paths, **filters)), sys.stdout, predict,
+         opts.min_efficiency)
+
+if __name__ == "__main__":
+  main()
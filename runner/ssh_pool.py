@@ -0,0 +1,129 @@
+# Copyright 2013 The Regents of The University California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Persistent, multiplexed SSH sessions for the benchmark scripts.
+
+   Every remote operation in the runner shells out to ssh or scp, which
+   normally pays for a TCP handshake and a full key exchange each time.
+   A SessionPool keeps one OpenSSH control master per (host, user,
+   identity file) and routes every later ssh/scp process through its
+   control socket, so a command or file transfer only opens a new channel
+   on an already authenticated connection.
+"""
+
+import atexit
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+class SessionPool(object):
+  """Tracks the control masters opened for each (host, user, identity).
+
+     `ssh_cmd` and `scp_cmd` may be replaced with local stand-ins (any
+     program accepting the same arguments) to exercise the pool without
+     a remote host.
+  """
+
+  def __init__(self, control_dir=None, persist=600, ssh_cmd="ssh",
+               scp_cmd="scp"):
+    self.control_dir = control_dir
+    self.persist = persist
+    self.ssh_cmd = ssh_cmd
+    self.scp_cmd = scp_cmd
+    self.enabled = True
+    self.sessions = {}
+    self.lock = threading.Lock()
+
+  def _control_path(self, host, username, identity_file):
+    key = (host, username, identity_file)
+    with self.lock:
+      if self.control_dir is None:
+        self.control_dir = tempfile.mkdtemp(prefix="bdb_ssh_")
+      if key not in self.sessions:
+        # Unix socket paths are limited to ~100 bytes, so use a digest
+        # rather than the (potentially very long) EC2 hostname.
+        digest = hashlib.md5("%s@%s:%s" % key).hexdigest()[:16]
+        self.sessions[key] = os.path.join(self.control_dir, digest)
+      return self.sessions[key]
+
+  def options(self, host, username, identity_file):
+    """Return the ssh/scp options used to reach the given host."""
+    opts = "-o StrictHostKeyChecking=no -i %s" % identity_file
+    if not self.enabled:
+      return opts
+    return opts + " -o ControlMaster=auto -o ControlPath=%s " \
+        "-o ControlPersist=%s" % (
+          self._control_path(host, username, identity_file), self.persist)
+
+  def ssh(self, host, username, identity_file, command):
+    return subprocess.check_call(
+        "%s -t %s %s@%s '%s'" %
+        (self.ssh_cmd, self.options(host, username, identity_file),
+         username, host, command), shell=True)
+
+  def popen(self, host, username, identity_file, command):
+    """Start a command without a tty, with its stdin and stdout piped."""
+    return subprocess.Popen(
+        "%s %s %s@%s '%s'" %
+        (self.ssh_cmd, self.options(host, username, identity_file),
+         username, host, command), shell=True,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+  def scp_to(self, host, identity_file, username, local_file, remote_file):
+    return subprocess.check_call(
+        "%s -q %s '%s' '%s@%s:%s'" %
+        (self.scp_cmd, self.options(host, username, identity_file),
+         local_file, username, host, remote_file), shell=True)
+
+  def scp_from(self, host, identity_file, username, remote_file, local_file):
+    return subprocess.check_call(
+        "%s -q %s '%s@%s:%s' '%s'" %
+        (self.scp_cmd, self.options(host, username, identity_file),
+         username, host, remote_file, local_file), shell=True)
+
+  def close(self):
+    """Shut down every control master and remove the socket directory."""
+    with self.lock:
+      sessions = self.sessions.items()
+      self.sessions = {}
+    devnull = open(os.devnull, 'w')
+    for (host, username, identity_file), path in sessions:
+      if os.path.exists(path):
+        subprocess.call(
+            "%s -o ControlPath=%s -O exit %s@%s" %
+            (self.ssh_cmd, path, username, host), shell=True,
+            stdout=devnull, stderr=devnull)
+    devnull.close()
+    if self.control_dir is not None and os.path.isdir(self.control_dir):
+      shutil.rmtree(self.control_dir, ignore_errors=True)
+    self.control_dir = None
+
+# Shared by every script in the runner
+POOL = SessionPool()
+atexit.register(POOL.close)
+
+# Run a command on a host through ssh, throwing an exception if ssh fails
+def ssh(host, username, identity_file, command):
+  return POOL.ssh(host, username, identity_file, command)
+
+# Copy a file to a given host through scp, throwing an exception if scp fails
+def scp_to(host, identity_file, username, local_file, remote_file):
+  return POOL.scp_to(host, identity_file, username, local_file, remote_file)
+
+# Copy a file from a given host through scp, throwing an exception if scp fails
+def scp_from(host, identity_file, username, remote_file, local_file):
+  return POOL.scp_from(host, identity_file, username, remote_file, local_file)
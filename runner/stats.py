@@ -0,0 +1,163 @@
+# Copyright 2013 The Regents of The University California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Summary statistics for benchmark trial times.
+
+   Percentiles are linearly interpolated between the closest ranks, so with
+   few trials the 95th percentile is no longer simply the slowest trial.
+   Confidence intervals come from a percentile bootstrap, which makes no
+   assumption about how query times are distributed.
+"""
+
+import math
+import random
+
+def percentile(values, pctl):
+  """Linearly interpolated percentile of `values`, with `pctl` in [0, 1]."""
+  values = sorted(values)
+  if not values:
+    raise ValueError("percentile of an empty list")
+  rank = pctl * (len(values) - 1)
+  low = int(rank)
+  high = min(low + 1, len(values) - 1)
+  return values[low] + (values[high] - values[low]) * (rank - low)
+
+def median(values):
+  return percentile(values, 0.5)
+
+def bootstrap_ci(values, stat=median, confidence=0.95, resamples=1000, seed=0):
+  """Return the (low, high) bootstrap confidence interval of stat(values)."""
+  rand = random.Random(seed)
+  n = len(values)
+  estimates = [stat([values[rand.randrange(n)] for i in range(n)])
+               for r in range(resamples)]
+  alpha = (1 - confidence) / 2
+  return percentile(estimates, alpha), percentile(estimates, 1 - alpha)
+
+def steady_state_start(values):
+  """Number of leading warmup trials in `values`, a series in trial order.
+
+     Uses the marginal standard error rule (MSER): drop the prefix that
+     minimizes the squared standard error of the mean of what remains,
+     considering at most half of the trials. A prefix is only dropped if its
+     trials were slower than the rest, as a JVM or cache warming up would
+     make them.
+  """
+  n = len(values)
+  best_d, best_score = 0, None
+  for d in range(n // 2 + 1):
+    tail = values[d:]
+    if len(tail) < 2:
+      break
+    mean = sum(tail) / float(len(tail))
+    if d > 0 and sum(values[:d]) / float(d) <= mean:
+      continue
+    score = sum((x - mean) ** 2 for x in tail) / float(len(tail) ** 2)
+    if best_score is None or score < best_score:
+      best_d, best_score = d, score
+  return best_d
+
+def relative_ci_width(values, confidence=0.95):
+  """Width of the median's confidence interval as a fraction of the median."""
+  low, high = bootstrap_ci(values, confidence=confidence)
+  mid = median(values)
+  if mid == 0:
+    return 0.0
+  return (high - low) / mid
+
+class StoppingRule(object):
+  """Decides whether a query needs more trials.
+
+     Trials continue until at least `min_trials` steady-state trials have
+     run and their median's confidence interval is narrower than
+     `target_width` (relative to the median), or until `max_trials` have
+     run. Without a target width every query runs exactly `max_trials`
+     trials.
+  """
+
+  def __init__(self, max_trials, min_trials=3, target_width=None,
+               confidence=0.95):
+    self.max_trials = max_trials
+    self.min_trials = min(min_trials, max_trials)
+    self.target_width = target_width
+    self.confidence = confidence
+
+  def wants_more(self, times):
+    if len(times) >= self.max_trials:
+      return False
+    if self.target_width is None:
+      return True
+    steady = times[steady_state_start(times):]
+    if len(steady) < self.min_trials:
+      return True
+    return relative_ci_width(steady, self.confidence) > self.target_width
+
+def _exact_u_counts(m, n):
+  """Number of orderings of m + n distinct values giving each U statistic."""
+  # counts[j][u]: orderings of i values from the first sample and j from
+  # the second with statistic u, built up one value of the first at a time
+  counts = [[1] for j in range(n + 1)]
+  for i in range(1, m + 1):
+    row = [[1]]
+    for j in range(1, n + 1):
+      size = i * j + 1
+      cell = [0] * size
+      for u, c in enumerate(row[j - 1]):
+        cell[u] += c
+      for u, c in enumerate(counts[j]):
+        cell[u + j] += c
+      row.append(cell)
+    counts = row
+  return counts[n]
+
+def mann_whitney(a, b):
+  """Two-sided Mann-Whitney U test of whether `b` tends to differ from `a`.
+
+     Returns (u, p) where u counts the pairs in which the value from `b` is
+     larger, ties counting half. The p-value is exact when there are no
+     ties and both samples are small, and otherwise comes from the normal
+     approximation with tie and continuity corrections.
+  """
+  m, n = len(a), len(b)
+  if not m or not n:
+    raise ValueError("mann_whitney needs two non-empty samples")
+  u = sum((y > x) + 0.5 * (y == x) for x in a for y in b)
+  mean = m * n / 2.0
+  if len(set(a) | set(b)) == m + n and m + n <= 40:
+    counts = _exact_u_counts(m, n)
+    extreme = min(u, m * n - u)
+    tail = sum(counts[:int(extreme) + 1])
+    return u, min(1.0, 2.0 * tail / sum(counts))
+  # Tie correction: sum of t^3 - t over every group of t equal values
+  values = sorted(list(a) + list(b))
+  ties = 0
+  i = 0
+  while i < len(values):
+    j = i
+    while j < len(values) and values[j] == values[i]:
+      j += 1
+    ties += (j - i) ** 3 - (j - i)
+    i = j
+  total = float(m + n)
+  variance = m * n / 12.0 * ((total + 1) - ties / (total * (total - 1)))
+  if variance <= 0:
+    return u, 1.0
+  z = max(abs(u - mean) - 0.5, 0) / math.sqrt(variance)
+  return u, math.erfc(z / math.sqrt(2))
+
+def cliffs_delta(a, b):
+  """Effect size in [-1, 1]: P(value from b > value from a) - P(b < a)."""
+  greater = sum(y > x for x in a for y in b)
+  less = sum(y < x for x in a for y in b)
+  return (greater - less) / float(len(a) * len(b))
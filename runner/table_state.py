@@ -0,0 +1,88 @@
+# Copyright 2013 The Regents of The University California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Decide whether a table derived from the benchmark data must be rebuilt.
+
+   A derived table is fingerprinted by the recursive HDFS listing (path,
+   size, permissions and modification time of every file) of the source
+   locations it is built from. The fingerprint it was last built from is
+   kept in a stamp file on the master, so a later run can leave the table
+   alone when its sources have not changed since, e.g. because the data set
+   was not re-imported in between. A table whose directory in the
+   warehouse is gone, e.g. because it was dropped, is rebuilt regardless.
+
+   Usage from the runner:
+
+     table = DerivedTable("scratch_rank", ["/tmp/benchmark/scratch"],
+                          "hadoop", "/mnt")
+     if not table.check(host, user, identity_file, invalidate):
+       ... rebuild scratch_rank ...
+     ... once the rebuild succeeded ...
+     table.commit(host, user, identity_file)
+"""
+
+import ssh_pool
+
+class DerivedTable(object):
+  def __init__(self, name, sources, hadoop="hadoop", state_dir="/mnt",
+               location=None):
+    self.name = name
+    self.sources = sources
+    self.hadoop = hadoop
+    self.location = location or "/user/hive/warehouse/%s" % name
+    self.stamp = "%s/bdb_%s.fingerprint" % (state_dir, name)
+    self.fingerprint = None
+    self.current = False
+
+  # Print the fingerprint of the sources, or nothing if one can't be listed,
+  # and whether it matches the stamp and the table still exists. Also leave
+  # it next to the stamp, for commit() to move into place. Hadoop 1 has no
+  # "fs -ls -R", only "fs -lsr". May not contain single quotes, since it is
+  # run through ssh.
+  def check_command(self, invalidate=False):
+    pending = self.stamp + ".pending"
+    sources = " ".join(self.sources)
+    command = "listing=$(%s fs -ls -R %s 2>/dev/null || " \
+              "%s fs -lsr %s 2>/dev/null) || exit 0; " \
+              "fp=$(echo \"$listing\" | md5sum | cut -c 1-32); " \
+              "echo $fp > %s; echo $fp; " % (
+                self.hadoop, sources, self.hadoop, sources, pending)
+    if invalidate:
+      return command + "rm -f %s; echo stale" % self.stamp
+    return command + "if %s fs -test -d %s 2>/dev/null && cmp -s %s %s; " \
+                     "then rm -f %s; echo current; else echo stale; fi" % (
+                       self.hadoop, self.location, pending, self.stamp,
+                       pending)
+
+  def check(self, host, username, identity_file, invalidate=False):
+    """Fingerprint the sources on `host`. True if the table is current."""
+    proc = ssh_pool.POOL.popen(host, username, identity_file,
+                               self.check_command(invalidate))
+    proc.stdin.close()
+    lines = proc.stdout.read().split()
+    proc.wait()
+    self.fingerprint = None
+    self.current = False
+    if len(lines) >= 2:
+      self.fingerprint = lines[-2]
+      self.current = lines[-1] == "current"
+    return self.current
+
+  # Record that the table now reflects the fingerprint found by check()
+  def commit(self, host, username, identity_file):
+    if self.fingerprint is None or self.current:
+      return
+    ssh_pool.ssh(host, username, identity_file,
+                 "mv -f %s.pending %s" % (self.stamp, self.stamp))
+    self.current = True
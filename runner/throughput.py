@@ -0,0 +1,120 @@
+# Copyright 2013 The Regents of The University California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure query throughput with several concurrent query streams.
+
+   Each stream runs its own sequence of queries, drawn from a weighted mix,
+   back to back. All streams start together, and every query's start time
+   and latency is recorded. Running the same mix at several concurrency
+   levels shows how throughput scales and how much latency degrades as
+   queries start queueing behind each other.
+"""
+
+import random
+import time
+
+import stats
+from fanout import fan_out
+
+# Parse a mix such as "1a:3,2a,3a:2" into [("1a", 3), ("2a", 1), ("3a", 2)]
+def parse_mix(mix):
+  weighted = []
+  for item in mix.split(","):
+    if ":" in item:
+      query_num, weight = item.split(":")
+      weighted.append((query_num, int(weight)))
+    else:
+      weighted.append((item, 1))
+  return weighted
+
+# The deterministic sequence of queries a given stream will run
+def stream_queries(mix, count, stream, seed=0):
+  rand = random.Random(seed * 1000 + stream)
+  choices = [q for (q, weight) in mix for i in range(weight)]
+  return [rand.choice(choices) for i in range(count)]
+
+class QueryRecord(object):
+  def __init__(self, stream, query_num, start):
+    self.stream = stream
+    self.query_num = query_num
+    self.start = start
+    self.latency = None
+    self.error = None
+
+def run_streams(make_executor, num_streams, mix, queries_per_stream, seed=0):
+  """Run `num_streams` concurrent streams and return (records, makespan).
+
+     make_executor(stream) is called for every stream before any query
+     starts, so per-stream setup is not timed. It must return a function
+     that runs one query and returns its latency in seconds.
+  """
+  executors = [make_executor(s) for s in range(num_streams)]
+  sequences = [stream_queries(mix, queries_per_stream, s, seed)
+               for s in range(num_streams)]
+  t0 = time.time()
+
+  def run_stream(stream):
+    records = []
+    for query_num in sequences[stream]:
+      record = QueryRecord(stream, query_num, time.time() - t0)
+      try:
+        record.latency = executors[stream](query_num)
+      except Exception as e:
+        record.error = e
+      records.append(record)
+    return records
+
+  results = fan_out(run_stream, range(num_streams), parallelism=num_streams)
+  makespan = time.time() - t0
+  return [rec for r in results for rec in r.value], makespan
+
+def report(levels, out):
+  """Print a summary of every concurrency level that was run.
+
+     `levels` is a list of (num_streams, records, makespan). Slowdown is the
+     median latency of a query relative to its median at the lowest
+     concurrency level.
+  """
+  baseline = {}
+  for num_streams, records, makespan in sorted(levels):
+    done = [r for r in records if r.error is None]
+    failed = len(records) - len(done)
+    print >> out, "=== %d concurrent stream(s) ===" % num_streams
+    print >> out, "Completed %d queries (%d failed) in %.2fs: " \
+        "%.1f queries/hour" % (len(done), failed, makespan,
+                               len(done) * 3600.0 / makespan)
+    # By Little's law, the average number of queries in flight
+    if done:
+      print >> out, "Average queries in flight: %.2f" % (
+        sum(r.latency for r in done) / makespan)
+
+    print >> out, "Query\tCount\tp5\tp50\tp95\tSlowdown"
+    for query_num in sorted(set(r.query_num for r in done)):
+      lat = [r.latency for r in done if r.query_num == query_num]
+      median = stats.median(lat)
+      baseline.setdefault(query_num, median)
+      print >> out, "%s\t%d\t%.2f\t%.2f\t%.2f\t%.2fx" % (
+        query_num, len(lat), stats.percentile(lat, .05), median,
+        stats.percentile(lat, .95), median / baseline[query_num])
+
+    print >> out, "Stream\tCount\tp50\tMax\tBusy"
+    for stream in range(num_streams):
+      lat = [r.latency for r in done if r.stream == stream]
+      if lat:
+        print >> out, "%d\t%d\t%.2f\t%.2f\t%.2fs" % (
+          stream, len(lat), stats.median(lat), max(lat), sum(lat))
+    for r in records:
+      if r.error is not None:
+        print >> out, "Stream %d query %s failed: %s" % (
+          r.stream, r.query_num, r.error)
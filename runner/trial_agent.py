@@ -0,0 +1,194 @@
+# Copyright 2013 The Regents of The University California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run benchmark trials on a cluster node and stream back their results.
+
+   run_query.py copies this script to the master once, starts it over a
+   single ssh channel and writes a JSON job description as the first line
+   of its stdin:
+
+     {"steps": [{"id": ..., "command": "...", "pre": ["..."],
+                 "include": "regex", "exclude": "regex",
+                 "notify": "regex", "barrier": false, "timeout": seconds,
+                 "timeout_from": "regex"}, ...]}
+
+   Every step runs locally, timed with a monotonic clock, and produces one
+   JSON record on stdout containing the output lines that match `include`
+   but not `exclude`, and the wall-clock times the step started, ended and
+   printed each of those lines. Lines matching `notify` are also sent on
+   their own as soon as they are printed, so the client can follow the
+   progress of a long step. A step marked as a barrier first emits a "ready"
+   record and waits for a "go" line on stdin, so the client can act on
+   other hosts (e.g. clear buffer caches) between trials without opening
+   another connection. Answering "skip" instead skips that step, which lets
+   the client stop running trials once it has seen enough of them.
+
+   A step with a `timeout` is cancelled once it has run that long: its
+   process group gets SIGINT, which makes the Hive, Shark and Impala CLIs
+   kill the job they are running, then SIGTERM and SIGKILL if it is still
+   around a grace period later. With `timeout_from`, the deadline instead
+   starts (and restarts) whenever a line matching it is printed, so a step
+   running several trials gets a deadline per trial. The record of a
+   cancelled step has "timed_out" set and ends with a TIMED_OUT line.
+
+   This runs on the cluster nodes, so it must stay compatible with the
+   Python 2.6 found there and may only use the standard library.
+"""
+
+import ctypes
+import json
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+CLOCK_MONOTONIC = 1
+
+class _timespec(ctypes.Structure):
+  _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+def _make_clock():
+  try:
+    librt = ctypes.CDLL("librt.so.1", use_errno=True)
+    clock_gettime = librt.clock_gettime
+  except (OSError, AttributeError):
+    return "time", time.time
+  ts = _timespec()
+  def monotonic():
+    if clock_gettime(CLOCK_MONOTONIC, ctypes.pointer(ts)) != 0:
+      raise OSError(ctypes.get_errno(), "clock_gettime failed")
+    return ts.tv_sec + ts.tv_nsec * 1e-9
+  return "monotonic", monotonic
+
+CLOCK_NAME, clock = _make_clock()
+
+# Printed as the last line of a step that ran out of time
+TIMED_OUT = "Timed out after %g seconds\n"
+
+# Seconds to wait for a cancelled step to exit before the next signal
+GRACE_PERIOD = 15
+
+class Watchdog(threading.Thread):
+  """Cancels the process group `pgid` once its deadline passes."""
+  def __init__(self, pgid, timeout, grace=GRACE_PERIOD):
+    threading.Thread.__init__(self)
+    self.setDaemon(True)
+    self.pgid = pgid
+    self.timeout = timeout
+    self.grace = grace
+    self.deadline = None
+    self.fired = False
+    self.done = threading.Event()
+
+  def restart(self):
+    self.deadline = clock() + self.timeout
+
+  def run(self):
+    while not self.done.isSet():
+      if self.deadline is not None and clock() >= self.deadline:
+        self.cancel()
+        return
+      self.done.wait(0.5)
+
+  def cancel(self):
+    self.fired = True
+    for sig in [signal.SIGINT, signal.SIGTERM, signal.SIGKILL]:
+      try:
+        os.killpg(self.pgid, sig)
+      except OSError:
+        return
+      self.done.wait(self.grace)
+      if self.done.isSet():
+        return
+
+  # Called once the step's process has exited
+  def stop(self):
+    self.done.set()
+    self.join()
+
+def emit(record):
+  sys.stdout.write(json.dumps(record) + "\n")
+  sys.stdout.flush()
+
+def run_step(step):
+  devnull = open(os.devnull, 'w')
+  for command in step.get("pre", []):
+    subprocess.call(command, shell=True, stdout=devnull,
+                    stderr=subprocess.STDOUT)
+  devnull.close()
+
+  include = re.compile(step.get("include") or ".")
+  exclude = step.get("exclude") and re.compile(step["exclude"])
+  notify = step.get("notify") and re.compile(step["notify"])
+  timeout_from = step.get("timeout_from") and re.compile(step["timeout_from"])
+  lines = []
+  line_times = []
+  wall_start = time.time()
+  start = clock()
+  # In a process group of its own, so it can be cancelled as a whole
+  proc = subprocess.Popen(step["command"], shell=True, stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT, universal_newlines=True,
+                          preexec_fn=os.setsid)
+  watchdog = None
+  if step.get("timeout"):
+    watchdog = Watchdog(proc.pid, step["timeout"])
+    if not timeout_from:
+      watchdog.restart()
+    watchdog.start()
+  for line in iter(proc.stdout.readline, ""):
+    if watchdog and timeout_from and timeout_from.search(line):
+      watchdog.restart()
+    if include.search(line) and not (exclude and exclude.search(line)):
+      lines.append(line)
+      line_times.append(time.time())
+    if notify and notify.search(line):
+      emit({"type": "line", "id": step["id"], "line": line,
+            "time": time.time()})
+  returncode = proc.wait()
+  end = clock()
+  timed_out = False
+  if watchdog:
+    watchdog.stop()
+    timed_out = watchdog.fired
+  if timed_out:
+    lines.append(TIMED_OUT % step["timeout"])
+    line_times.append(time.time())
+  return {"type": "step", "id": step["id"], "start": start, "end": end,
+          "elapsed": end - start, "returncode": returncode, "lines": lines,
+          "wall_start": wall_start, "wall_end": time.time(),
+          "line_times": line_times, "timed_out": timed_out}
+
+def main():
+  job = json.loads(sys.stdin.readline())
+  emit({"type": "hello", "host": socket.gethostname(), "clock": CLOCK_NAME})
+  for step in job["steps"]:
+    if step.get("barrier"):
+      emit({"type": "ready", "id": step["id"]})
+      reply = sys.stdin.readline().strip()
+      if reply == "skip":
+        emit({"type": "skipped", "id": step["id"]})
+        continue
+      if reply != "go":
+        emit({"type": "aborted", "id": step["id"]})
+        return 1
+    emit(run_step(step))
+  emit({"type": "done"})
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,173 @@
+# Copyright 2013 The Regents of The University California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Check the results engines produce without copying them off the cluster.
+
+   run_query.py --verify has the engine checksum the result table of each
+   query after its last trial: the number of rows and, for every column,
+   the sum of its values, or of their lengths for strings. Sums don't
+   depend on the order of rows, and every engine (and local_engine.py) can
+   compute them, so checksums can be compared across engines. Sums of
+   floating point values are compared with a relative tolerance, since
+   engines add them up in different orders.
+
+   Row counts are checked against the catalog (see queries.py), which has
+   them for queries 1 and 2 on the 5nodes data set. Checksums are stored as
+   "checksum" records, along with whatever didn't match. Run as a script,
+   this compares the checksums of every query across engines, taking the
+   local engine's as the reference if there is one and otherwise the one
+   most engines agree on:
+
+     python verify.py results.jsonl
+"""
+
+import re
+import sys
+from optparse import OptionParser
+
+import queries
+import results_store
+
+# Scale factor of the data set the catalog's cardinalities were measured on
+CATALOG_SCALE_FACTOR = 5
+# Units of the cardinalities that are the number of rows of the result
+ROW_UNITS = ["results", "groups"]
+
+TOLERANCE = 1e-6
+
+# A checksum as the Hive, Shark and Impala (-B) CLIs print it
+NUMBER = r"-?\d[\d.]*(?:[eE][+-]?\d+)?"
+CHECKSUM_ROW = re.compile(r"^\s*%s(?:\s+(?:%s|NULL))*\s*$" % (NUMBER, NUMBER))
+
+def checksum_statement(query_num, dialect):
+  """Statement computing the checksum of a query's result table."""
+  table, columns = queries.result_table(query_num, dialect)
+  sums = ["SUM(LENGTH(%s))" % name if kind == "string" else "SUM(%s)" % name
+          for name, kind in columns]
+  return "SELECT COUNT(*), %s FROM %s;" % (", ".join(sums), table)
+
+def _value(text):
+  if text == "NULL":
+    return None
+  try:
+    return int(text)
+  except ValueError:
+    return float(text)
+
+def parse_checksum(lines):
+  """The checksum in the output of a CLI, or None if it printed none."""
+  rows = [line for line in lines if CHECKSUM_ROW.match(line)]
+  if not rows:
+    return None
+  return [_value(v) for v in rows[-1].split()]
+
+def fetched_checksum(row):
+  """A checksum fetched through a DB-API cursor, as plain numbers."""
+  return [v if v is None or isinstance(v, (int, long)) else float(v)
+          for v in row]
+
+def row_checksum(query_num, rows):
+  """The checksum of result rows held locally, e.g. by local_engine.py."""
+  table, columns = queries.result_table(query_num, "hql")
+  checksum = [len(rows)]
+  for i, (name, kind) in enumerate(columns):
+    if kind == "string":
+      checksum.append(sum(len(row[i]) for row in rows))
+    else:
+      checksum.append(sum(row[i] for row in rows))
+  return checksum
+
+# Whether two checksums agree. SUM() of no rows is NULL.
+def same(a, b, tolerance=TOLERANCE):
+  if a is None or b is None or len(a) != len(b):
+    return False
+  for x, y in zip(a, b):
+    x, y = x or 0, y or 0
+    if abs(x - y) > tolerance * max(abs(x), abs(y)):
+      return False
+  return True
+
+def expected_rows(query_num, scale_factor):
+  """Rows the catalog expects in the result of a query, or None."""
+  family, value, cardinality = queries.QUERY_INFO[query_num]
+  if scale_factor != CATALOG_SCALE_FACTOR or family not in queries.FAMILIES:
+    return None
+  if queries.FAMILIES[family].cardinality_unit not in ROW_UNITS:
+    return None
+  return cardinality
+
+def check(query_num, checksum, scale_factor):
+  """What is wrong with a query's checksum, as a list of messages."""
+  if checksum is None:
+    return ["no checksum was computed"]
+  expected = expected_rows(query_num, scale_factor)
+  if expected is not None and checksum[0] != expected:
+    return ["%s rows, the catalog expects %s" % (checksum[0], expected)]
+  return []
+
+def _format(checksum):
+  return checksum is None and "none" or ", ".join(str(v) for v in checksum)
+
+def report(records, out):
+  """Print the engines whose checksum of a query differs from the
+     reference. Returns how many did."""
+  mismatches = 0
+  groups = results_store.group(records, "scale_factor", "query")
+  for (scale_factor, query_num), group in sorted(groups.items()):
+    latest = {}
+    for r in sorted(group, key=lambda r: r["timestamp"]):
+      latest[r["engine"]] = r["checksum"]
+    if len(latest) < 2:
+      continue
+    reference = [e for e in latest if e.startswith("local")]
+    if reference:
+      reference_engine = reference[0]
+    else:
+      reference_engine = max(sorted(latest), key=lambda e: len(
+        [o for o in latest if same(latest[o], latest[e])]))
+    expected = latest[reference_engine]
+    for engine, checksum in sorted(latest.items()):
+      if not same(checksum, expected):
+        mismatches += 1
+        print >> out, "Query %s, scale factor %s: %s has %s, %s has %s" % (
+          query_num, scale_factor, engine, _format(checksum),
+          reference_engine, _format(expected))
+  return mismatches
+
+def parse_args():
+  parser = OptionParser(usage="verify.py [options] STORE...")
+  parser.add_option("--engine", action="append",
+      help="Only include this engine (may be repeated)")
+  parser.add_option("--query", action="append",
+      help="Only include this query (may be repeated)")
+  (opts, args) = parser.parse_args()
+  if not args:
+    parser.print_help()
+    sys.exit(1)
+  return opts, args
+
+def main():
+  opts, paths = parse_args()
+  filters = {"kind": "checksum"}
+  if opts.engine:
+    filters["engine"] = opts.engine
+  if opts.query:
+    filters["query"] = opts.query
+  records = list(results_store.load(paths, **filters))
+  mismatches = report(records, sys.stdout)
+  print "%d mismatch(es)" % mismatches
+  return mismatches and 1 or 0
+
+if __name__ == "__main__":
+  sys.exit(main())